@@ -1,6 +1,6 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
-from .models import CustomUser, ChatMessage, Server, Stat
+from .models import CustomUser, ChatMessage, ArchivedMessage, Attachment, UploadSession, MessageChange, ReadMarker, Server, Stat
 
 # Создание кастомного интерфейса для CustomUser
 class CustomUserAdmin(UserAdmin):
@@ -23,5 +23,10 @@ class CustomUserAdmin(UserAdmin):
 # Регистрируем модель CustomUser с кастомным интерфейсом
 admin.site.register(CustomUser, CustomUserAdmin)
 admin.site.register(ChatMessage)
+admin.site.register(ArchivedMessage)
+admin.site.register(Attachment)
+admin.site.register(UploadSession)
+admin.site.register(MessageChange)
+admin.site.register(ReadMarker)
 admin.site.register(Server)
 admin.site.register(Stat)
\ No newline at end of file
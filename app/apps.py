@@ -1,6 +1,19 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
 
 
 class AppConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'app'
+
+    def ready(self):
+        from project.database import tune_sqlite
+        from .metrics import install_query_timer
+        from .caching import connect_counter_signals
+        from .authentication import connect_token_signals
+        from .receipts import connect_receipt_signals
+        connection_created.connect(tune_sqlite, dispatch_uid='tune_sqlite')
+        connection_created.connect(install_query_timer, dispatch_uid='install_query_timer')
+        connect_counter_signals()
+        connect_token_signals()
+        connect_receipt_signals()
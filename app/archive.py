@@ -0,0 +1,96 @@
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from .models import ChatMessage, ArchivedMessage
+from .caching import invalidate_counters
+from .receipts import bump_generation
+
+HISTORY_PAGE_SIZE = 100
+
+
+def archive_messages(older_than_days, batch_size=1000):
+    """Переносит сообщения старше older_than_days дней в ArchivedMessage пачками.
+
+    Каждая пачка переносится в своей транзакции, чтобы не держать блокировку
+    базы на всё время архивации. Возвращает количество перенесённых сообщений.
+    """
+    cutoff = timezone.now() - timedelta(days=older_than_days)
+    moved = 0
+    while True:
+        with transaction.atomic():
+            batch = list(
+                ChatMessage.objects.filter(created_at__lt=cutoff).order_by('created_at', 'id')[:batch_size]
+            )
+            if not batch:
+                break
+            archived = ArchivedMessage.objects.bulk_create(
+                [
+                    ArchivedMessage(
+                        id=msg.id, user_id=msg.user_id, text=msg.text,
+                        created_at=msg.created_at, attachment_id=msg.attachment_id,
+                        version=msg.version, edited_at=msg.edited_at, deleted_at=msg.deleted_at,
+                        reply_to_id=msg.reply_to_id, reply_preview=msg.reply_preview,
+                    )
+                    # Надгробия тоже: клиент, догоняющий журнал правок, должен узнать об удалении
+                    for msg in batch
+                ],
+                ignore_conflicts=True,
+            )
+            ChatMessage.objects.filter(id__in=[msg.id for msg in batch]).delete()
+        moved += len(archived)
+    if moved:
+        invalidate_counters('messages')  # счётчик на главной считает только горячую таблицу
+        bump_generation()  # непрочитанные тоже
+    return moved
+
+
+def hot_history(before=None):
+    hot = (
+        ChatMessage.objects.filter(deleted_at__isnull=True)
+        .select_related('user', 'attachment')
+        .order_by('-created_at', '-id')
+    )
+    if before is not None:
+        hot = hot.filter(id__lt=before)
+    return hot
+
+
+def cold_history(oldest=None):
+    cold = (
+        ArchivedMessage.objects.filter(deleted_at__isnull=True)
+        .select_related('user', 'attachment')
+        .order_by('-created_at', '-id')
+    )
+    if oldest is not None:
+        cold = cold.filter(id__lt=oldest)
+    return cold
+
+
+def needs_archive(messages, before, limit):
+    return len(messages) < limit and (before is not None or not messages)
+
+
+def message_history(before=None, limit=HISTORY_PAGE_SIZE):
+    """Страница истории (новые первыми) с сообщениями строго до id=before.
+
+    Сначала читается горячая таблица; архив затрагивается только при
+    листании назад (before), когда горячая таблица до before закончилась.
+    Первая страница читает архив, лишь если горячая таблица пуста: небольшая
+    или только что очищенная архивацией таблица не тянет за собой архив.
+    """
+    messages = list(hot_history(before)[:limit])
+    if needs_archive(messages, before, limit):
+        oldest = messages[-1].id if messages else before
+        messages.extend(cold_history(oldest)[:limit - len(messages)])
+    return messages
+
+
+async def amessage_history(before=None, limit=HISTORY_PAGE_SIZE):
+    """message_history для async-представлений (async ORM, без перехода в поток)"""
+    messages = [message async for message in hot_history(before)[:limit]]
+    if needs_archive(messages, before, limit):
+        oldest = messages[-1].id if messages else before
+        messages.extend([message async for message in cold_history(oldest)[:limit - len(messages)]])
+    return messages
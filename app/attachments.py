@@ -0,0 +1,215 @@
+"""
+Вложения: загрузка по частям с докачкой и хранилище по содержимому.
+
+Клиент открывает UploadSession, затем шлёт куски в теле PUT с заголовком
+Upload-Offset. Каждый кусок пишется на диск потоком блоками по
+ATTACHMENT_IO_BLOCK, файл целиком в памяти не держится. После обрывов клиент
+спрашивает у сессии received и продолжает с этого места. Готовый файл
+хэшируется (SHA-256) и переносится в attachments/<aa>/<bb>/<sha256>; если
+такой файл уже есть, копия удаляется - одинаковые вложения хранятся один раз.
+
+Кусок больше ATTACHMENT_CHUNK_SIZE отклоняется: ASGI-обработчик принимает
+тело запроса целиком до вызова представления. Брошенные сессии вместе с их
+.part-файлами удаляет cleanup_uploads (команда cleanup_uploads).
+
+Скачивание отдаётся асинхронным генератором (aiter_file): под ASGI
+синхронный итератор ответа Django сначала собирает в список целиком.
+"""
+
+import asyncio
+import hashlib
+import os
+import re
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Attachment, UploadSession
+
+# Размер блока чтения/записи при потоковой обработке
+ATTACHMENT_IO_BLOCK = 64 * 1024
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class UploadError(Exception):
+    """Ошибка загрузки; status - HTTP-код ответа"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def attachments_root():
+    return getattr(settings, 'ATTACHMENT_ROOT', os.path.join(settings.MEDIA_ROOT, 'attachments'))
+
+
+def blob_path(sha256):
+    return os.path.join(attachments_root(), sha256[:2], sha256[2:4], sha256)
+
+
+def part_path(session):
+    return os.path.join(attachments_root(), 'uploads', f"{session.id}.part")
+
+
+def start_upload(user, filename, size, content_type=None):
+    max_size = getattr(settings, 'ATTACHMENT_MAX_SIZE', 100 * 1024 * 1024)
+    if size <= 0:
+        raise UploadError("size must be positive")
+    if size > max_size:
+        raise UploadError(f"file is larger than {max_size} bytes", status=413)
+    session = UploadSession.objects.create(
+        user=user,
+        filename=os.path.basename(filename)[:255] or 'file',
+        content_type=content_type or 'application/octet-stream',
+        size=size,
+    )
+    os.makedirs(os.path.dirname(part_path(session)), exist_ok=True)
+    open(part_path(session), 'wb').close()
+    return session
+
+
+def write_chunk(session, offset, stream, length):
+    """Дописывает length байт из stream с позиции offset, возвращает новый received.
+
+    Кусок принимается только с текущей позиции сессии: повторно присланный
+    или пропущенный кусок отклоняется с 409, клиент докачивает с received.
+    """
+    if offset != session.received:
+        raise UploadError(f"expected offset {session.received}", status=409)
+    if length is None or length <= 0:
+        raise UploadError("empty chunk")
+    if length > settings.ATTACHMENT_CHUNK_SIZE:
+        raise UploadError(f"chunk is larger than {settings.ATTACHMENT_CHUNK_SIZE} bytes", status=413)
+    if offset + length > session.size:
+        raise UploadError("chunk goes past the declared size", status=416)
+
+    written = 0
+    with open(part_path(session), 'r+b') as f:
+        f.seek(offset)
+        while written < length:
+            block = stream.read(min(ATTACHMENT_IO_BLOCK, length - written))
+            if not block:
+                break
+            f.write(block)
+            written += len(block)
+        # Оборванный кусок не учитываем: хвост перезапишет следующая попытка
+        f.truncate(offset + written)
+
+    # Условное обновление: параллельная запись того же куска не продвинет сессию дважды
+    updated = UploadSession.objects.filter(pk=session.pk, received=offset).update(received=offset + written)
+    if not updated:
+        raise UploadError("concurrent upload to the same session", status=409)
+    session.received = offset + written
+    return session.received
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(ATTACHMENT_IO_BLOCK), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def finish_upload(session):
+    """Переносит полностью загруженный файл в хранилище и создаёт Attachment"""
+    path = part_path(session)
+    sha256 = file_sha256(path)
+    target = blob_path(sha256)
+    if os.path.exists(target):
+        os.remove(path)  # такой файл уже хранится
+    else:
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.replace(path, target)
+
+    with transaction.atomic():
+        attachment = Attachment.objects.create(
+            user_id=session.user_id,
+            sha256=sha256,
+            size=session.size,
+            filename=session.filename,
+            content_type=session.content_type,
+        )
+        session.delete()
+    return attachment
+
+
+def attachment_data(attachment):
+    """Ссылка на вложение для API и WebSocket (без содержимого)"""
+    if attachment is None:
+        return None
+    return {
+        "id": attachment.id,
+        "filename": attachment.filename,
+        "size": attachment.size,
+        "content_type": attachment.content_type,
+        "sha256": attachment.sha256,
+    }
+
+
+def parse_range(header, size):
+    """Заголовок Range -> (start, end) включительно; None - отдать файл целиком.
+
+    Поддерживается один диапазон: bytes=a-b, bytes=a-, bytes=-n.
+    """
+    if not header:
+        return None
+    match = RANGE_RE.match(header.strip())
+    if not match or match.groups() == ('', ''):
+        return None  # несколько диапазонов и прочее не поддерживаем - весь файл
+    first, last = match.groups()
+    if first == '':
+        start, end = max(0, size - int(last)), size - 1
+    else:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise RangeNotSatisfiable()
+    return start, end
+
+
+async def aiter_file(path, start, length):
+    """length байт файла с позиции start блоками; чтение с диска - в потоке"""
+    f = await asyncio.to_thread(open, path, 'rb')
+    try:
+        await asyncio.to_thread(f.seek, start)
+        while length > 0:
+            block = await asyncio.to_thread(f.read, min(ATTACHMENT_IO_BLOCK, length))
+            if not block:
+                break
+            length -= len(block)
+            yield block
+    finally:
+        f.close()
+
+
+def cleanup_uploads(max_age=None):
+    """Удаляет незавершённые загрузки старше max_age секунд и их .part-файлы.
+
+    Заодно убирает .part-файлы без сессии (например, сессия удалена вместе с
+    пользователем). Возвращает число удалённых файлов.
+    """
+    max_age = settings.ATTACHMENT_UPLOAD_TTL if max_age is None else max_age
+    stale = UploadSession.objects.filter(created_at__lt=timezone.now() - timedelta(seconds=max_age))
+    stale.delete()
+
+    uploads = os.path.join(attachments_root(), 'uploads')
+    if not os.path.isdir(uploads):
+        return 0
+    alive = {f"{pk}.part" for pk in UploadSession.objects.values_list('pk', flat=True)}
+    removed = 0
+    deadline = time.time() - max_age
+    for entry in os.scandir(uploads):
+        # Свежий файл без сессии может принадлежать сессии, созданной прямо сейчас
+        if entry.name not in alive and entry.stat().st_mtime < deadline:
+            os.remove(entry.path)
+            removed += 1
+    return removed
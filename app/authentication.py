@@ -0,0 +1,204 @@
+"""
+Аутентификация по токену с кэшем.
+
+Клиент присылает токен в каждом запросе, и TokenAuthentication на каждый
+запрос делал JOIN Token + User. Здесь результат проверки хранится в памяти
+процесса (TokenCache): не дольше TOKEN_CACHE_TTL секунд и не больше
+TOKEN_CACHE_MAX_ENTRIES записей. Удаление токена и любое изменение
+пользователя (в том числе деактивация) сразу убирают его записи из кэша
+этого процесса; в других процессах они живут не дольше TTL.
+
+TOKEN_EXPIRY_DAYS ограничивает срок жизни токена: просроченный токен
+отклоняется, новый выдают /api-token-auth/ и /api/token/rotate/.
+
+DRF не поддерживает async-представления, поэтому async-представления
+(app/views.py) проверяют заголовок "Authorization: Token <key>" через
+aauthenticate_token - тем же кэшем и с тем же форматом ответа 401.
+WebSocket проверяется так же, один раз при подключении (TokenAuthMiddleware).
+"""
+
+import copy
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+from urllib.parse import parse_qs
+
+from channels.middleware import BaseMiddleware
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.db.models.signals import post_delete, post_save
+from django.http import JsonResponse
+from django.utils import timezone
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+TOKEN_KEYWORD = 'Token'
+# WebSocket: "Sec-WebSocket-Protocol: token, <key>" (браузерам недоступны заголовки)
+TOKEN_SUBPROTOCOL = 'token'
+
+
+class TokenCache:
+    """LRU-кэш ключ токена -> (пользователь, время создания токена) с TTL"""
+
+    def __init__(self, ttl=60, max_entries=10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = OrderedDict()  # ключ -> (пользователь, created, истекает)
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry[2] < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+        # Копия: представление может менять request.user, кэш от этого не страдает
+        return copy.copy(entry[0]), entry[1]
+
+    def set(self, key, user, created):
+        with self.lock:
+            self.entries[key] = (user, created, time.monotonic() + self.ttl)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def invalidate_user(self, user_id):
+        with self.lock:
+            for key in [key for key, entry in self.entries.items() if entry[0].pk == user_id]:
+                del self.entries[key]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+token_cache = TokenCache(
+    ttl=getattr(settings, 'TOKEN_CACHE_TTL', 60),
+    max_entries=getattr(settings, 'TOKEN_CACHE_MAX_ENTRIES', 10000),
+)
+
+
+def token_expired(created):
+    days = getattr(settings, 'TOKEN_EXPIRY_DAYS', None)
+    return days is not None and created < timezone.now() - timedelta(days=days)
+
+
+def check_token(user, created):
+    """Пользователь, если токен действителен, иначе AuthenticationFailed"""
+    if not user.is_active:
+        raise exceptions.AuthenticationFailed('User inactive or deleted.')
+    if token_expired(created):
+        raise exceptions.AuthenticationFailed('Token has expired.')
+    return user
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """TokenAuthentication без запроса к БД для токенов из кэша"""
+
+    def authenticate_credentials(self, key):
+        cached = token_cache.get(key)
+        if cached is None:
+            try:
+                token = Token.objects.select_related('user').get(key=key)
+            except Token.DoesNotExist:
+                raise exceptions.AuthenticationFailed('Invalid token.')
+            cached = (token.user, token.created)
+            token_cache.set(key, *cached)
+        user = check_token(*cached)
+        return user, key
+
+
+def token_key(request):
+    """Ключ из заголовка Authorization или None"""
+    parts = request.headers.get('Authorization', '').split()
+    if len(parts) != 2 or parts[0] != TOKEN_KEYWORD:
+        return None
+    return parts[1]
+
+
+async def aauthenticate_key(key):
+    """Активный пользователь по ключу токена или None (async, через тот же кэш)"""
+    cached = token_cache.get(key)
+    if cached is None:
+        try:
+            token = await Token.objects.select_related('user').aget(key=key)
+        except Token.DoesNotExist:
+            return None
+        cached = (token.user, token.created)
+        token_cache.set(key, *cached)
+    try:
+        return check_token(*cached)
+    except exceptions.AuthenticationFailed:
+        return None
+
+
+async def aauthenticate_token(request):
+    """Активный пользователь по заголовку Authorization или None"""
+    key = token_key(request)
+    if key is None:
+        return None
+    return await aauthenticate_key(key)
+
+
+def rotate_token(user):
+    """Удаляет текущий токен пользователя и выдаёт новый"""
+    Token.objects.filter(user=user).delete()
+    return Token.objects.create(user=user)
+
+
+def unauthorized():
+    response = JsonResponse({"detail": "Authentication credentials were not provided."}, status=401)
+    response['WWW-Authenticate'] = TOKEN_KEYWORD
+    return response
+
+
+def websocket_token(scope):
+    """(ключ, подпротокол для ответа) из подпротокола или ?token=; (None, None), если нет"""
+    subprotocols = scope.get("subprotocols") or []
+    if len(subprotocols) >= 2 and subprotocols[0] == TOKEN_SUBPROTOCOL:
+        return subprotocols[1], TOKEN_SUBPROTOCOL
+    query = parse_qs(scope.get("query_string", b"").decode("latin-1"))
+    if query.get("token"):
+        return query["token"][0], None
+    return None, None
+
+
+class TokenAuthMiddleware(BaseMiddleware):
+    """Аутентификация WebSocket один раз при рукопожатии: scope["user"] по токену.
+
+    Неверный или отсутствующий токен даёт AnonymousUser - решение о том,
+    пускать ли такой сокет, принимает consumer (до accept()).
+    """
+
+    async def __call__(self, scope, receive, send):
+        key, subprotocol = websocket_token(scope)
+        user = await aauthenticate_key(key) if key else None
+        scope = dict(scope, user=user or AnonymousUser(), auth_subprotocol=subprotocol)
+        return await super().__call__(scope, receive, send)
+
+
+def on_token_deleted(sender, instance, **kwargs):
+    token_cache.invalidate(instance.key)
+
+
+def on_user_saved(sender, instance, **kwargs):
+    # Деактивация, смена имени и т.п.: кэшированный объект пользователя устарел
+    token_cache.invalidate_user(instance.pk)
+
+
+def connect_token_signals():
+    """Вызывается из AppConfig.ready()"""
+    from .models import CustomUser
+
+    post_delete.connect(on_token_deleted, sender=Token, dispatch_uid='token_cache_token_deleted')
+    post_save.connect(on_user_saved, sender=CustomUser, dispatch_uid='token_cache_user_saved')
+    post_delete.connect(on_user_saved, sender=CustomUser, dispatch_uid='token_cache_user_deleted')
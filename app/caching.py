@@ -0,0 +1,124 @@
+"""
+Кэш страниц и счётчиков сайта.
+
+Маркетинговые страницы одинаковы для всех, кроме шапки (Войти/Профиль),
+поэтому страница кэшируется целиком по ключу (путь, вошёл ли пользователь).
+Страницы со статистикой дополнительно включают в ключ значения счётчиков:
+новый пользователь или сообщение меняют ключ, и старая копия просто
+перестаёт использоваться, отдельная инвалидация не нужна.
+
+Счётчики пользователей и сообщений тоже живут в кэше: при создании объекта
+они увеличиваются на месте (cache.incr), без COUNT(*) по таблице. В кэше
+каждого процесса (LocMemCache) счётчики могут отставать от изменений,
+сделанных другими процессами, не дольше SITE_COUNTERS_TIMEOUT секунд.
+"""
+
+import functools
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save
+
+COUNTER_KEYS = {
+    'users': 'site:users',
+    'messages': 'site:messages',
+}
+
+
+def counter_queryset(name):
+    from .models import ChatMessage, CustomUser
+
+    if name == 'users':
+        return CustomUser.objects.all()
+    return ChatMessage.objects.filter(deleted_at__isnull=True)  # без надгробий
+
+
+def site_counters():
+    """{'users': ..., 'messages': ...}; пересчитываются только отсутствующие в кэше"""
+    cached = cache.get_many(COUNTER_KEYS.values())
+    counters = {}
+    for name, key in COUNTER_KEYS.items():
+        if key in cached:
+            counters[name] = cached[key]
+            continue
+        counters[name] = counter_queryset(name).count()
+        cache.add(key, counters[name], settings.SITE_COUNTERS_TIMEOUT)
+    return counters
+
+
+async def asite_counters():
+    """site_counters для async-представлений"""
+    cached = await cache.aget_many(COUNTER_KEYS.values())
+    counters = {}
+    for name, key in COUNTER_KEYS.items():
+        if key in cached:
+            counters[name] = cached[key]
+            continue
+        counters[name] = await counter_queryset(name).acount()
+        await cache.aadd(key, counters[name], settings.SITE_COUNTERS_TIMEOUT)
+    return counters
+
+
+def adjust_counter(name, delta):
+    try:
+        cache.incr(COUNTER_KEYS[name], delta)
+    except ValueError:
+        pass  # счётчика нет в кэше - будет посчитан при следующем чтении
+
+
+def invalidate_counters(*names):
+    cache.delete_many([COUNTER_KEYS[name] for name in names or COUNTER_KEYS])
+
+
+def cached_page(timeout=None, counters=()):
+    """Кэширует ответ 200 на GET по (путь, вошёл ли пользователь, значения counters)"""
+
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return view(request, *args, **kwargs)
+
+            parts = [view.__name__, request.get_full_path(), str(request.user.is_authenticated)]
+            if counters:
+                values = site_counters()
+                parts.extend(str(values[name]) for name in counters)
+            key = 'page:' + hashlib.md5('|'.join(parts).encode()).hexdigest()
+
+            response = cache.get(key)
+            if response is None:
+                response = view(request, *args, **kwargs)
+                if response.status_code == 200 and not response.cookies:
+                    cache.set(key, response, settings.PAGE_CACHE_TIMEOUT if timeout is None else timeout)
+            return response
+
+        return wrapper
+
+    return decorator
+
+
+def on_created(counter):
+    def receiver(sender, instance=None, created=False, **kwargs):
+        if created:
+            adjust_counter(counter, 1)
+    return receiver
+
+
+def on_user_deleted(sender, **kwargs):
+    # Вместе с пользователем каскадно удаляются его сообщения
+    invalidate_counters('users', 'messages')
+
+
+def connect_counter_signals():
+    """Вызывается из AppConfig.ready()"""
+    from .models import ChatMessage, CustomUser
+
+    post_save.connect(on_created('users'), sender=CustomUser, weak=False, dispatch_uid='site_counter_users_add')
+    post_delete.connect(on_user_deleted, sender=CustomUser, dispatch_uid='site_counter_users_del')
+    # На удаление сообщений не подписываемся: обработчик post_delete лишил бы
+    # QuerySet.delete() быстрого пути (архивация). Удаляющий код сам вызывает
+    # invalidate_counters('messages').
+    post_save.connect(
+        on_created('messages'), sender=ChatMessage, weak=False, dispatch_uid='site_counter_messages_add',
+    )
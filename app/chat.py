@@ -0,0 +1,173 @@
+"""
+Сохранение сообщений чата пачкой.
+
+Кадр клиента - одно сообщение или batch (очередь после переподключения,
+боты, импорт) - проверяется и сохраняется целиком: вложения, родители
+ответов и уже сохранённые ключи идемпотентности читаются одним запросом на
+пачку, сами сообщения пишутся одним bulk_create. Рассылается пачка тоже
+одним событием channel layer (ChatConsumer.chat_messages).
+
+bulk_create не отправляет post_save, поэтому счётчики сайта и поколение
+непрочитанных обновляются здесь же.
+"""
+
+import logging
+
+from django.db import IntegrityError, transaction
+from django.contrib.auth import get_user_model
+
+from .attachments import attachment_data
+from .caching import adjust_counter
+from .models import Attachment, ChatMessage
+from .receipts import bump_generation
+from .replies import find_reply_parents
+
+logger = logging.getLogger(__name__)
+User = get_user_model()
+
+CLIENT_ID_MAX_LENGTH = 64  # ChatMessage.client_id
+BATCH_MAX_MESSAGES = 500  # Сообщений в одном кадре batch, остальные отбрасываются
+
+
+def clean_client_id(value):
+    if isinstance(value, str) and 0 < len(value) <= CLIENT_ID_MAX_LENGTH:
+        return value
+    return None
+
+
+def clean_id(value):
+    """id вложения или родителя из кадра: только целое число"""
+    return value if isinstance(value, int) and not isinstance(value, bool) else None
+
+
+def save_messages(user, items):
+    """Сохраняет пачку; возвращает (созданные сообщения, client_id, с которыми закончено).
+
+    user - пользователь сокета; None - устаревший клиент без токена, автор
+    берётся из поля user каждого сообщения. Закончено - значит сохранено,
+    уже было сохранено раньше или отклонено навсегда: клиенту незачем
+    отправлять такое сообщение повторно.
+    """
+    done = []
+    candidates = []
+    seen = set()
+    for data in items[:BATCH_MAX_MESSAGES]:
+        if not isinstance(data, dict):
+            continue
+        client_id = clean_client_id(data.get("client_id"))
+        text = data.get("text") or ""
+        if not isinstance(text, str) or (not text and not data.get("attachment")):
+            logger.warning("⚠️ [WS] Пустое сообщение от %s", data.get("user"), extra={"event": "empty_message"})
+            done.append(client_id)
+            continue
+        if client_id is not None:
+            if client_id in seen:
+                continue  # тот же ключ дважды в одной пачке
+            seen.add(client_id)
+        candidates.append((data, client_id, text))
+    if not candidates:
+        return [], done
+
+    if user is not None:
+        authors = {None: user}
+    else:
+        # 🔍 Устаревший клиент без токена: все авторы пачки одним запросом
+        names = {data.get("user") for data, _, _ in candidates}
+        authors = {author.username: author for author in User.objects.filter(username__in=names)}
+
+    def author_of(data):
+        return authors.get(None if user is not None else data.get("user"))
+
+    client_ids = [client_id for _, client_id, _ in candidates if client_id]
+    existing = set()
+    if client_ids:
+        existing = set(
+            ChatMessage.objects.filter(user__in=list(authors.values()), client_id__in=client_ids)
+            .values_list('user_id', 'client_id')
+        )
+    attachment_ids = {clean_id(data.get("attachment")) for data, _, _ in candidates} - {None}
+    attachments = Attachment.objects.in_bulk(attachment_ids) if attachment_ids else {}
+    reply_ids = {clean_id(data.get("reply_to")) for data, _, _ in candidates} - {None}
+    previews = find_reply_parents(reply_ids) if reply_ids else {}
+
+    messages = []
+    for data, client_id, text in candidates:
+        author = author_of(data)
+        if author is None:
+            logger.error("❌ Ошибка: Пользователь '%s' не найден в базе!", data.get("user"))
+            done.append(client_id)
+            continue
+        if client_id and (author.id, client_id) in existing:
+            done.append(client_id)  # повтор из очереди клиента
+            continue
+
+        # 📎 По сокету идёт только ссылка на уже загруженное вложение (/api/uploads/)
+        attachment = None
+        if data.get("attachment"):
+            attachment = attachments.get(clean_id(data["attachment"]))
+            if attachment is None or attachment.user_id != author.id:
+                logger.warning("⚠️ [WS] Чужое или несуществующее вложение %s от %s", data["attachment"], author)
+                done.append(client_id)
+                continue
+
+        # ↩️ Превью родителя считается один раз здесь и хранится в ответе
+        reply_preview = None
+        if data.get("reply_to"):
+            reply_preview = previews.get(clean_id(data["reply_to"]))
+            if reply_preview is None:
+                logger.warning("⚠️ [WS] Ответ на несуществующее сообщение %s от %s", data["reply_to"], author)
+                done.append(client_id)
+                continue
+
+        messages.append(ChatMessage(
+            user=author,
+            text=text,
+            attachment=attachment,
+            reply_to_id=reply_preview and reply_preview["id"],
+            reply_preview=reply_preview,
+            client_id=client_id,
+        ))
+
+    if not messages:
+        return [], done
+    try:
+        with transaction.atomic():
+            ChatMessage.objects.bulk_create(messages)
+    except IntegrityError:
+        # Гонка за ключ: часть ключей только что сохранила другая вкладка.
+        # Повторяем по одному только то, что уже прошло проверки выше
+        messages = save_one_by_one(messages, done)
+    if messages:
+        adjust_counter('messages', len(messages))
+        bump_generation()
+    done.extend(message.client_id for message in messages)
+    return messages, done
+
+
+def save_one_by_one(messages, done):
+    """Сохраняет сообщения по одному; уже сохранённые ключи - в done. Возвращает созданные"""
+    created = []
+    for message in messages:
+        message.pk = None  # id мог остаться от откаченного bulk_create
+        try:
+            with transaction.atomic():
+                ChatMessage.objects.bulk_create([message])  # без post_save, как и вся пачка
+        except IntegrityError:
+            done.append(message.client_id)
+            continue
+        created.append(message)
+    return created
+
+
+def broadcast_data(message):
+    """Событие рассылки для ChatConsumer (без обращений к БД)"""
+    return {
+        "id": message.id,
+        "username": message.user.username,
+        "message": message.text,
+        "created_at": message.created_at.strftime("%Y-%m-%d %H:%M:%S"),
+        "attachment": attachment_data(message.attachment),
+        "reply_to": message.reply_to_id,
+        "reply_preview": message.reply_preview,
+        "client_id": message.client_id,
+    }
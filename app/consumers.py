@@ -1,75 +1,192 @@
+import asyncio
 import json
 from channels.generic.websocket import AsyncWebsocketConsumer
-from django.contrib.auth import get_user_model
+from django.conf import settings
 import logging
-from datetime import datetime
-from .models import ChatMessage
-from asgiref.sync import sync_to_async
+from .chat import save_messages, broadcast_data, BATCH_MAX_MESSAGES
+from .metrics import event_timer, timed_sync_to_async
+from .presence import presence
+from .ephemeral import ephemeral, EPHEMERAL_TYPES
+from .receipts import receipts
 
-logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
-User = get_user_model()  # Берём модель пользователя
+logger = logging.getLogger(__name__)
+# События на каждое сообщение: семплируются фильтром из LOGGING (LOG_MESSAGE_SAMPLE_RATE)
+message_logger = logging.getLogger(__name__ + ".messages")
 
 class ChatConsumer(AsyncWebsocketConsumer):
+    connections = 0  # Активные подключения в этом процессе (для app.status)
+
     async def connect(self):
         """🔌 Подключение клиента к WebSocket"""
-        self.room_group_name = "global_chat"
-        await self.channel_layer.group_add(self.room_group_name, self.channel_name)
-        await self.accept()
-        logging.info(f"✅ Новый клиент подключился: {self.channel_name}")
+        self.accepted = False
+        self.presence_user = None
+        self.outgoing = []  # Кадры сообщений, ждущие окна склейки (WS_BROADCAST_WINDOW)
+        self.flush_task = None
+        # Пользователь определён по токену при рукопожатии (TokenAuthMiddleware)
+        user = self.scope.get("user")
+        self.user = user if user is not None and user.is_authenticated else None
+        if self.user is None and getattr(settings, 'WS_REQUIRE_AUTH', True):
+            logger.warning("⛔ WebSocket без токена отклонён", extra={"event": "reject"})
+            await self.close(code=4401)
+            return
+
+        with event_timer("connect"):
+            self.room_group_name = "global_chat"
+            await self.channel_layer.group_add(self.room_group_name, self.channel_name)
+            await self.accept(subprotocol=self.scope.get("auth_subprotocol"))
+            self.accepted = True
+            ChatConsumer.connections += 1
+            presence.ensure_started(self.channel_layer, self.room_group_name)
+            ephemeral.ensure_started(self.channel_layer, self.room_group_name)
+            receipts.ensure_started()
+            # Анонимный сокет (WS_REQUIRE_AUTH = False) попадёт в реестр с первым сообщением
+            if self.user is not None:
+                self.mark_online(self.user.username)
+        logger.info("✅ Новый клиент подключился: %s", self.channel_name, extra={"event": "connect"})
 
     async def disconnect(self, close_code):
         """❌ Отключение клиента"""
-        await self.channel_layer.group_discard(self.room_group_name, self.channel_name)
-        logging.info(f"❌ Клиент отключился: {self.channel_name}")
+        if not self.accepted:
+            return
+        with event_timer("disconnect"):
+            await self.channel_layer.group_discard(self.room_group_name, self.channel_name)
+            ChatConsumer.connections -= 1
+            if self.flush_task is not None:
+                self.flush_task.cancel()
+            if getattr(self, "presence_user", None):
+                presence.disconnect(self.presence_user)
+        logger.info("❌ Клиент отключился: %s", self.channel_name, extra={"event": "disconnect", "code": close_code})
+
+    def mark_online(self, username):
+        self.presence_user = username
+        presence.connect(username)
 
     async def receive(self, text_data):
         """📥 Прием сообщений от клиента"""
+        with event_timer("receive"):
+            await self._receive(text_data)
+
+    async def _receive(self, text_data):
         try:
             data = json.loads(text_data)
 
-            username = data.get("user", "Неизвестный")
-            message = data.get("text", "")
-
-            if not message:
-                logging.warning(f"⚠️ [WS] Пустое сообщение: {data}")
+            # ⌨️ Эфемерные события (печатает, прочитано): без БД, склеиваются по интервалу
+            if data.get("type") in EPHEMERAL_TYPES:
+                username = self.presence_user or data.get("user")
+                if username:
+                    ephemeral.push(data["type"], username, data)
+                # ✔️ Отметка о прочтении сохраняется пачкой раз в несколько секунд
+                if data["type"] == "read" and self.user is not None and isinstance(data.get("message_id"), int):
+                    receipts.ack(self.user.id, data["message_id"], self.room_group_name)
                 return
 
-            logging.info(f"📥 [SERVER] Получено сообщение: {data}")
+            # 📦 Пачка сообщений (очередь клиента, боты, импорт): один bulk_create и одна рассылка
+            if data.get("type") == "batch":
+                items = data.get("messages") or []
+            else:
+                items = [data]
+            if isinstance(items, list):
+                await self.handle_messages(items)
 
-            # 🔍 Ищем пользователя в базе
-            user = await sync_to_async(User.objects.get)(username=username)
+        except json.JSONDecodeError as e:
+            logger.error("❌ Ошибка декодирования JSON: %s", e)
+        except Exception as e:
+            # Без подтверждения: клиент повторит отправку после переподключения
+            logger.exception("❌ Ошибка при обработке сообщения: %s", e)
 
-            # 🕒 Создаём сообщение и сохраняем время
-            chat_message = await sync_to_async(ChatMessage.objects.create)(
-                user=user,
-                text=message
-            )
+    async def handle_messages(self, items):
+        """Сохраняет и рассылает сообщения кадра, подтверждает их client_id одним кадром ack"""
+        for data in items[:BATCH_MAX_MESSAGES]:
+            if isinstance(data, dict):
+                # Полезную нагрузку не логируем: только автор и размер
+                username = self.user.username if self.user else data.get("user")
+                message_logger.info(
+                    "📥 [SERVER] Получено сообщение от %s", username,
+                    extra={"event": "message", "user": username, "size": len(str(data.get("text") or ""))},
+                )
 
-            created_at = chat_message.created_at.strftime("%Y-%m-%d %H:%M:%S") if chat_message else "Неизвестное время"
+        if self.presence_user is None and items and isinstance(items[0], dict) and items[0].get("user"):
+            # Анонимный сокет (WS_REQUIRE_AUTH = False) попадает в реестр с первым сообщением
+            self.mark_online(items[0]["user"])
 
-            # 📡 Рассылаем сообщение всем клиентам
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
-                    "type": "chat_message",
-                    "username": username,
-                    "message": message,
-                    "created_at": created_at
-                }
-            )
-
-        except User.DoesNotExist:
-            logging.error(f"❌ Ошибка: Пользователь '{username}' не найден в базе!")
-        except json.JSONDecodeError as e:
-            logging.error(f"❌ Ошибка декодирования JSON: {str(e)}")
-        except Exception as e:
-            logging.error(f"❌ Ошибка при обработке сообщения: {str(e)}")
+        messages, done = await timed_sync_to_async(save_messages)(self.user, items)
+        if messages:
+            # 📡 Вся пачка - одним событием channel layer
+            await self.channel_layer.group_send(self.room_group_name, {
+                "type": "chat_messages",
+                "messages": [broadcast_data(message) for message in messages],
+            })
+        await self.send_ack(done)
 
+    async def send_ack(self, client_ids):
+        """✔️ Сообщения с этими ключами сохранены (или отклонены) - клиент убирает их из очереди"""
+        client_ids = [client_id for client_id in client_ids if client_id]
+        if client_ids:
+            await self.send(text_data=json.dumps({"type": "ack", "client_ids": client_ids}))
 
     async def chat_message(self, event):
-        """📤 Отправка сообщения всем клиентам"""
+        """📤 Одно сообщение - в буфер рассылки"""
+        await self.queue_outgoing([event])
+
+    async def chat_messages(self, event):
+        """📤 Пачка сообщений - в буфер рассылки"""
+        await self.queue_outgoing(event["messages"])
+
+    async def queue_outgoing(self, events):
+        """Сообщения, пришедшие в течение WS_BROADCAST_WINDOW, уходят клиенту одним кадром"""
+        self.outgoing.extend(
+            {
+                "id": event.get("id"),
+                "user": event["username"],
+                "text": event["message"],
+                "created_at": event["created_at"],
+                "attachment": event.get("attachment"),
+                "reply_to": event.get("reply_to"),
+                "reply_preview": event.get("reply_preview"),
+                "client_id": event.get("client_id")
+            }
+            for event in events
+        )
+        window = getattr(settings, 'WS_BROADCAST_WINDOW', 0.01)
+        if not window:
+            await self.flush_outgoing()
+        elif self.flush_task is None:
+            self.flush_task = asyncio.create_task(self.flush_outgoing_later(window))
+
+    async def flush_outgoing_later(self, window):
+        await asyncio.sleep(window)
+        await self.flush_outgoing()
+
+    async def flush_outgoing(self):
+        task, self.flush_task = self.flush_task, None
+        if task is not None and task is not asyncio.current_task():
+            task.cancel()
+        frames, self.outgoing = self.outgoing, []
+        if not frames:
+            return
+        with event_timer("chat_message"):
+            if len(frames) == 1:
+                await self.send(text_data=json.dumps(frames[0]))
+            else:
+                await self.send(text_data=json.dumps({"type": "batch", "messages": frames}))
+
+    async def message_delta(self, event):
+        """✏️ Правка или удаление сообщения (app/edits.py)"""
+        await self.flush_outgoing()  # Дельта не должна обогнать само сообщение
+        await self.send(text_data=json.dumps({"type": "delta", **event["delta"]}))
+
+    async def presence_update(self, event):
+        """👥 Пачка изменений присутствия"""
         await self.send(text_data=json.dumps({
-            "user": event["username"],
-            "text": event["message"],
-            "created_at": event["created_at"]
-        }))
\ No newline at end of file
+            "type": "presence",
+            "online": event["online"],
+            "offline": event["offline"],
+            "online_count": event["online_count"],
+        }))
+
+    async def ephemeral_batch(self, event):
+        """⌨️ Пачка эфемерных событий за интервал"""
+        # Свои события клиенту не нужны
+        events = [e for e in event["events"] if e["user"] != self.presence_user]
+        if events:
+            await self.send(text_data=json.dumps({"type": "ephemeral", "events": events}))
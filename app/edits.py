@@ -0,0 +1,105 @@
+"""
+Правка и удаление сообщений.
+
+Сообщение не удаляется из таблицы: у него очищаются текст и вложение и
+ставится deleted_at (надгробие), а version растёт с каждой правкой. Каждое
+изменение пишется в MessageChange; его id - курсор синхронизации: клиент,
+пропустивший события, запрашивает /api/messages/changes/?since=<курсор> и
+получает только итоговое состояние изменённых сообщений.
+
+Подключённым клиентам изменение рассылается компактной дельтой message_delta
+(id, версия и только изменившиеся поля), а не всем сообщением.
+"""
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .caching import adjust_counter
+from .models import ArchivedMessage, ChatMessage, MessageChange
+from .receipts import bump_generation
+from .replies import refresh_reply_previews
+
+CHAT_GROUP = "global_chat"
+CHANGES_PAGE_SIZE = 500
+
+
+class VersionConflict(Exception):
+    """Сообщение уже изменено: клиент правил устаревшую версию"""
+
+
+def message_delta(message):
+    """Компактное описание текущего состояния изменённого сообщения"""
+    if message.deleted_at is not None:
+        return {"id": message.id, "version": message.version, "deleted": True}
+    return {
+        "id": message.id,
+        "version": message.version,
+        "text": message.text,
+        "edited_at": message.edited_at.isoformat() if message.edited_at else None,
+    }
+
+
+def record_change(message, **fields):
+    """Применяет fields с проверкой версии, пишет журнал, рассылает дельту после коммита"""
+    with transaction.atomic():
+        updated = ChatMessage.objects.filter(pk=message.pk, version=message.version).update(
+            version=F('version') + 1, **fields,
+        )
+        if not updated:
+            raise VersionConflict()
+        message.refresh_from_db(fields=['version', *fields])
+        MessageChange.objects.create(message=message, version=message.version)
+        refresh_reply_previews(message)
+        delta = message_delta(message)
+        transaction.on_commit(lambda: broadcast_delta(delta))
+    return message
+
+
+def edit_message(message, text):
+    return record_change(message, text=text, edited_at=timezone.now())
+
+
+def delete_message(message):
+    record_change(message, text='', attachment=None, deleted_at=timezone.now())
+    adjust_counter('messages', -1)
+    bump_generation()
+    return message
+
+
+def broadcast_delta(delta):
+    channel_layer = get_channel_layer()
+    if channel_layer is not None:
+        async_to_sync(channel_layer.group_send)(CHAT_GROUP, {"type": "message_delta", "delta": delta})
+
+
+def current_cursor():
+    return MessageChange.objects.order_by('-id').values_list('id', flat=True).first() or 0
+
+
+def changes_since(cursor, limit=CHANGES_PAGE_SIZE):
+    """(дельты, новый курсор, есть ли ещё) - по одной дельте на сообщение.
+
+    Журнал не зависит от горячей таблицы: сообщение, уехавшее в архив, берётся
+    оттуда, а пропавшее совсем (удалено вместе с автором) отдаётся как удалённое.
+    """
+    changes = list(MessageChange.objects.filter(id__gt=cursor).order_by('id')[:limit + 1])
+    has_more = len(changes) > limit
+    changes = changes[:limit]
+    versions = {}
+    for change in changes:
+        versions[change.message_id] = change.version
+    # У всех записей уже итоговое состояние: читаем сами сообщения, а не записи журнала
+    messages = ChatMessage.objects.in_bulk(list(versions)) if versions else {}
+    missing = versions.keys() - messages.keys()
+    if missing:
+        messages.update(ArchivedMessage.objects.in_bulk(list(missing)))
+    deltas = [
+        message_delta(messages[message_id]) if message_id in messages
+        else {"id": message_id, "version": version, "deleted": True}
+        for message_id, version in versions.items()
+    ]
+    next_cursor = changes[-1].id if changes else cursor
+    return deltas, next_cursor, has_more
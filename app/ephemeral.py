@@ -0,0 +1,61 @@
+"""
+Эфемерные события чата (печатает, прочитано): не сохраняются в БД.
+
+Событие от клиента только перезаписывает последнее значение по ключу
+(тип, пользователь). Раз в EPHEMERAL_INTERVAL секунд все накопленные события
+уходят клиентам одним кадром ephemeral_batch, поэтому N нажатий клавиш
+превращаются не более чем в одну рассылку на пользователя за интервал.
+"""
+
+import asyncio
+import logging
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Тип события -> допустимые поля помимо type и user
+EPHEMERAL_TYPES = {
+    "typing": (),
+    "read": ("message_id",),
+}
+
+
+class EphemeralCoalescer:
+    def __init__(self, interval=0.5):
+        self.interval = interval
+        self.pending = {}  # (тип, пользователь) -> событие
+        self.room_group_name = None
+        self.task = None
+
+    def push(self, kind, user, data):
+        event = {"type": kind, "user": user}
+        for field in EPHEMERAL_TYPES[kind]:
+            event[field] = data.get(field)
+        self.pending[(kind, user)] = event
+
+    def drain(self):
+        pending, self.pending = self.pending, {}
+        return list(pending.values())
+
+    def ensure_started(self, channel_layer, room_group_name):
+        if self.task is None:
+            self.room_group_name = room_group_name
+            self.task = asyncio.create_task(self.flush_loop(channel_layer))
+
+    async def flush_loop(self, channel_layer):
+        while True:
+            await asyncio.sleep(self.interval)
+            events = self.drain()
+            if not events:
+                continue
+            try:
+                await channel_layer.group_send(self.room_group_name, {
+                    "type": "ephemeral_batch",
+                    "events": events,
+                })
+            except Exception:
+                logger.exception("❌ Ошибка рассылки эфемерных событий")
+
+
+ephemeral = EphemeralCoalescer(interval=getattr(settings, 'EPHEMERAL_INTERVAL', 0.5))
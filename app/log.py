@@ -0,0 +1,71 @@
+"""
+Асинхронное структурированное логирование (подключается через LOGGING в settings).
+
+Записи кладутся в очередь без форматирования; форматирование и вывод
+выполняет отдельный поток QueueListener, а не event loop Daphne.
+"""
+
+import atexit
+import json
+import logging
+import random
+from logging.handlers import QueueHandler, QueueListener
+from queue import SimpleQueue
+
+# Стандартные атрибуты LogRecord: всё остальное пришло через extra={...}
+RESERVED_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна запись - одна строка JSON; поля из extra попадают в неё как есть"""
+
+    def format(self, record):
+        entry = {
+            'ts': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in RESERVED_ATTRS:
+                entry[key] = value
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class SampleFilter(logging.Filter):
+    """Пропускает долю rate записей (для событий на каждое сообщение); WARNING и выше - всегда"""
+
+    def __init__(self, rate=1.0):
+        super().__init__()
+        self.rate = float(rate)
+
+    def filter(self, record):
+        return record.levelno >= logging.WARNING or random.random() < self.rate
+
+
+class QueueListenerHandler(QueueHandler):
+    """QueueHandler со своим QueueListener: вывод в stderr и, при необходимости, в файл"""
+
+    def __init__(self, filename=None, structured=True):
+        queue = SimpleQueue()
+        super().__init__(queue)
+
+        formatter = JsonFormatter() if structured else logging.Formatter(
+            "%(asctime)s - %(levelname)s - %(message)s"
+        )
+        targets = [logging.StreamHandler()]
+        if filename:
+            targets.append(logging.FileHandler(filename, encoding='utf-8'))
+        for target in targets:
+            target.setFormatter(formatter)
+
+        self.listener = QueueListener(queue, *targets, respect_handler_level=True)
+        self.listener.start()
+        atexit.register(self.listener.stop)
+
+    def prepare(self, record):
+        # Очередь внутри процесса, pickle не нужен: форматирование (getMessage)
+        # остаётся ленивым и выполняется в потоке слушателя
+        return record
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from app.archive import archive_messages
+
+
+class Command(BaseCommand):
+    help = "Переносит старые сообщения из ChatMessage в архив (ArchivedMessage)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=30, help="Архивировать сообщения старше N дней")
+        parser.add_argument('--batch-size', type=int, default=1000, help="Размер пачки на одну транзакцию")
+
+    def handle(self, *args, **options):
+        moved = archive_messages(options['days'], batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"📦 Перенесено в архив: {moved}"))
@@ -0,0 +1,18 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from app.attachments import cleanup_uploads
+
+
+class Command(BaseCommand):
+    help = "Удаляет брошенные загрузки вложений (UploadSession) и их .part-файлы"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--hours', type=float, default=settings.ATTACHMENT_UPLOAD_TTL / 3600,
+            help="Удалять загрузки, начатые больше N часов назад",
+        )
+
+    def handle(self, *args, **options):
+        removed = cleanup_uploads(int(options['hours'] * 3600))
+        self.stdout.write(self.style.SUCCESS(f"🧹 Удалено незавершённых загрузок: {removed}"))
@@ -0,0 +1,84 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from app.archive import hot_history, message_history
+from app.receipts import unread_state
+from app.replies import thread
+from app.models import ChatMessage, CustomUser
+
+
+# Проходы по CTE и подзапросу цепочки ответов ограничены её глубиной, а не размером таблиц
+DERIVED_TABLES = {'CONSTANT', 'thread', 'm'}
+
+
+def is_bad_step(step):
+    """Полный проход по таблице без индекса или сортировка во временном B-дереве"""
+    words = step.split()
+    if words[0] == 'SCAN' and words[1] in DERIVED_TABLES:
+        return False
+    if step.startswith('SCAN') and 'USING' not in step:
+        return True
+    return 'USE TEMP B-TREE' in step
+
+
+class Command(BaseCommand):
+    help = "Выполняет горячие запросы к ChatMessage и печатает их EXPLAIN QUERY PLAN"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', help="Имя пользователя для запросов профиля (по умолчанию первый)")
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help="Завершиться с ошибкой, если план содержит полный проход или сортировку",
+        )
+
+    def hot_queries(self, user):
+        """Запросы, которые выполняют представления на каждый запрос"""
+        last_id = ChatMessage.objects.order_by('-id').values_list('id', flat=True).first() or 0
+        return [
+            ("Лента сообщений (message_list_view)",
+             lambda: list(hot_history()[:100])),
+            ("Сообщения пользователя (profile_view)",
+             lambda: ChatMessage.objects.filter(user=user).count()),
+            ("Последние сообщения пользователя",
+             lambda: list(ChatMessage.objects.filter(user=user).order_by('-created_at')[:100])),
+            ("Листание истории в архив (message_history)",
+             lambda: message_history(before=1)),
+            ("Цепочка ответов (MessageThreadView)",
+             lambda: thread(last_id)),
+            ("Непрочитанные (UnreadView)",
+             lambda: unread_state(user.pk)),
+        ]
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError("EXPLAIN QUERY PLAN поддерживается только для SQLite")
+
+        if options['user']:
+            user = CustomUser.objects.filter(username=options['user']).first()
+            if user is None:
+                raise CommandError(f"Пользователь '{options['user']}' не найден")
+        else:
+            user = CustomUser.objects.order_by('pk').first() or CustomUser(pk=0)
+
+        problems = []
+        for title, run in self.hot_queries(user):
+            with CaptureQueriesContext(connection) as captured:
+                run()
+
+            for query in captured.captured_queries:
+                with connection.cursor() as cursor:
+                    cursor.execute(f"EXPLAIN QUERY PLAN {query['sql']}")
+                    plan = [row[-1] for row in cursor.fetchall()]
+
+                self.stdout.write(self.style.MIGRATE_HEADING(f"📊 {title}"))
+                self.stdout.write(f"   {query['sql']}")
+                for step in plan:
+                    bad = is_bad_step(step)
+                    if bad:
+                        problems.append(f"{title}: {step}")
+                    self.stdout.write(self.style.ERROR(f"   ❌ {step}") if bad else f"   ✅ {step}")
+
+        if problems and options['check']:
+            raise CommandError("Найдены запросы без индекса:\n" + "\n".join(problems))
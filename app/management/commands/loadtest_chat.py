@@ -0,0 +1,281 @@
+import asyncio
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import time
+import urllib.parse
+import urllib.request
+from datetime import datetime, timezone
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+
+from app.models import CustomUser
+from app.status import process_rss
+
+LOADTEST_PREFIX = "loadtest:"
+LOADTEST_PASSWORD = "loadtest-password"
+
+
+def percentile(values, fraction):
+    """Перцентиль по отсортированному списку (nearest-rank)"""
+    if not values:
+        return None
+    index = min(len(values) - 1, max(0, int(round(fraction * len(values))) - 1))
+    return values[index]
+
+
+class LoadStats:
+    """Общая статистика всех клиентов одного прогона"""
+
+    def __init__(self, clients):
+        self.clients = clients
+        self.sent_at = {}  # текст сообщения -> время отправки (perf_counter)
+        self.deliveries = {}  # текст сообщения -> сколько клиентов его получили
+        self.latencies = []
+        self.errors = []
+        self.rss_samples = []
+
+    def sent(self, text):
+        self.sent_at[text] = time.perf_counter()
+        self.deliveries[text] = 0
+
+    def received(self, text):
+        sent_at = self.sent_at.get(text)
+        if sent_at is None:
+            return
+        self.deliveries[text] += 1
+        self.latencies.append((time.perf_counter() - sent_at) * 1000)
+
+
+class LoadClient:
+    """Имитация ChatInterface: логин по токену, отправка и приём сообщений по WebSocket"""
+
+    def __init__(self, index, username, stats):
+        self.index = index
+        self.username = username
+        self.stats = stats
+        self.token = None
+
+    def login(self, base_url):
+        data = urllib.parse.urlencode({"username": self.username, "password": LOADTEST_PASSWORD}).encode()
+        with urllib.request.urlopen(f"{base_url}/api-token-auth/", data=data, timeout=30) as response:
+            self.token = json.loads(response.read())["token"]
+
+    async def run(self, ws_url, rate, duration, drain, start_barrier):
+        import websockets
+
+        try:
+            async with websockets.connect(ws_url, subprotocols=["token", self.token], max_queue=None) as ws:
+                await start_barrier.wait()
+                receiver = asyncio.create_task(self.receive(ws))
+                await self.send_loop(ws, rate, duration)
+                await asyncio.sleep(drain)
+                receiver.cancel()
+        except Exception as e:
+            self.stats.errors.append(f"{self.username}: {e!r}")
+
+    async def send_loop(self, ws, rate, duration):
+        interval = 1 / rate if rate > 0 else None
+        deadline = time.perf_counter() + duration
+        seq = 0
+        while interval and time.perf_counter() < deadline:
+            text = f"{LOADTEST_PREFIX}{self.index}:{seq}"
+            self.stats.sent(text)
+            await ws.send(json.dumps({"user": self.username, "text": text}))
+            seq += 1
+            await asyncio.sleep(interval)
+
+    async def receive(self, ws):
+        async for message in ws:
+            try:
+                data = json.loads(message)
+                # Сообщения одного окна рассылки приходят кадром batch
+                items = data["messages"] if data.get("type") == "batch" else [data]
+            except (ValueError, AttributeError, KeyError):
+                continue
+            for item in items:
+                text = item.get("text", "") if isinstance(item, dict) else ""
+                if isinstance(text, str) and text.startswith(LOADTEST_PREFIX):
+                    self.stats.received(text)
+
+
+class Command(BaseCommand):
+    help = "Нагрузочный тест WebSocket-чата: N клиентов против локально запущенного Daphne"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=50, help="Количество клиентов")
+        parser.add_argument('--rate', type=float, default=1.0, help="Сообщений в секунду на клиента")
+        parser.add_argument('--duration', type=float, default=30.0, help="Длительность отправки (секунды)")
+        parser.add_argument('--drain', type=float, default=3.0, help="Ожидание доставки после отправки")
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument(
+            '--no-server',
+            action='store_true',
+            help="Не запускать Daphne, использовать уже работающий сервер на --host/--port",
+        )
+        parser.add_argument('--label', default='', help="Метка прогона (например, версия релиза)")
+        parser.add_argument('--output', help="Файл для JSON-отчёта (по умолчанию stdout)")
+        parser.add_argument('--keep-data', action='store_true', help="Не удалять тестовых пользователей")
+
+    def handle(self, *args, **options):
+        try:
+            import websockets  # noqa: F401
+        except ImportError:
+            raise CommandError("Для нагрузочного теста нужен пакет websockets")
+
+        usernames = [f"loadtest_{i}" for i in range(options['clients'])]
+        self.create_users(usernames)
+
+        server = None
+        try:
+            if not options['no_server']:
+                server = self.start_server(options['host'], options['port'])
+            report = asyncio.run(self.run_load(usernames, server, options))
+        finally:
+            if server is not None:
+                server.terminate()
+                server.wait(timeout=10)
+            if not options['keep_data']:
+                # CASCADE удалит и сообщения тестовых пользователей
+                CustomUser.objects.filter(username__in=usernames).delete()
+
+        output = json.dumps(report, ensure_ascii=False, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                f.write(output)
+            self.stderr.write(self.style.SUCCESS(f"📊 Отчёт сохранён: {options['output']}"))
+        else:
+            self.stdout.write(output)
+
+    def create_users(self, usernames):
+        # Один хэш на всех: make_password для каждого занял бы минуты
+        password = make_password(LOADTEST_PASSWORD)
+        existing = set(CustomUser.objects.filter(username__in=usernames).values_list('username', flat=True))
+        CustomUser.objects.bulk_create(
+            [CustomUser(username=name, password=password) for name in usernames if name not in existing]
+        )
+        CustomUser.objects.filter(username__in=usernames).update(password=password)
+
+    def start_server(self, host, port):
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=os.environ.get('DJANGO_SETTINGS_MODULE', 'project.settings'))
+        server = subprocess.Popen(
+            [sys.executable, '-m', 'daphne', '-b', host, '-p', str(port), 'project.asgi:application'],
+            env=env,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            if server.poll() is not None:
+                raise CommandError("Daphne завершился при запуске")
+            try:
+                with socket.create_connection((host, port), timeout=0.5):
+                    return server
+            except OSError:
+                time.sleep(0.2)
+        server.terminate()
+        raise CommandError("Daphne не начал принимать подключения за 30 секунд")
+
+    async def sample_rss(self, pid, stats, stop):
+        while not stop.is_set():
+            rss = process_rss(pid)
+            if rss is not None:
+                stats.rss_samples.append(rss)
+            try:
+                await asyncio.wait_for(stop.wait(), timeout=0.5)
+            except asyncio.TimeoutError:
+                pass
+
+    async def run_load(self, usernames, server, options):
+        base_url = f"http://{options['host']}:{options['port']}"
+        ws_url = f"ws://{options['host']}:{options['port']}/ws/chat/"
+        stats = LoadStats(len(usernames))
+        clients = [LoadClient(i, name, stats) for i, name in enumerate(usernames)]
+
+        # Логин через /api-token-auth/, как у настоящего клиента (по 8 одновременно)
+        login_limit = asyncio.Semaphore(8)
+
+        async def login(client):
+            async with login_limit:
+                try:
+                    await asyncio.to_thread(client.login, base_url)
+                except Exception as e:
+                    stats.errors.append(f"{client.username}: login {e!r}")
+
+        await asyncio.gather(*(login(client) for client in clients))
+        clients = [client for client in clients if client.token]
+
+        stop_sampling = asyncio.Event()
+        sampler = None
+        if server is not None:
+            sampler = asyncio.create_task(self.sample_rss(server.pid, stats, stop_sampling))
+
+        # Все клиенты начинают отправку одновременно, когда подключились
+        start_barrier = asyncio.Event()
+        tasks = [
+            asyncio.create_task(
+                client.run(ws_url, options['rate'], options['duration'], options['drain'], start_barrier)
+            )
+            for client in clients
+        ]
+        await asyncio.sleep(1)
+        started = time.perf_counter()
+        start_barrier.set()
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - started
+
+        stop_sampling.set()
+        if sampler is not None:
+            await sampler
+
+        return self.build_report(stats, len(clients), elapsed, options)
+
+    def build_report(self, stats, connected, elapsed, options):
+        latencies = sorted(stats.latencies)
+        sent = len(stats.sent_at)
+        expected = sent * connected
+        delivered = sum(stats.deliveries.values())
+        rss = stats.rss_samples
+
+        def mb(value):
+            return round(value / 1024 / 1024, 2) if value is not None else None
+
+        def ms(value):
+            return round(value, 3) if value is not None else None
+
+        return {
+            "label": options['label'],
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "config": {
+                "clients": options['clients'],
+                "rate_per_client": options['rate'],
+                "duration_s": options['duration'],
+            },
+            "connected_clients": connected,
+            "sent": sent,
+            "expected_deliveries": expected,
+            "delivered": delivered,
+            "dropped": expected - delivered,
+            "throughput": {
+                "sent_per_s": round(sent / elapsed, 2) if elapsed else None,
+                "delivered_per_s": round(delivered / elapsed, 2) if elapsed else None,
+            },
+            "latency_ms": {
+                "p50": ms(percentile(latencies, 0.50)),
+                "p90": ms(percentile(latencies, 0.90)),
+                "p99": ms(percentile(latencies, 0.99)),
+                "max": ms(latencies[-1] if latencies else None),
+            },
+            "server_rss_mb": {
+                "start": mb(rss[0] if rss else None),
+                "max": mb(max(rss) if rss else None),
+                "end": mb(rss[-1] if rss else None),
+            },
+            "errors": stats.errors[:50],
+        }
@@ -0,0 +1,149 @@
+"""
+Метрики в памяти процесса с выдачей в текстовом формате Prometheus (/metrics).
+
+Гистограммы собирают:
+  - время HTTP-представлений, количество и время их запросов к БД (MetricsMiddleware);
+  - время событий ChatConsumer (event_timer);
+  - ожидание в очереди пула потоков sync_to_async (timed_sync_to_async).
+"""
+
+import functools
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import sync_to_async
+
+METRIC_PREFIX = 'moremessage_'
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+# Счётчики запросов к БД текущего HTTP-запроса: [количество, секунды].
+# ContextVar копируется в потоки sync_to_async, поэтому видит и запросы синхронных представлений.
+current_query_stats = ContextVar('current_query_stats', default=None)
+
+
+class Histogram:
+    def __init__(self, name, help_text, label_names, buckets=DEFAULT_BUCKETS):
+        self.name = METRIC_PREFIX + name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        self.series = {}  # значения меток -> [счётчики корзин..., сумма, количество]
+        self.lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        with self.lock:
+            series = self.series.get(labels)
+            if series is None:
+                series = self.series[labels] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def exposition(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            items = [(labels, list(series)) for labels, series in self.series.items()]
+        for labels, series in items:
+            pairs = [f'{name}="{escape_label(value)}"' for name, value in zip(self.label_names, labels)]
+            for bound, count in zip(self.buckets, series):
+                le = ','.join(pairs + [f'le="{bound}"'])
+                lines.append(f"{self.name}_bucket{{{le}}} {count}")
+            le = ','.join(pairs + ['le="+Inf"'])
+            lines.append(f"{self.name}_bucket{{{le}}} {series[-1]}")
+            label_text = '{' + ','.join(pairs) + '}' if pairs else ''
+            lines.append(f"{self.name}_sum{label_text} {series[-2]}")
+            lines.append(f"{self.name}_count{label_text} {series[-1]}")
+        return lines
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+http_request_duration = Histogram(
+    'http_request_duration_seconds', "Время обработки HTTP-запроса", ('view', 'method', 'status'),
+)
+http_db_queries = Histogram(
+    'http_db_queries', "Количество запросов к БД на HTTP-запрос", ('view',), buckets=COUNT_BUCKETS,
+)
+http_db_duration = Histogram(
+    'http_db_duration_seconds', "Суммарное время запросов к БД на HTTP-запрос", ('view',),
+)
+db_query_duration = Histogram(
+    'db_query_duration_seconds', "Время одного запроса к БД", ('vendor',),
+)
+ws_event_duration = Histogram(
+    'ws_event_duration_seconds', "Время обработки события ChatConsumer", ('event',),
+)
+sync_to_async_wait = Histogram(
+    'sync_to_async_queue_wait_seconds', "Ожидание свободного потока sync_to_async", ('func',),
+)
+
+REGISTRY = [
+    http_request_duration,
+    http_db_queries,
+    http_db_duration,
+    db_query_duration,
+    ws_event_duration,
+    sync_to_async_wait,
+]
+
+
+def exposition():
+    """Все метрики в текстовом формате Prometheus 0.0.4"""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.exposition())
+    return '\n'.join(lines) + '\n'
+
+
+def query_timer(execute, sql, params, many, context):
+    """execute_wrapper для каждого подключения: время запроса и счётчик текущего HTTP-запроса"""
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = time.perf_counter() - started
+        db_query_duration.observe(elapsed, context['connection'].vendor)
+        stats = current_query_stats.get()
+        if stats is not None:
+            stats[0] += 1
+            stats[1] += elapsed
+
+
+def install_query_timer(sender, connection, **kwargs):
+    """Обработчик connection_created"""
+    if query_timer not in connection.execute_wrappers:
+        connection.execute_wrappers.append(query_timer)
+
+
+@contextmanager
+def event_timer(event):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        ws_event_duration.observe(time.perf_counter() - started, event)
+
+
+def timed_sync_to_async(func, **kwargs):
+    """sync_to_async, который дополнительно меряет ожидание потока в пуле"""
+    # repr() не вызываем: для методов QuerySet он выполняет запрос
+    name = getattr(func, '__qualname__', None) or type(func).__name__
+
+    @functools.wraps(func)
+    async def wrapper(*args, **call_kwargs):
+        submitted = time.perf_counter()
+
+        def run():
+            sync_to_async_wait.observe(time.perf_counter() - submitted, name)
+            return func(*args, **call_kwargs)
+
+        return await sync_to_async(run, **kwargs)()
+
+    return wrapper
@@ -0,0 +1,253 @@
+import cProfile
+import io
+import os
+import pstats
+import random
+import threading
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseNotModified
+
+from . import metrics
+from .staticfiles import static_index
+
+PROFILE_HEADER = 'HTTP_X_PROFILE'
+
+
+class MetricsMiddleware:
+    """Время представления и запросы к БД на каждый HTTP-запрос (см. app/metrics.py).
+
+    PROFILE_SAMPLE_RATE > 0 - доля запросов, чьи профили (cProfile или
+    pyinstrument, если установлен) пишутся в PROFILE_DIR. Отчёт вместо ответа
+    по заголовку X-Profile отдаёт ProfileMiddleware.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        profiler, started, token = self.start(request)
+        try:
+            response = self.get_response(request)
+        except BaseException:
+            if profiler is not None:
+                profiler.stop()  # например, клиент отключился: профилировщик не должен остаться занят
+            raise
+        finally:
+            metrics.current_query_stats.reset(token)
+        return self.finish(request, response, profiler, started)
+
+    async def __acall__(self, request):
+        profiler, started, token = self.start(request)
+        try:
+            response = await self.get_response(request)
+        except BaseException:
+            if profiler is not None:
+                profiler.stop()  # например, клиент отключился: профилировщик не должен остаться занят
+            raise
+        finally:
+            metrics.current_query_stats.reset(token)
+        return self.finish(request, response, profiler, started)
+
+    def start(self, request):
+        request.query_stats = [0, 0.0]
+        token = metrics.current_query_stats.set(request.query_stats)
+        profiler = self.make_profiler(request)
+        if profiler is not None:
+            profiler.start()
+        return profiler, time.perf_counter(), token
+
+    def finish(self, request, response, profiler, started):
+        elapsed = time.perf_counter() - started
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match else 'unresolved'
+        queries, query_time = request.query_stats
+
+        metrics.http_request_duration.observe(elapsed, view, request.method, response.status_code)
+        metrics.http_db_queries.observe(queries, view)
+        metrics.http_db_duration.observe(query_time, view)
+
+        if profiler is not None:
+            profiler.stop()
+            profiler.dump(view)
+        return response
+
+    def make_profiler(self, request):
+        rate = getattr(settings, 'PROFILE_SAMPLE_RATE', 0)
+        if rate and random.random() < rate:
+            return Profiler.acquire()
+        return None
+
+
+class ProfileMiddleware:
+    """Заголовок "X-Profile: 1" - отчёт профилировщика вместо ответа.
+
+    Только при PROFILE_HEADER_ENABLED и только для staff: под event loop
+    профилируется весь процесс. Стоит после AuthenticationMiddleware, поэтому
+    время сессий и аутентификации в отчёт не входит.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not self.wanted(request) or not request.user.is_staff:
+            return self.get_response(request)
+        profiler = Profiler.acquire()
+        if profiler is None:
+            return self.busy()
+        profiler.start()
+        try:
+            self.get_response(request)
+        finally:
+            profiler.stop()
+        return self.report(profiler)
+
+    async def __acall__(self, request):
+        if not self.wanted(request) or not (await request.auser()).is_staff:
+            return await self.get_response(request)
+        profiler = Profiler.acquire()
+        if profiler is None:
+            return self.busy()
+        profiler.start()
+        try:
+            await self.get_response(request)
+        finally:
+            profiler.stop()
+        return self.report(profiler)
+
+    @staticmethod
+    def wanted(request):
+        return request.META.get(PROFILE_HEADER) and getattr(settings, 'PROFILE_HEADER_ENABLED', False)
+
+    @staticmethod
+    def busy():
+        return HttpResponse("Профилировщик занят другим запросом", status=409, content_type='text/plain; charset=utf-8')
+
+    @staticmethod
+    def report(profiler):
+        return HttpResponse(profiler.report(), content_type='text/plain; charset=utf-8')
+
+
+class StaticFilesMiddleware:
+    """Раздача собранной статики из STATIC_ROOT прямо в процессе (без nginx).
+
+    Файлы с хэшем в имени отдаются с Cache-Control: immutable, остальные -
+    с коротким max-age и ETag. Сжатая копия (.br/.gz) выбирается по
+    Accept-Encoding. Если файла нет в STATIC_ROOT, запрос идёт дальше
+    (в DEBUG его обслужит staticfiles из app/static).
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.prefix = '/' + settings.STATIC_URL.lstrip('/')
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return self.serve(request) or self.get_response(request)
+
+    async def __acall__(self, request):
+        return self.serve(request) or await self.get_response(request)
+
+    def serve(self, request):
+        if request.method not in ('GET', 'HEAD') or not request.path.startswith(self.prefix):
+            return None
+        static_file = static_index.lookup(request.path[len(self.prefix):])
+        if static_file is None:
+            return None
+
+        if request.headers.get('If-None-Match') == static_file.etag:
+            response = HttpResponseNotModified()
+        else:
+            encoding, path = static_file.choose(request.headers.get('Accept-Encoding', ''))
+            content = static_file.read(path)
+            response = HttpResponse(b'' if request.method == 'HEAD' else content, content_type=static_file.content_type)
+            response['Content-Length'] = str(len(content))
+            if encoding:
+                response['Content-Encoding'] = encoding
+        response['ETag'] = static_file.etag
+        if static_file.encodings:
+            response['Vary'] = 'Accept-Encoding'
+        if static_file.immutable:
+            response['Cache-Control'] = 'public, max-age=31536000, immutable'
+        else:
+            response['Cache-Control'] = f"public, max-age={settings.STATIC_MAX_AGE}"
+        return response
+
+
+class Profiler:
+    """pyinstrument, если установлен, иначе cProfile (видит только текущий поток).
+
+    Одновременно работает один профилировщик на процесс: два сразу мешают
+    друг другу (а cProfile на Python 3.12+ второй просто не запустит).
+    """
+    lock = threading.Lock()
+
+    @classmethod
+    def acquire(cls):
+        """Новый профилировщик или None, если уже идёт другой профиль"""
+        if not cls.lock.acquire(blocking=False):
+            return None
+        return cls()
+
+    def __init__(self):
+        try:
+            from pyinstrument import Profiler as SamplingProfiler
+            self.profiler = SamplingProfiler(async_mode='enabled')
+            self.sampling = True
+        except ImportError:
+            self.profiler = cProfile.Profile()
+            self.sampling = False
+
+    def start(self):
+        if self.sampling:
+            self.profiler.start()
+        else:
+            self.profiler.enable()
+
+    def stop(self):
+        try:
+            if self.sampling:
+                self.profiler.stop()
+            else:
+                self.profiler.disable()
+        finally:
+            self.lock.release()
+
+    def report(self):
+        if self.sampling:
+            return self.profiler.output_text(unicode=True)
+        stream = io.StringIO()
+        pstats.Stats(self.profiler, stream=stream).sort_stats('cumulative').print_stats(50)
+        return stream.getvalue()
+
+    def dump(self, view):
+        directory = getattr(settings, 'PROFILE_DIR', None)
+        if not directory:
+            return
+        os.makedirs(directory, exist_ok=True)
+        name = f"{view.replace(':', '_')}-{time.time():.6f}"
+        if self.sampling:
+            with open(os.path.join(directory, f"{name}.html"), 'w', encoding='utf-8') as f:
+                f.write(self.profiler.output_html())
+        else:
+            self.profiler.dump_stats(os.path.join(directory, f"{name}.prof"))
@@ -1,3 +1,5 @@
+import uuid
+
 from django.db import models
 from django.contrib.auth.models import AbstractUser
 from django.db.models.signals import post_save
@@ -9,14 +11,115 @@ from rest_framework.authtoken.models import Token
 class CustomUser(AbstractUser):
     pass
 
+class Attachment(models.Model):
+    """Вложение: файл лежит в хранилище по SHA-256, одинаковые файлы хранятся один раз"""
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE)
+    sha256 = models.CharField(max_length=64, db_index=True)
+    size = models.BigIntegerField()
+    filename = models.CharField(max_length=255)
+    content_type = models.CharField(max_length=100, default='application/octet-stream')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.filename} ({self.sha256[:12]})"
+
+class UploadSession(models.Model):
+    """Незавершённая загрузка по частям: received - сколько байт уже на диске"""
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE)
+    filename = models.CharField(max_length=255)
+    content_type = models.CharField(max_length=100, default='application/octet-stream')
+    size = models.BigIntegerField()
+    received = models.BigIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.filename}: {self.received}/{self.size}"
+
 class ChatMessage(models.Model):
     user = models.ForeignKey(CustomUser, on_delete=models.CASCADE)
-    text = models.TextField()
+    text = models.TextField(blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    attachment = models.ForeignKey(Attachment, null=True, blank=True, on_delete=models.SET_NULL)
+    # Правки и удаление (app/edits.py): удалённое сообщение остаётся строкой-надгробием
+    version = models.PositiveIntegerField(default=1)
+    edited_at = models.DateTimeField(null=True, blank=True)
+    deleted_at = models.DateTimeField(null=True, blank=True)
+    # Ответ (app/replies.py). Родитель может уже лежать в архиве, поэтому без
+    # ограничения в БД; reply_preview - копия автора и текста родителя для рассылки
+    reply_to = models.ForeignKey(
+        'self', null=True, blank=True, on_delete=models.DO_NOTHING, db_constraint=False, related_name='replies',
+    )
+    reply_preview = models.JSONField(null=True, blank=True)
+    # Ключ идемпотентности от клиента: повтор из очереди отправки не создаёт дубликат
+    client_id = models.CharField(max_length=64, null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # Лента сообщений: ORDER BY created_at DESC, id DESC
+            models.Index(fields=['created_at', 'id'], name='chatmsg_created_id_idx'),
+            # Профиль: сообщения пользователя и их количество
+            models.Index(fields=['user', 'created_at'], name='chatmsg_user_created_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'client_id'],
+                condition=models.Q(client_id__isnull=False),
+                name='chatmsg_user_client_id_uniq',
+            ),
+        ]
 
     def __str__(self):
         return f"{self.user.username} - {self.created_at}"
     
+class MessageChange(models.Model):
+    """Журнал правок и удалений; id - курсор для /api/messages/changes/?since="""
+    # Без ограничения в БД: журнал переживает перенос сообщения в архив
+    message = models.ForeignKey(
+        ChatMessage, on_delete=models.DO_NOTHING, db_constraint=False, related_name='changes',
+    )
+    version = models.PositiveIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.message_id} v{self.version}"
+
+class ReadMarker(models.Model):
+    """Последнее прочитанное сообщение пользователя в комнате (app/receipts.py)"""
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='read_markers')
+    room = models.CharField(max_length=64)
+    last_read_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'room'], name='readmarker_user_room_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} {self.room}: {self.last_read_id}"
+
+class ArchivedMessage(models.Model):
+    """Холодный архив: сообщения старше N дней переносит команда archive_messages"""
+    id = models.BigIntegerField(primary_key=True)  # id сохраняется из ChatMessage
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE)
+    text = models.TextField(blank=True)
+    created_at = models.DateTimeField()
+    attachment = models.ForeignKey(Attachment, null=True, blank=True, on_delete=models.SET_NULL)
+    version = models.PositiveIntegerField(default=1)
+    edited_at = models.DateTimeField(null=True, blank=True)
+    deleted_at = models.DateTimeField(null=True, blank=True)  # надгробие переносится как есть
+    reply_to_id = models.BigIntegerField(null=True, blank=True, db_index=True)  # id в ChatMessage или здесь
+    reply_preview = models.JSONField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='archmsg_created_id_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user.username} - {self.created_at} (архив)"
+
 @receiver(post_save, sender=CustomUser)
 def create_auth_token(sender, instance=None, created=False, **kwargs):
     if created:
@@ -0,0 +1,198 @@
+"""
+Реестр присутствия: кто сейчас онлайн.
+
+Реестр живёт в памяти процесса и меняется только из event loop (ChatConsumer).
+Изменения онлайн/офлайн копятся и раз в PRESENCE_FLUSH_INTERVAL секунд уходят
+клиентам одним событием presence_update; если пользователь успел зайти и выйти
+внутри окна, событие не отправляется вовсе.
+
+При нескольких процессах (PRESENCE_LAYER_SYNC) процессы обмениваются своими
+изменениями через channel layer и раз в PRESENCE_HEARTBEAT секунд - полным
+списком своих пользователей; данные молчащего процесса устаревают. Входы и
+выходы, узнанные от других процессов, попадают в presence_update так же, как
+локальные.
+"""
+
+import asyncio
+import logging
+import time
+import uuid
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+PRESENCE_SYNC_GROUP = "presence_sync"
+
+
+class PresenceRegistry:
+    def __init__(self, flush_interval=1.0, layer_sync=False, heartbeat=15.0):
+        self.flush_interval = flush_interval
+        self.layer_sync = layer_sync
+        self.heartbeat = heartbeat
+        self.process_id = uuid.uuid4().hex
+
+        self.local = {}  # пользователь -> подключений в этом процессе
+        self.online = {}  # пользователь -> в скольких процессах онлайн
+        self.remote = {}  # id процесса -> [множество пользователей, время последнего сообщения]
+        self.changed = {}  # пользователь -> был ли онлайн до начала окна (все процессы, для клиентов)
+        self.local_changed = {}  # то же только по этому процессу, для рассылки другим процессам
+
+        self.room_group_name = None
+        self.tasks = []
+
+    # region запросы
+
+    def online_count(self):
+        """Количество пользователей онлайн, O(1)"""
+        return len(self.online)
+
+    def is_online(self, user):
+        return user in self.online
+
+    def connections(self, user):
+        return self.local.get(user, 0)
+
+    # endregion
+
+    # region события подключений
+
+    def connect(self, user):
+        count = self.local.get(user, 0)
+        self.local[user] = count + 1
+        if count == 0:
+            self.local_changed.setdefault(user, False)
+            self._increment(user)
+
+    def disconnect(self, user):
+        count = self.local.get(user, 0) - 1
+        if count > 0:
+            self.local[user] = count
+            return
+        if self.local.pop(user, None) is not None:
+            self.local_changed.setdefault(user, True)
+            self._decrement(user)
+
+    def _increment(self, user):
+        count = self.online.get(user, 0)
+        self.online[user] = count + 1
+        if count == 0:
+            self.changed.setdefault(user, False)
+
+    def _decrement(self, user):
+        count = self.online.get(user, 0) - 1
+        if count > 0:
+            self.online[user] = count
+            return
+        self.online.pop(user, None)
+        self.changed.setdefault(user, True)
+
+    def drain_changes(self):
+        """Итоговые изменения за окно: (вошли, вышли)"""
+        changed, self.changed = self.changed, {}
+        came, left = [], []
+        for user, was_online in changed.items():
+            now_online = user in self.online
+            if now_online and not was_online:
+                came.append(user)
+            elif was_online and not now_online:
+                left.append(user)
+        return came, left
+
+    # endregion
+
+    # region фоновые задачи
+
+    def ensure_started(self, channel_layer, room_group_name):
+        """Запускает рассылку (и синхронизацию процессов) в текущем event loop один раз"""
+        if self.tasks:
+            return
+        self.room_group_name = room_group_name
+        self.tasks.append(asyncio.create_task(self.flush_loop(channel_layer)))
+        if self.layer_sync:
+            self.tasks.append(asyncio.create_task(self.sync_loop(channel_layer)))
+
+    async def flush_loop(self, channel_layer):
+        last_heartbeat = 0.0
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                came, left = self.drain_changes()
+                if came or left:
+                    await channel_layer.group_send(self.room_group_name, {
+                        "type": "presence_update",
+                        "online": came,
+                        "offline": left,
+                        "online_count": self.online_count(),
+                    })
+                if self.layer_sync:
+                    full = time.monotonic() - last_heartbeat >= self.heartbeat
+                    if full:
+                        last_heartbeat = time.monotonic()
+                    await self.publish(channel_layer, full)
+                    self.expire_remote()
+            except Exception:
+                logger.exception("❌ Ошибка рассылки присутствия")
+
+    async def publish(self, channel_layer, full):
+        local_changed, self.local_changed = self.local_changed, {}
+        if not full and not local_changed:
+            return
+        message = {"type": "presence.sync", "process": self.process_id}
+        if full:
+            message["users"] = list(self.local)
+        else:
+            message["online"] = [user for user, was in local_changed.items() if not was and user in self.local]
+            message["offline"] = [user for user, was in local_changed.items() if was and user not in self.local]
+        await channel_layer.group_send(PRESENCE_SYNC_GROUP, message)
+
+    async def sync_loop(self, channel_layer):
+        channel = await channel_layer.new_channel()
+        await channel_layer.group_add(PRESENCE_SYNC_GROUP, channel)
+        while True:
+            try:
+                message = await channel_layer.receive(channel)
+                if message.get("process") != self.process_id:
+                    self.apply_remote(message)
+            except Exception:
+                # Одно испорченное сообщение не должно остановить синхронизацию процессов
+                logger.exception("❌ Ошибка синхронизации присутствия")
+
+    def apply_remote(self, message):
+        entry = self.remote.setdefault(message["process"], [set(), 0.0])
+        users = entry[0]
+        entry[1] = time.monotonic()
+        if "users" in message:
+            current = set(message["users"])
+            came, left = current - users, users - current
+        else:
+            came, left = set(message.get("online", ())) - users, set(message.get("offline", ())) & users
+        for user in came:
+            users.add(user)
+            self._increment(user)
+        for user in left:
+            users.discard(user)
+            self._decrement(user)
+
+    def expire_remote(self):
+        deadline = time.monotonic() - self.heartbeat * 3
+        for process_id, (users, heard_at) in list(self.remote.items()):
+            if heard_at < deadline:
+                for user in users:
+                    self._decrement(user)
+                del self.remote[process_id]
+
+    # endregion
+
+
+def layer_sync_default():
+    backend = settings.CHANNEL_LAYERS.get("default", {}).get("BACKEND", "")
+    return not backend.endswith("InMemoryChannelLayer")
+
+
+presence_layer_sync = getattr(settings, 'PRESENCE_LAYER_SYNC', None)
+presence = PresenceRegistry(
+    flush_interval=getattr(settings, 'PRESENCE_FLUSH_INTERVAL', 1.0),
+    layer_sync=layer_sync_default() if presence_layer_sync is None else presence_layer_sync,
+    heartbeat=getattr(settings, 'PRESENCE_HEARTBEAT', 15.0),
+)
@@ -0,0 +1,144 @@
+"""
+Отметки о прочтении и счётчики непрочитанных.
+
+Клиент сообщает о прочтении событием read (message_id). Отметки копятся в
+памяти процесса (ReadReceiptBuffer) и раз в READ_RECEIPT_FLUSH_INTERVAL
+секунд записываются одним upsert: не больше одной записи на пользователя
+за интервал, сколько бы событий он ни прислал. Отметка только растёт: запоздалое
+событие со второго устройства или из старой сессии её не откатывает.
+
+Непрочитанные - это count(id > last_read) по первичному ключу без своих
+сообщений, не больше
+UNREAD_COUNT_LIMIT (клиент показывает "99+"). Отметка читается подзапросом,
+так что счётчик - один запрос по диапазону ключа; результат кэшируется: кэш сбрасывает новое или удалённое
+сообщение (поколение комнаты) и запись отметки пользователя. В кэше другого
+процесса (LocMemCache) счётчик может отставать не дольше UNREAD_CACHE_TIMEOUT.
+"""
+
+import asyncio
+import logging
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Subquery, Value
+from django.db.models.functions import Coalesce
+from django.db.models.signals import post_save
+from django.utils import timezone
+
+from .models import ChatMessage, ReadMarker
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ROOM = "global_chat"  # Комната пока одна - общий чат
+UNREAD_COUNT_LIMIT = 100
+UPSERT_BATCH_SIZE = 200  # строк на один INSERT (4 параметра на строку)
+
+# Условие в DO UPDATE - одинаковый синтаксис в SQLite и PostgreSQL
+UPSERT_SQL = """
+INSERT INTO {table} (user_id, room, last_read_id, updated_at)
+VALUES {rows}
+ON CONFLICT (user_id, room) DO UPDATE
+SET last_read_id = excluded.last_read_id, updated_at = excluded.updated_at
+WHERE {table}.last_read_id < excluded.last_read_id
+"""
+
+
+def generation_key(room):
+    return f"unread:gen:{room}"
+
+
+def unread_key(room, user_id):
+    return f"unread:{room}:{user_id}"
+
+
+def bump_generation(room=DEFAULT_ROOM):
+    """Сообщений в комнате стало больше или меньше: кэшированные счётчики устарели"""
+    try:
+        cache.incr(generation_key(room))
+    except ValueError:
+        cache.add(generation_key(room), 1, None)
+
+
+def unread_state(user_id, room=DEFAULT_ROOM):
+    """{"unread": n, "first_unread": id или None}: из кэша или одним запросом"""
+    cached = cache.get_many([generation_key(room), unread_key(room, user_id)])
+    generation = cached.get(generation_key(room), 0)
+    state = cached.get(unread_key(room, user_id))
+    if state is not None and state[0] == generation:
+        return state[1]
+
+    last_read = Coalesce(
+        Subquery(ReadMarker.objects.filter(user_id=user_id, room=room).values('last_read_id')[:1]),
+        Value(0),
+    )
+    ids = list(
+        ChatMessage.objects.filter(id__gt=last_read, deleted_at__isnull=True)
+        .exclude(user_id=user_id)  # свои сообщения прочитаны
+        .order_by('id')
+        .values_list('id', flat=True)[:UNREAD_COUNT_LIMIT]
+    )
+    result = {"unread": len(ids), "first_unread": ids[0] if ids else None}
+    cache.set(unread_key(room, user_id), (generation, result), settings.UNREAD_CACHE_TIMEOUT)
+    return result
+
+
+class ReadReceiptBuffer:
+    """Склейка отметок о прочтении: (пользователь, комната) -> наибольший id"""
+
+    def __init__(self, flush_interval=5.0):
+        self.flush_interval = flush_interval
+        self.pending = {}
+        self.task = None
+
+    def ack(self, user_id, message_id, room=DEFAULT_ROOM):
+        key = (user_id, room)
+        if message_id > self.pending.get(key, 0):
+            self.pending[key] = message_id
+
+    def drain(self):
+        pending, self.pending = self.pending, {}
+        return pending
+
+    def ensure_started(self):
+        if self.task is None:
+            self.task = asyncio.create_task(self.flush_loop())
+
+    async def flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            pending = self.drain()
+            if not pending:
+                continue
+            try:
+                await database_sync_to_async(self.write)(pending)
+            except Exception:
+                logger.exception("❌ Ошибка записи отметок о прочтении")
+
+    def write(self, pending):
+        """Один upsert на все накопленные отметки; меньший id не перезаписывает больший"""
+        table = connection.ops.quote_name(ReadMarker._meta.db_table)
+        now = connection.ops.adapt_datetimefield_value(timezone.now())
+        items = list(pending.items())
+        with connection.cursor() as cursor:
+            for start in range(0, len(items), UPSERT_BATCH_SIZE):
+                batch = items[start:start + UPSERT_BATCH_SIZE]
+                params = []
+                for (user_id, room), message_id in batch:
+                    params.extend((user_id, room, message_id, now))
+                cursor.execute(UPSERT_SQL.format(table=table, rows=', '.join(['(%s, %s, %s, %s)'] * len(batch))), params)
+        cache.delete_many([unread_key(room, user_id) for user_id, room in pending])
+
+
+receipts = ReadReceiptBuffer(flush_interval=getattr(settings, 'READ_RECEIPT_FLUSH_INTERVAL', 5.0))
+
+
+def on_message_created(sender, instance=None, created=False, **kwargs):
+    if created:
+        bump_generation()
+
+
+def connect_receipt_signals():
+    """Вызывается из AppConfig.ready()"""
+    post_save.connect(on_message_created, sender=ChatMessage, dispatch_uid='unread_generation_message_add')
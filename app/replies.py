@@ -0,0 +1,133 @@
+"""
+Ответы на сообщения.
+
+Сообщение-ответ хранит reply_to (id родителя) и reply_preview - копию автора
+и текста родителя на момент ответа. Превью уходит вместе с сообщением в
+рассылку и в историю, так что клиенту не нужно искать родителя, чтобы
+показать цитату. Правка или удаление родителя переписывает превью у всех
+ответов одним UPDATE по индексу reply_to.
+
+Цепочку ответов целиком (от корня до сообщения) возвращает thread() одним
+рекурсивным запросом по обеим таблицам, горячей и архиву: родитель старого
+ответа мог уже уехать в архив.
+"""
+
+from django.db import connection
+
+from .models import ArchivedMessage, ChatMessage, CustomUser, Attachment
+
+# Длинный шифротекст не обрезать без порчи, поэтому в превью его нет (text=None)
+REPLY_PREVIEW_MAX_LENGTH = 1000
+THREAD_MAX_DEPTH = 100
+
+
+class ReplyParentNotFound(Exception):
+    """Отвечают на несуществующее или удалённое сообщение"""
+
+
+def reply_preview(message):
+    """Превью родителя; message - ChatMessage или ArchivedMessage с загруженным user"""
+    if getattr(message, 'deleted_at', None) is not None:
+        return {"id": message.id, "user": message.user.username, "deleted": True}
+    return {
+        "id": message.id,
+        "user": message.user.username,
+        "text": message.text if len(message.text) <= REPLY_PREVIEW_MAX_LENGTH else None,
+        "attachment": message.attachment.filename if message.attachment_id else None,
+    }
+
+
+def find_reply_parents(message_ids):
+    """{id: превью} для существующих родителей из горячей таблицы или архива"""
+    ids = set(message_ids)
+    hot = ChatMessage.objects.filter(pk__in=ids, deleted_at__isnull=True).select_related('user', 'attachment')
+    parents = {message.id: message for message in hot}
+    missing = ids - parents.keys()
+    if missing:
+        parents.update(
+            (message.id, message)
+            for message in ArchivedMessage.objects.filter(pk__in=missing, deleted_at__isnull=True)
+            .select_related('user', 'attachment')
+        )
+    return {message_id: reply_preview(message) for message_id, message in parents.items()}
+
+
+def find_reply_parent(message_id):
+    """Превью родителя из горячей таблицы или архива, иначе ReplyParentNotFound"""
+    previews = find_reply_parents([message_id])
+    if message_id not in previews:
+        raise ReplyParentNotFound()
+    return previews[message_id]
+
+
+def refresh_reply_previews(message):
+    """Обновляет превью у ответов на message после его правки или удаления.
+
+    Ответ всегда новее родителя, поэтому ответы на сообщение горячей таблицы
+    тоже лежат в ней.
+    """
+    message = ChatMessage.objects.select_related('user', 'attachment').get(pk=message.pk)
+    return ChatMessage.objects.filter(reply_to=message).update(reply_preview=reply_preview(message))
+
+
+THREAD_SQL = """
+WITH RECURSIVE thread(id, depth) AS (
+    SELECT CAST(%(message_id)s AS BIGINT), 0
+    UNION ALL
+    SELECT COALESCE(hot.reply_to_id, cold.reply_to_id), thread.depth + 1
+    FROM thread
+    LEFT JOIN {hot} hot ON hot.id = thread.id
+    LEFT JOIN {cold} cold ON cold.id = thread.id
+    WHERE COALESCE(hot.reply_to_id, cold.reply_to_id) IS NOT NULL AND thread.depth < %(max_depth)s
+)
+SELECT m.*, u.username, a.filename, a.size, a.content_type, a.sha256
+FROM (
+    SELECT hot.id, hot.user_id, hot.text, hot.created_at, hot.attachment_id, hot.version,
+           hot.edited_at, hot.deleted_at, hot.reply_to_id, thread.depth
+    FROM thread JOIN {hot} hot ON hot.id = thread.id
+    UNION ALL
+    SELECT cold.id, cold.user_id, cold.text, cold.created_at, cold.attachment_id, cold.version,
+           cold.edited_at, cold.deleted_at, cold.reply_to_id, thread.depth
+    FROM thread JOIN {cold} cold ON cold.id = thread.id
+) m
+JOIN {users} u ON u.id = m.user_id
+LEFT JOIN {attachments} a ON a.id = m.attachment_id
+"""
+
+
+def thread(message_id, max_depth=THREAD_MAX_DEPTH):
+    """Цепочка ответов от корня до message_id включительно, одним запросом"""
+    sql = THREAD_SQL.format(
+        hot=connection.ops.quote_name(ChatMessage._meta.db_table),
+        cold=connection.ops.quote_name(ArchivedMessage._meta.db_table),
+        users=connection.ops.quote_name(CustomUser._meta.db_table),
+        attachments=connection.ops.quote_name(Attachment._meta.db_table),
+    )
+    # raw() приводит created_at и остальные поля модели к типам Python
+    rows = ChatMessage.objects.raw(sql, {"message_id": message_id, "max_depth": max_depth})
+    messages = sorted(rows, key=lambda row: -row.depth)  # корень первым; сортировка в БД дала бы временное B-дерево
+    return [thread_message_data(message) for message in messages]
+
+
+def thread_message_data(message):
+    if message.deleted_at is not None:
+        return {"id": message.id, "user": message.username, "deleted": True, "reply_to": message.reply_to_id}
+    attachment = None
+    if message.attachment_id:
+        attachment = {
+            "id": message.attachment_id,
+            "filename": message.filename,
+            "size": message.size,
+            "content_type": message.content_type,
+            "sha256": message.sha256,
+        }
+    return {
+        "id": message.id,
+        "user": message.username,
+        "text": message.text,
+        "created_at": message.created_at,
+        "attachment": attachment,
+        "version": message.version,
+        "edited_at": message.edited_at,
+        "reply_to": message.reply_to_id,
+    }
@@ -1,10 +1,40 @@
 from rest_framework import serializers
-from .models import ChatMessage
+from rest_framework.authtoken.serializers import AuthTokenSerializer
+from .models import ChatMessage, CustomUser
+from .attachments import attachment_data
+from .replies import find_reply_parent, ReplyParentNotFound
 
 class ChatMessageSerializer(serializers.ModelSerializer):
-    user = serializers.CharField(source='user.username')  # ✅ Добавляем user
+    user = serializers.CharField(source='user.username', read_only=True)  # ✅ Добавляем user (автор - из токена)
+    attachment = serializers.SerializerMethodField()  # Только ссылка, файл - /api/attachments/<id>/
+    # Родитель может быть и в архиве, поэтому id, а не PrimaryKeyRelatedField
+    reply_to = serializers.IntegerField(source='reply_to_id', required=False, allow_null=True)
 
     class Meta:
         model = ChatMessage
-        fields = ['id', 'user', 'text', 'created_at']
+        fields = ['id', 'user', 'text', 'created_at', 'attachment', 'version', 'edited_at', 'reply_to', 'reply_preview']
+        read_only_fields = ['version', 'edited_at', 'reply_preview']
 
+    def get_attachment(self, obj):
+        return attachment_data(obj.attachment)
+
+    def validate(self, attrs):
+        if attrs.get('reply_to_id') is not None:
+            try:
+                attrs['reply_preview'] = find_reply_parent(attrs['reply_to_id'])
+            except ReplyParentNotFound:
+                raise serializers.ValidationError({'reply_to': 'Message not found'})
+        return attrs
+
+
+
+class EmailOrUsernameAuthTokenSerializer(AuthTokenSerializer):
+    """Вход в приложении принимает и имя пользователя, и email"""
+
+    def validate(self, attrs):
+        login = attrs.get('username', '')
+        if '@' in login:
+            username = CustomUser.objects.filter(email__iexact=login).values_list('username', flat=True).first()
+            if username:
+                attrs['username'] = username
+        return super().validate(attrs)
@@ -0,0 +1,143 @@
+"""
+Сборка и раздача статики.
+
+collectstatic с CompressedManifestStorage копирует файлы в STATIC_ROOT,
+добавляет к именам хэш содержимого (styles.css -> styles.3f2a1b.css) и рядом
+с текстовыми файлами кладёт сжатые копии .gz и .br (brotli, если установлен).
+
+StaticFileIndex один раз обходит STATIC_ROOT и держит в памяти всё, что нужно
+для ответа: тип, ETag, доступные кодировки. Файлы с хэшем в имени никогда не
+меняются, поэтому отдаются с Cache-Control: immutable на год.
+"""
+
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import threading
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+from django.core.files.base import ContentFile
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_EXTENSIONS = {'.css', '.js', '.svg', '.txt', '.html', '.json', '.xml', '.map', '.ico'}
+# Сжатая копия сохраняется, только если она заметно меньше оригинала
+MIN_COMPRESSION_RATIO = 0.95
+# Файлы до этого размера держим в памяти, остальные читаются с диска на каждый запрос
+MAX_CACHED_FILE_SIZE = 1024 * 1024
+
+# Порядок предпочтения: (Content-Encoding, расширение копии)
+ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+
+
+def compress(data):
+    """{расширение: сжатые байты} для копий, которые имеет смысл хранить"""
+    variants = {'.gz': gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        variants['.br'] = brotli.compress(data, quality=11)
+    return {ext: blob for ext, blob in variants.items() if len(blob) < len(data) * MIN_COMPRESSION_RATIO}
+
+
+class CompressedManifestStorage(ManifestStaticFilesStorage):
+    """Хэш в именах файлов (manifest) + предварительно сжатые копии"""
+
+    # Без collectstatic (разработка, тесты) отдаём имена без хэша вместо ошибки
+    manifest_strict = False
+
+    def stored_name(self, name):
+        try:
+            return super().stored_name(name)
+        except ValueError:
+            return name
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run=dry_run, **options)
+        if dry_run:
+            return
+        names = list(paths) + list(self.hashed_files.values())
+        for name in names:
+            if os.path.splitext(name)[1].lower() not in COMPRESSIBLE_EXTENSIONS or not self.exists(name):
+                continue
+            with self.open(name) as f:
+                data = f.read()
+            for ext, blob in compress(data).items():
+                if self.exists(name + ext):
+                    self.delete(name + ext)
+                self._save(name + ext, ContentFile(blob))
+
+
+class StaticFile:
+    def __init__(self, path, immutable):
+        self.path = path
+        self.immutable = immutable
+        self.size = os.path.getsize(path)
+        self.content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        self.encodings = [
+            (encoding, path + ext) for encoding, ext in ENCODINGS if os.path.exists(path + ext)
+        ]
+        stat = os.stat(path)
+        self.etag = '"%s"' % hashlib.md5(f"{path}:{stat.st_size}:{stat.st_mtime_ns}".encode()).hexdigest()
+        self.contents = {}
+        self.lock = threading.Lock()
+
+    def choose(self, accept_encoding):
+        """(Content-Encoding или None, путь) по заголовку Accept-Encoding"""
+        accepted = {part.split(';')[0].strip() for part in accept_encoding.split(',')}
+        for encoding, path in self.encodings:
+            if encoding in accepted:
+                return encoding, path
+        return None, self.path
+
+    def read(self, path):
+        content = self.contents.get(path)
+        if content is None:
+            with open(path, 'rb') as f:
+                content = f.read()
+            if len(content) <= MAX_CACHED_FILE_SIZE:
+                with self.lock:
+                    self.contents[path] = content
+        return content
+
+
+class StaticFileIndex:
+    """URL-путь внутри STATIC_URL -> StaticFile; строится при первом обращении"""
+
+    def __init__(self, root):
+        self.root = root
+        self.files = None
+        self.lock = threading.Lock()
+
+    def lookup(self, name):
+        if self.files is None:
+            with self.lock:
+                if self.files is None:
+                    self.files = self.build()
+        return self.files.get(name)
+
+    def build(self):
+        files = {}
+        if not self.root or not os.path.isdir(self.root):
+            return files
+        hashed = set()
+        manifest = os.path.join(self.root, ManifestStaticFilesStorage.manifest_name)
+        if os.path.exists(manifest):
+            with open(manifest, encoding='utf-8') as f:
+                hashed = set(json.load(f).get('paths', {}).values())
+        compressed_exts = tuple(ext for _, ext in ENCODINGS)
+        for directory, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                if filename.endswith(compressed_exts):
+                    continue
+                path = os.path.join(directory, filename)
+                name = os.path.relpath(path, self.root).replace(os.sep, '/')
+                files[name] = StaticFile(path, immutable=name in hashed)
+        return files
+
+
+static_index = StaticFileIndex(getattr(settings, 'STATIC_ROOT', None))
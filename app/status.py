@@ -0,0 +1,253 @@
+"""
+Движок статуса серверов.
+
+Фоновый поток раз в STATUS_SAMPLE_INTERVAL секунд снимает нагрузку процесса и хоста
+(CPU, RSS, WebSocket-подключения, очередь channel layer, задержка БД) и хранит
+последний снимок в памяти. Раз в STATUS_FLUSH_SAMPLES снимков средняя нагрузка
+записывается одной пачкой в Server/Stat. Страница /status/ и /api/status/ читают
+только снимок в памяти и ничего не запрашивают у БД.
+
+Строка Server своя у каждого процесса ("<хост> #<STATUS_WORKER_ID или pid>"):
+несколько воркеров Daphne на одном хосте не затирают данные друг друга. Процесс
+без подключений за всё окно отмечается "Спит", при остановке - "Не в сети";
+строки остановленных процессов хоста удаляет первая запись нового процесса.
+"""
+
+import atexit
+import os
+import socket
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections, connection
+
+from .presence import presence
+
+STAT_ONLINE = 'Онлайн'
+STAT_SLEEPING = 'Спит'
+STAT_OFFLINE = 'Не в сети'
+
+# Порог "медленной" БД для статуса degraded (мс)
+DB_SLOW_MS = 200
+# Нагрузка, начиная с которой сервис считается перегруженным (%)
+HIGH_LOAD_PERCENT = 90
+
+
+def process_rss(pid=None):
+    """RSS процесса в байтах: psutil, если установлен, иначе /proc (Linux)"""
+    pid = pid or os.getpid()
+    try:
+        import psutil
+        return psutil.Process(pid).memory_info().rss
+    except ImportError:
+        pass
+    except Exception:
+        return None
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        return None
+    return None
+
+
+def host_load_percent():
+    """Загрузка CPU хоста в процентах (средняя за минуту / число ядер)"""
+    try:
+        load = os.getloadavg()[0]
+    except (AttributeError, OSError):
+        return None
+    return min(100, round(load / (os.cpu_count() or 1) * 100))
+
+
+def channel_layer_depth():
+    """Сообщения, ожидающие в очередях InMemoryChannelLayer (для других слоёв - None)"""
+    from channels.layers import get_channel_layer
+
+    layer = get_channel_layer()
+    channels = getattr(layer, 'channels', None)
+    if channels is None:
+        return None
+    return sum(queue.qsize() for queue in list(channels.values()))
+
+
+def websocket_connections():
+    from .consumers import ChatConsumer
+
+    return ChatConsumer.connections
+
+
+def db_latency_ms():
+    """Задержка пробного запроса SELECT 1 (мс) или None, если БД недоступна"""
+    started = time.perf_counter()
+    try:
+        close_old_connections()
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1")
+            cursor.fetchone()
+    except Exception:
+        return None
+    return round((time.perf_counter() - started) * 1000, 3)
+
+
+class StatusEngine:
+    def __init__(self, interval, flush_samples, server_name, worker_id=None):
+        self.interval = interval
+        self.flush_samples = flush_samples
+        self.host_name = server_name
+        self.server_name = f"{server_name} #{worker_id or os.getpid()}"
+        self.snapshot = None
+        self.servers = None
+        self.samples = []
+        self.lock = threading.Lock()
+        self.thread = None
+        self.stopped = threading.Event()
+        self.last_cpu = (time.perf_counter(), time.process_time())
+
+    def start(self):
+        if self.thread is not None:
+            return
+        self.thread = threading.Thread(target=self.run, name='status-engine', daemon=True)
+        self.thread.start()
+        atexit.register(self.stop)
+
+    def stop(self):
+        """Останавливает съём и отмечает процесс "Не в сети" (вызывается и при выходе)"""
+        if self.stopped.is_set():
+            return
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join(self.interval)
+        self.write_server(STAT_OFFLINE, 0)
+
+    def run(self):
+        while not self.stopped.is_set():
+            sample = self.sample()
+            with self.lock:
+                self.snapshot = sample
+            self.samples.append(sample)
+            if len(self.samples) >= self.flush_samples or self.servers is None:
+                self.flush()
+            self.stopped.wait(self.interval)
+
+    def process_cpu_percent(self):
+        wall, cpu = time.perf_counter(), time.process_time()
+        last_wall, last_cpu = self.last_cpu
+        self.last_cpu = (wall, cpu)
+        if wall <= last_wall:
+            return 0
+        return min(100, round((cpu - last_cpu) / (wall - last_wall) * 100))
+
+    def sample(self):
+        process_cpu = self.process_cpu_percent()
+        host_load = host_load_percent()
+        return {
+            'sampled_at': time.time(),
+            'process_cpu_percent': process_cpu,
+            'host_load_percent': host_load,
+            'load_percentage': host_load if host_load is not None else process_cpu,
+            'rss_bytes': process_rss(),
+            'websocket_connections': websocket_connections(),
+            'online_users': presence.online_count(),
+            'channel_queue_depth': channel_layer_depth(),
+            'db_latency_ms': db_latency_ms(),
+        }
+
+    def flush(self):
+        """Пишет среднюю нагрузку за окно в Server и перечитывает список серверов"""
+        samples, self.samples = self.samples, []
+        loads = [sample['load_percentage'] for sample in samples]
+        load = round(sum(loads) / len(loads)) if loads else 0
+        idle = all(not sample['websocket_connections'] for sample in samples)
+        self.write_server(STAT_SLEEPING if idle else STAT_ONLINE, load)
+
+    def write_server(self, stat_name, load):
+        from .models import Server, Stat
+
+        try:
+            close_old_connections()
+            if self.servers is None:
+                # Первая запись процесса: строки остановленных процессов этого хоста больше не нужны
+                Server.objects.filter(
+                    name__startswith=f"{self.host_name} #", status__name=STAT_OFFLINE,
+                ).exclude(name=self.server_name).delete()
+            stat, _ = Stat.objects.get_or_create(name=stat_name)
+            Server.objects.update_or_create(
+                name=self.server_name,
+                defaults={'status': stat, 'load_percentage': load},
+            )
+            servers = list(Server.objects.select_related('status').order_by('name'))
+        except Exception:
+            return
+        with self.lock:
+            self.servers = servers
+
+    def get_snapshot(self):
+        with self.lock:
+            return self.snapshot, self.servers
+
+    def status_data(self):
+        """Данные для status.html и /api/status/"""
+        snapshot, _ = self.get_snapshot()
+        if snapshot is None or time.time() - snapshot['sampled_at'] > self.interval * 3:
+            return offline_status()
+
+        load = snapshot['load_percentage']
+        messages = service(
+            'fa-server', "Сервер сообщений",
+            'degraded' if load >= HIGH_LOAD_PERCENT else 'operational',
+            f"Онлайн: {snapshot['online_users']}, подключений: {snapshot['websocket_connections']}, нагрузка {load}%",
+        )
+
+        latency = snapshot['db_latency_ms']
+        if latency is None:
+            database = service('fa-database', "База данных", 'outage', "Недоступна")
+        else:
+            database = service(
+                'fa-database', "База данных",
+                'degraded' if latency >= DB_SLOW_MS else 'operational',
+                f"Задержка {latency:.1f} мс",
+            )
+
+        media_ok = os.access(settings.MEDIA_ROOT, os.W_OK)
+        storage = service(
+            'fa-cloud', "Облачное хранилище",
+            'operational' if media_ok else 'outage',
+            "Работает" if media_ok else "Недоступно",
+        )
+
+        services = [messages, database, storage]
+        overall = 'operational' if all(s['status'] == 'operational' for s in services) else 'outage'
+        return {
+            "overall": overall,
+            "overall_status": "Все системы работают." if overall == 'operational' else "Есть проблемы.",
+            "services": services,
+            "metrics": snapshot,
+        }
+
+
+def service(icon, name, status, status_text):
+    return {"icon": icon, "name": name, "status": status, "status_text": status_text}
+
+
+def offline_status():
+    return {
+        "overall": "outage",
+        "overall_status": "Не в сети.",
+        "services": [
+            service('fa-server', "Сервер сообщений", 'outage', "Выключен..."),
+            service('fa-database', "База данных", 'outage', "Выключена..."),
+            service('fa-cloud', "Облачное хранилище", 'outage', "Выключено..."),
+        ],
+    }
+
+
+status_engine = StatusEngine(
+    interval=getattr(settings, 'STATUS_SAMPLE_INTERVAL', 5),
+    flush_samples=getattr(settings, 'STATUS_FLUSH_SAMPLES', 12),
+    server_name=getattr(settings, 'STATUS_SERVER_NAME', socket.gethostname()),
+    worker_id=getattr(settings, 'STATUS_WORKER_ID', None),
+)
@@ -0,0 +1,135 @@
+"""
+Превью изображений из вложений.
+
+Превью строятся в небольшом пуле потоков (THUMBNAIL_WORKERS), а не в
+обработчике запроса: после загрузки вложение только ставится в очередь.
+Очередь ограничена THUMBNAIL_MAX_PENDING задачами - при переполнении задача
+отбрасывается и будет поставлена снова при первом запросе превью.
+Готовые превью лежат на диске по ключу (размер, SHA-256), поэтому одинаковые
+картинки обрабатываются один раз, а ответ можно кэшировать бессрочно.
+Содержимое по SHA-256 не меняется, поэтому файл, который не разбирается как
+изображение (битый или не картинка под image/*), запоминается и больше в
+очередь не ставится: эндпоинт сразу отвечает 415. Прочие ошибки только
+логируются, и следующий запрос ставит построение снова.
+
+Нужен Pillow; без него превью не строятся и эндпоинт отвечает 404.
+"""
+
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+from .attachments import attachments_root, blob_path
+
+logger = logging.getLogger(__name__)
+
+try:
+    from PIL import Image, ImageOps, UnidentifiedImageError
+except ImportError:
+    Image = None
+
+# Ошибки разбора самого файла: повторять бесполезно. Остальное (нет места,
+# блоб ещё пишется, права на каталог) временно - построение повторит следующий запрос
+UNDECODABLE_ERRORS = (UnidentifiedImageError, Image.DecompressionBombError, SyntaxError, ValueError) if Image else ()
+
+THUMBNAIL_FORMAT = 'webp'
+THUMBNAIL_CONTENT_TYPE = 'image/webp'
+
+
+def is_image(attachment):
+    return attachment.content_type.startswith('image/')
+
+
+def thumbnail_path(sha256, size):
+    return os.path.join(attachments_root(), 'thumbs', str(size), sha256[:2], f"{sha256}.{THUMBNAIL_FORMAT}")
+
+
+def render_thumbnail(source, target, size):
+    with Image.open(source) as image:
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((size, size))
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        # Пишем во временный файл: читатели никогда не увидят недописанное превью
+        tmp = f"{target}.{threading.get_ident()}.tmp"
+        image.save(tmp, format=THUMBNAIL_FORMAT, quality=80)
+        os.replace(tmp, target)
+
+
+class ThumbnailPipeline:
+    def __init__(self, sizes, workers=2, max_pending=32):
+        self.sizes = sorted(sizes)
+        self.workers = workers
+        self.max_pending = max_pending
+        self.executor = None
+        self.pending = set()  # SHA-256 в очереди или в работе
+        self.failed = set()  # SHA-256, из которых превью не строится
+        self.lock = threading.Lock()
+
+    def available(self):
+        return Image is not None
+
+    def schedule(self, attachment):
+        """Ставит построение всех размеров в очередь; False - очередь полна или не нужно"""
+        if not self.available() or not is_image(attachment):
+            return False
+        sha256 = attachment.sha256
+        with self.lock:
+            if sha256 in self.failed:
+                return False
+            if sha256 in self.pending:
+                return True
+            if len(self.pending) >= self.max_pending:
+                logger.warning("⚠️ Очередь превью переполнена, %s отложено", sha256[:12])
+                return False
+            self.pending.add(sha256)
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='thumbnails')
+        self.executor.submit(self.generate, sha256)
+        return True
+
+    def generate(self, sha256):
+        try:
+            source = blob_path(sha256)
+            for size in self.sizes:
+                target = thumbnail_path(sha256, size)
+                if not os.path.exists(target):
+                    render_thumbnail(source, target, size)
+        except UNDECODABLE_ERRORS:
+            logger.warning("⚠️ Вложение %s не читается как изображение", sha256[:12], exc_info=True)
+            with self.lock:
+                self.failed.add(sha256)
+        except Exception:
+            logger.exception("❌ Ошибка построения превью %s", sha256[:12])
+        finally:
+            with self.lock:
+                self.pending.discard(sha256)
+
+    def has_failed(self, attachment):
+        return attachment.sha256 in self.failed
+
+    def size_bucket(self, requested):
+        """Запрошенный размер -> ближайший допустимый сверху (или наибольший)"""
+        for size in self.sizes:
+            if requested <= size:
+                return size
+        return self.sizes[-1]
+
+    def get(self, attachment, size):
+        """Путь к готовому превью или None (тогда построение поставлено в очередь)"""
+        path = thumbnail_path(attachment.sha256, self.size_bucket(size))
+        if os.path.exists(path):
+            return path
+        self.schedule(attachment)
+        return None
+
+
+thumbnails = ThumbnailPipeline(
+    sizes=getattr(settings, 'THUMBNAIL_SIZES', (64, 256, 1024)),
+    workers=getattr(settings, 'THUMBNAIL_WORKERS', 2),
+    max_pending=getattr(settings, 'THUMBNAIL_MAX_PENDING', 32),
+)
@@ -5,21 +5,33 @@ from .views import (
     home_view,
     profile_view,
     register_view,
-    api_users_view,
+    UserDirectoryView,
+    UserMeView,
+    EmailOrUsernameObtainAuthToken,
+    TokenRotateView,
     unauthorized_view,
     download_view,
     download_file,
     logout_view,
-    ChatMessageListCreate,
-    UserDetailView,
+    message_list_view,
+    MessageDetailView,
+    MessageChangesView,
+    MessageThreadView,
+    UnreadView,
+    user_detail_view,
     coming_view,
     about,
     career,
     support,
     status,
-    contact
+    contact,
+    metrics_view,
+    status_api_view,
+    UploadCreateView,
+    UploadDetailView,
+    AttachmentDownloadView,
+    AttachmentThumbnailView
 )
-from rest_framework.authtoken.views import obtain_auth_token
 
 
 urlpatterns = [
@@ -28,17 +40,33 @@ urlpatterns = [
     path('register/', register_view, name='register'),
     path('login/', LoginView.as_view(template_name='login.html'), name='login'),
     path('logout/', logout_view, name='logout'),
-    path('api/users/', api_users_view, name='api_users'),
-    path('api/messages/', ChatMessageListCreate.as_view(), name='message-list'),
+    path('api/users/', UserDirectoryView.as_view(), name='api_users'),
+    path('api/users/me/', UserMeView.as_view(), name='user-me'),
+    path('api/messages/', message_list_view, name='message-list'),
+    path('api/messages/changes/', MessageChangesView.as_view(), name='message-changes'),
+    path('api/messages/<int:message_id>/', MessageDetailView.as_view(), name='message-detail'),
+    path('api/messages/<int:message_id>/thread/', MessageThreadView.as_view(), name='message-thread'),
+    path('api/unread/', UnreadView.as_view(), name='unread'),
+    path('api/uploads/', UploadCreateView.as_view(), name='upload-create'),
+    path('api/uploads/<uuid:upload_id>/', UploadDetailView.as_view(), name='upload-detail'),
+    path('api/attachments/<int:attachment_id>/', AttachmentDownloadView.as_view(), name='attachment-download'),
+    path(
+        'api/attachments/<int:attachment_id>/thumbnail/',
+        AttachmentThumbnailView.as_view(),
+        name='attachment-thumbnail',
+    ),
     path('unauthorized/', unauthorized_view, name='unauthorized'),
     path('download/', download_view, name='download'),
     path('download/windows/', download_file, name='download_windows'),
-    path('api-token-auth/', obtain_auth_token, name='api_token_auth'),
-    path("api/users/<str:username>/", UserDetailView.as_view(), name="user-detail"),
+    path('api-token-auth/', EmailOrUsernameObtainAuthToken.as_view(), name='api_token_auth'),
+    path('api/token/rotate/', TokenRotateView.as_view(), name='token-rotate'),
+    path("api/users/<str:username>/", user_detail_view, name="user-detail"),
     path('coming/', coming_view, name='coming'),
     path('about/', about, name='about'),
     path('career/', career, name='career'),
     path('support/', support, name='support'),
     path('status/', status, name='status'),
+    path('api/status/', status_api_view, name='api_status'),
     path('contact/', contact, name='contact'),
+    path('metrics/', metrics_view, name='metrics'),
 ]
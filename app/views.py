@@ -1,6 +1,8 @@
 from django.shortcuts import render, redirect
-from django.http import HttpResponse, JsonResponse
-from django.core.serializers import serialize
+from django.http import HttpResponse, JsonResponse, FileResponse, StreamingHttpResponse
+from django.utils.http import content_disposition_header
+from django.views.decorators.csrf import csrf_exempt
+from asgiref.sync import sync_to_async
 from .forms import RegistrationForm
 from .models import CustomUser, Server
 import os
@@ -9,24 +11,40 @@ from django.http import HttpResponse
 from django.contrib.auth import logout, login
 from rest_framework import generics
 from .models import ChatMessage
-from .serializers import ChatMessageSerializer
+from .serializers import ChatMessageSerializer, EmailOrUsernameAuthTokenSerializer
+from .archive import amessage_history
+from .authentication import aauthenticate_token, unauthorized, rotate_token, token_expired
+from .caching import cached_page, site_counters, asite_counters
+from . import attachments
+from . import edits
+from . import replies
+from .receipts import unread_state, DEFAULT_ROOM
+from .thumbnails import thumbnails, THUMBNAIL_CONTENT_TYPE
+from .models import Attachment, UploadSession
+from . import metrics
+from .status import status_engine
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.authtoken.models import Token
-from django.contrib.auth.models import User
+from rest_framework.authtoken.views import ObtainAuthToken
 from rest_framework.response import Response
 from rest_framework.views import APIView
-from rest_framework import status
+from rest_framework import status as drf_status  # имя status занято представлением ниже
 
 
-def home_view(request):
-    user = request.user
-    users = len(CustomUser.objects.all())
-    messages = len(ChatMessage.objects.all())
-    return render(request, 'home.html', context={'user': user, 'messages': messages, 'users': users})
+async def home_view(request):
+    # Пользователь загружается заранее: шаблон не должен трогать БД из event loop
+    user = await request.auser()
+    # Счётчики из кэша, без COUNT(*) на каждый показ главной
+    counters = await asite_counters()
+    return render(request, 'home.html', context={
+        'user': user,
+        'messages': counters['messages'],
+        'users': counters['users'],
+    })
 
 def profile_view(request):
     user = request.user
-    msgs = ChatMessage.objects.filter(user=request.user).count()
+    msgs = ChatMessage.objects.filter(user=request.user, deleted_at__isnull=True).count()
     return render(request, 'profile.html', {'user': user, 'msgs': msgs})
 
 def register_view(request):
@@ -41,6 +59,7 @@ def register_view(request):
         form = RegistrationForm()
     return render(request, 'register.html', {'form': form})
 
+@cached_page()
 def download_view(request):
     return render(request, 'download.html')
 
@@ -62,10 +81,81 @@ def download_file(request):
         return response
 
 
-def api_users_view(request):
-    users = CustomUser.objects.all()
-    data = serialize('json', users, fields=('username', 'email', 'password'))
-    return JsonResponse({'users': data})
+# Поля, которые можно запросить через ?fields= (пароль и служебные - никогда)
+USER_DIRECTORY_FIELDS = ('id', 'username', 'email', 'date_joined')
+USER_DIRECTORY_DEFAULT_FIELDS = ('id', 'username')
+USER_DIRECTORY_PAGE_SIZE = 50
+USER_DIRECTORY_MAX_PAGE_SIZE = 200
+
+class UserDirectoryView(APIView):
+    """Каталог пользователей по алфавиту.
+
+    ?after=<username> - следующая страница (keyset: username > after),
+    ?q=<префикс> - поиск по началу имени (диапазон по уникальному индексу username),
+    ?fields=id,username,email - только нужные поля, ?limit= - размер страницы.
+    """
+
+    def get(self, request):
+        fields = request.query_params.get('fields')
+        fields = tuple(fields.split(',')) if fields else USER_DIRECTORY_DEFAULT_FIELDS
+        unknown = set(fields) - set(USER_DIRECTORY_FIELDS)
+        if unknown:
+            return Response(
+                {"error": f"unknown fields: {', '.join(sorted(unknown))}"},
+                status=drf_status.HTTP_400_BAD_REQUEST,
+            )
+        try:
+            limit = min(int(request.query_params.get('limit', USER_DIRECTORY_PAGE_SIZE)), USER_DIRECTORY_MAX_PAGE_SIZE)
+        except ValueError:
+            return Response({"error": "limit must be an integer"}, status=drf_status.HTTP_400_BAD_REQUEST)
+        if limit < 1:
+            return Response({"error": "limit must be positive"}, status=drf_status.HTTP_400_BAD_REQUEST)
+
+        users = CustomUser.objects.order_by('username')
+        prefix = request.query_params.get('q')
+        if prefix:
+            # Диапазон вместо LIKE: в SQLite LIKE без учёта регистра не использует индекс
+            users = users.filter(username__gte=prefix, username__lt=prefix + '\U0010ffff')
+        after = request.query_params.get('after')
+        if after:
+            users = users.filter(username__gt=after)
+
+        # username нужен для курсора, даже если его не запросили
+        rows = list(users.values(*dict.fromkeys(fields + ('username',)))[:limit + 1])
+        has_next = len(rows) > limit
+        rows = rows[:limit]
+        cursor = rows[-1]['username'] if has_next else None
+        if 'username' not in fields:
+            for row in rows:
+                del row['username']
+        return Response({"results": rows, "next": cursor})
+
+class UserMeView(APIView):
+    """Текущий пользователь по токену: без запросов сверх аутентификации"""
+
+    def get(self, request):
+        user = request.user
+        return Response({"id": user.id, "username": user.username, "email": user.email})
+
+class EmailOrUsernameObtainAuthToken(ObtainAuthToken):
+    """Токен по имени или email; в ответе - настоящее имя пользователя"""
+    serializer_class = EmailOrUsernameAuthTokenSerializer
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        user = serializer.validated_data['user']
+        token, _ = Token.objects.get_or_create(user=user)
+        if token_expired(token.created):
+            token = rotate_token(user)
+        return Response({"token": token.key, "username": user.username})
+
+class TokenRotateView(APIView):
+    """Новый токен взамен текущего (старый сразу перестаёт действовать)"""
+
+    def post(self, request):
+        token = rotate_token(request.user)
+        return Response({"token": token.key, "username": request.user.username})
 
 def unauthorized_view(request):
     return render(request, 'unauthorized.html')
@@ -74,65 +164,277 @@ def logout_view(request):
     logout(request)
     return redirect('home')
 
+@cached_page()
 def coming_view(request):
     return render(request, 'coming.html')
 
-class ChatMessageListCreate(generics.ListCreateAPIView):
+class ChatMessageCreate(generics.CreateAPIView):
     permission_classes = [IsAuthenticated]  # Добавить эту строку
-    queryset = ChatMessage.objects.all().order_by('-created_at')[:100]
+    queryset = ChatMessage.objects.all()
     serializer_class = ChatMessageSerializer
 
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
 
-class UserDetailView(APIView):
-    def get(self, request, username):
+chat_message_create = ChatMessageCreate.as_view()
+
+@csrf_exempt  # как и у представлений DRF: доступ только по токену
+async def message_list_view(request):
+    """GET - страница истории (async ORM), остальное - ChatMessageCreate (DRF, синхронно)"""
+    if request.method != 'GET':
+        return await sync_to_async(chat_message_create)(request)
+    if await aauthenticate_token(request) is None:
+        return unauthorized()
+
+    # ?before=<id> - листание истории назад, прозрачно захватывает архив
+    before = request.GET.get('before')
+    try:
+        before = int(before) if before else None
+    except ValueError:
+        return JsonResponse({"error": "before must be a message id"}, status=400)
+    # user и attachment уже подгружены select_related: сериализация не ходит в БД
+    data = ChatMessageSerializer(await amessage_history(before=before), many=True).data
+    return JsonResponse(data, safe=False)
+
+class MessageDetailView(APIView):
+    """Правка (PATCH {text, version}) и удаление (DELETE) своего сообщения"""
+
+    def get_message(self, request, message_id):
+        # Править можно только живые сообщения горячей таблицы: архив неизменяем
+        return ChatMessage.objects.filter(
+            pk=message_id, user=request.user, deleted_at__isnull=True,
+        ).first()
+
+    def patch(self, request, message_id):
+        message = self.get_message(request, message_id)
+        if message is None:
+            return Response({"error": "Message not found"}, status=drf_status.HTTP_404_NOT_FOUND)
+        text = request.data.get('text')
+        if not isinstance(text, str) or not text:
+            return Response({"error": "text is required"}, status=drf_status.HTTP_400_BAD_REQUEST)
+        # version - версия, которую видел клиент; без неё правится текущая
+        version = request.data.get('version')
+        if version is not None and str(version) != str(message.version):
+            return Response(edits.message_delta(message), status=drf_status.HTTP_409_CONFLICT)
         try:
-            user = CustomUser.objects.get(username=username)
-            return Response({
-                "username": user.username,
-                "email": user.email
-            })
-        except User.DoesNotExist:
-            return Response({"error": "User not found"}, status=status.HTTP_404_NOT_FOUND)
+            edits.edit_message(message, text)
+        except edits.VersionConflict:
+            message.refresh_from_db()
+            return Response(edits.message_delta(message), status=drf_status.HTTP_409_CONFLICT)
+        return Response(edits.message_delta(message))
+
+    def delete(self, request, message_id):
+        message = self.get_message(request, message_id)
+        if message is None:
+            return Response({"error": "Message not found"}, status=drf_status.HTTP_404_NOT_FOUND)
+        try:
+            edits.delete_message(message)
+        except edits.VersionConflict:
+            message.refresh_from_db()
+            return Response(edits.message_delta(message), status=drf_status.HTTP_409_CONFLICT)
+        return Response(status=drf_status.HTTP_204_NO_CONTENT)
+
+class MessageThreadView(APIView):
+    """Цепочка ответов от корня до сообщения (один рекурсивный запрос)"""
+
+    def get(self, request, message_id):
+        messages = replies.thread(message_id)
+        if not messages:
+            return Response({"error": "Message not found"}, status=drf_status.HTTP_404_NOT_FOUND)
+        return Response({"messages": messages})
+
+class MessageChangesView(APIView):
+    """Правки и удаления после курсора: ?since=<cursor>; без since - только текущий курсор"""
+
+    def get(self, request):
+        since = request.query_params.get('since')
+        if since is None:
+            return Response({"changes": [], "cursor": edits.current_cursor(), "has_more": False})
+        try:
+            since = int(since)
+        except ValueError:
+            return Response({"error": "since must be an integer"}, status=drf_status.HTTP_400_BAD_REQUEST)
+        changes, cursor, has_more = edits.changes_since(since)
+        return Response({"changes": changes, "cursor": cursor, "has_more": has_more})
+
+class UnreadView(APIView):
+    """Непрочитанные по комнатам для значков при запуске клиента (из кэша или один запрос)"""
+
+    def get(self, request):
+        return Response({"rooms": {DEFAULT_ROOM: unread_state(request.user.id, DEFAULT_ROOM)}})
 
+async def user_detail_view(request, username):
+    if await aauthenticate_token(request) is None:
+        return unauthorized()
+    try:
+        user = await CustomUser.objects.aget(username=username)
+    except CustomUser.DoesNotExist:
+        return JsonResponse({"error": "User not found"}, status=404)
+    return JsonResponse({
+        "username": user.username,
+        "email": user.email
+    })
+
+class UploadCreateView(APIView):
+    """Начало загрузки вложения: {filename, size, content_type} -> id сессии"""
+
+    def post(self, request):
+        try:
+            size = int(request.data.get('size', 0))
+        except (TypeError, ValueError):
+            return Response({"error": "size must be an integer"}, status=drf_status.HTTP_400_BAD_REQUEST)
+        try:
+            session = attachments.start_upload(
+                request.user,
+                request.data.get('filename', ''),
+                size,
+                request.data.get('content_type'),
+            )
+        except attachments.UploadError as e:
+            return Response({"error": str(e)}, status=e.status)
+        return Response({
+            "id": str(session.id),
+            "offset": 0,
+            "size": session.size,
+            "chunk_size": settings.ATTACHMENT_CHUNK_SIZE,
+        }, status=drf_status.HTTP_201_CREATED)
+
+class UploadDetailView(APIView):
+    """GET - сколько уже загружено (для докачки), PUT - следующий кусок (Upload-Offset)"""
+
+    def get_session(self, request, upload_id):
+        return UploadSession.objects.filter(pk=upload_id, user=request.user).first()
+
+    def get(self, request, upload_id):
+        session = self.get_session(request, upload_id)
+        if session is None:
+            return Response({"error": "Upload not found"}, status=drf_status.HTTP_404_NOT_FOUND)
+        return Response({"id": str(session.id), "offset": session.received, "size": session.size})
+
+    def put(self, request, upload_id):
+        session = self.get_session(request, upload_id)
+        if session is None:
+            return Response({"error": "Upload not found"}, status=drf_status.HTTP_404_NOT_FOUND)
+        try:
+            offset = int(request.headers.get('Upload-Offset', ''))
+            length = int(request.headers.get('Content-Length', ''))
+        except ValueError:
+            return Response(
+                {"error": "Upload-Offset and Content-Length are required"},
+                status=drf_status.HTTP_400_BAD_REQUEST,
+            )
+        try:
+            # Тело читается потоком из запроса, request.data не трогаем
+            received = attachments.write_chunk(session, offset, request.stream, length)
+        except attachments.UploadError as e:
+            return Response({"error": str(e), "offset": session.received}, status=e.status)
+
+        if received < session.size:
+            return Response({"id": str(session.id), "offset": received, "size": session.size})
+        attachment = attachments.finish_upload(session)
+        thumbnails.schedule(attachment)  # превью строятся в фоне, ответ их не ждёт
+        return Response(attachments.attachment_data(attachment), status=drf_status.HTTP_201_CREATED)
+
+class AttachmentDownloadView(APIView):
+    """Скачивание вложения потоком, с поддержкой Range для докачки"""
+
+    def get(self, request, attachment_id):
+        attachment = Attachment.objects.filter(pk=attachment_id).first()
+        path = attachments.blob_path(attachment.sha256) if attachment else None
+        if attachment is None or not os.path.exists(path):
+            return Response({"error": "Attachment not found"}, status=drf_status.HTTP_404_NOT_FOUND)
+
+        size = attachment.size
+        try:
+            byte_range = attachments.parse_range(request.headers.get('Range'), size)
+        except attachments.RangeNotSatisfiable:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f"bytes */{size}"
+            return response
+
+        # Асинхронный генератор: под ASGI файл уходит блоками, а не собирается в памяти
+        start, end = byte_range or (0, size - 1)
+        response = StreamingHttpResponse(
+            attachments.aiter_file(path, start, end - start + 1),
+            status=200 if byte_range is None else 206,
+            content_type=attachment.content_type,
+        )
+        response['Content-Length'] = str(end - start + 1)
+        if byte_range is not None:
+            response['Content-Range'] = f"bytes {start}-{end}/{size}"
+        response['Content-Disposition'] = content_disposition_header(True, attachment.filename)
+        response['Accept-Ranges'] = 'bytes'
+        # Содержимое вложения по id никогда не меняется
+        response['ETag'] = f'"{attachment.sha256}"'
+        response['Cache-Control'] = 'private, max-age=31536000, immutable'
+        return response
+
+class AttachmentThumbnailView(APIView):
+    """Превью изображения: ?size=<px> округляется до размера из THUMBNAIL_SIZES"""
+
+    def get(self, request, attachment_id):
+        attachment = Attachment.objects.filter(pk=attachment_id).first()
+        if attachment is None or not attachment.content_type.startswith('image/'):
+            return Response({"error": "Thumbnail not found"}, status=drf_status.HTTP_404_NOT_FOUND)
+        try:
+            size = int(request.query_params.get('size', 256))
+        except ValueError:
+            return Response({"error": "size must be an integer"}, status=drf_status.HTTP_400_BAD_REQUEST)
+
+        path = thumbnails.get(attachment, size)
+        if path is None:
+            if not thumbnails.available():
+                return Response({"error": "Thumbnails are disabled"}, status=drf_status.HTTP_404_NOT_FOUND)
+            if thumbnails.has_failed(attachment):
+                # Повторять бесполезно: содержимое вложения не изменится
+                return Response(
+                    {"error": "Attachment is not a readable image"},
+                    status=drf_status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+                )
+            # Превью ещё строится: клиент повторит запрос
+            response = Response({"status": "pending"}, status=drf_status.HTTP_202_ACCEPTED)
+            response['Retry-After'] = '1'
+            return response
+
+        etag = f'"{attachment.sha256}-{thumbnails.size_bucket(size)}"'
+        if request.headers.get('If-None-Match') == etag:
+            response = HttpResponse(status=304)
+        else:
+            response = FileResponse(open(path, 'rb'), content_type=THUMBNAIL_CONTENT_TYPE)
+        response['ETag'] = etag
+        response['Cache-Control'] = 'private, max-age=31536000, immutable'
+        return response
+
+@cached_page(counters=('users',))
 def about(request):
-    users = len(CustomUser.objects.all())
-    return render(request, 'about.html', {'users': users})
+    return render(request, 'about.html', {'users': site_counters()['users']})
 
+@cached_page()
 def career(request):
     return render(request, 'career.html')
 
+@cached_page()
 def support(request):
     return render(request, 'support.html')
 
 def status(request):
-    servers = Server.objects.all()
-    status_data = {
-        "overall": "outage",
-        "overall_status": "Не в сети.",
-        "services": [
-            {
-                "icon": "fa-server",
-                "name": "Сервер сообщений",
-                "status": "outage",
-                "status_text": "Выключен..."
-            },
-            {
-                "icon": "fa-database",
-                "name": "База данных",
-                "status": "outage",
-                "status_text": "Выключена..."
-            },
-            {
-                "icon": "fa-cloud",
-                "name": "Облачное хранилище",
-                "status": "outage",
-                "status_text": "Выключено..."
-            }
-        ]
-    }
+    # Снимок из памяти фонового StatusEngine; без него (WSGI, тесты) - список серверов из БД
+    status_data = status_engine.status_data()
+    _, servers = status_engine.get_snapshot()
+    if servers is None:
+        servers = Server.objects.select_related('status')
     return render(request, 'status.html', {'status': status_data, 'servers': servers})
 
+def status_api_view(request):
+    """Статус сервисов и метрики нагрузки в JSON"""
+    return JsonResponse(status_engine.status_data())
+
+@cached_page()
 def contact(request):
-    return render(request, 'contact.html')
\ No newline at end of file
+    return render(request, 'contact.html')
+
+def metrics_view(request):
+    """Метрики в текстовом формате Prometheus: для staff и METRICS_ALLOWED_IPS"""
+    if request.META.get('REMOTE_ADDR') not in settings.METRICS_ALLOWED_IPS and not request.user.is_staff:
+        return HttpResponse("Forbidden", status=403, content_type='text/plain; charset=utf-8')
+    return HttpResponse(metrics.exposition(), content_type='text/plain; version=0.0.4; charset=utf-8')
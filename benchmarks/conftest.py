@@ -0,0 +1,107 @@
+"""
+Общие фикстуры бенчмарков.
+
+Объём данных задаётся переменными окружения (по умолчанию 10k):
+    BENCH_USERS=1000000 BENCH_MESSAGES=1000000 python -m pytest
+
+Бюджеты задержки умножаются на BENCH_LATENCY_FACTOR (для медленных CI-машин).
+Для сравнения с прошлым релизом:
+    python -m pytest --benchmark-autosave
+    python -m pytest --benchmark-compare --benchmark-compare-fail=mean:20%
+"""
+
+import os
+
+import pytest
+from django.contrib.auth.hashers import make_password
+from django.core.cache import cache
+from rest_framework.authtoken.models import Token
+
+from app.authentication import token_cache
+from app.models import ChatMessage, CustomUser
+
+BENCH_USERS = int(os.environ.get('BENCH_USERS', 10_000))
+BENCH_MESSAGES = int(os.environ.get('BENCH_MESSAGES', 10_000))
+LATENCY_FACTOR = float(os.environ.get('BENCH_LATENCY_FACTOR', 1.0))
+BATCH_SIZE = 5000
+
+BENCH_USERNAME = 'bench_user_0'
+BENCH_PASSWORD = 'bench-password'
+
+
+def user_factory(count, prefix='bench_user'):
+    """Массовое создание пользователей (один хэш пароля на всех)"""
+    password = make_password(BENCH_PASSWORD)
+    CustomUser.objects.bulk_create(
+        (CustomUser(username=f"{prefix}_{i}", password=password) for i in range(count)),
+        batch_size=BATCH_SIZE,
+    )
+    return list(CustomUser.objects.filter(username__startswith=prefix).values_list('id', flat=True))
+
+
+def message_factory(user_ids, count):
+    """Массовое создание сообщений, равномерно по пользователям"""
+    ChatMessage.objects.bulk_create(
+        (ChatMessage(user_id=user_ids[i % len(user_ids)], text=f"message {i}") for i in range(count)),
+        batch_size=BATCH_SIZE,
+    )
+
+
+@pytest.fixture(scope='session')
+def django_db_setup(django_db_setup, django_db_blocker):
+    """Заполняет тестовую базу один раз на всю сессию"""
+    with django_db_blocker.unblock():
+        user_ids = user_factory(max(BENCH_USERS, 1))
+        message_factory(user_ids, BENCH_MESSAGES)
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    """Кэши не переживают тест: данные тестов откатываются"""
+    cache.clear()
+    token_cache.clear()
+    yield
+    cache.clear()
+    token_cache.clear()
+
+
+@pytest.fixture
+def bench_user(db):
+    return CustomUser.objects.get(username=BENCH_USERNAME)
+
+
+@pytest.fixture
+def user_client(client, bench_user):
+    client.force_login(bench_user)
+    return client
+
+
+@pytest.fixture
+def token_client(bench_user):
+    from rest_framework.test import APIClient
+
+    token, _ = Token.objects.get_or_create(user=bench_user)
+    api_client = APIClient()
+    api_client.credentials(HTTP_AUTHORIZATION=f"Token {token.key}")
+    return api_client
+
+
+@pytest.fixture
+def check_view(benchmark, django_assert_num_queries):
+    """Проверяет число запросов одного вызова, затем замеряет и сравнивает с бюджетом"""
+
+    def check(client, url, num_queries, budget_ms, status=200):
+        client.get(url)  # прогрев: сессия, кэши шаблонов
+        with django_assert_num_queries(num_queries):
+            response = client.get(url)
+        assert response.status_code == status
+
+        benchmark(client.get, url)
+        if benchmark.stats is not None:
+            mean_ms = benchmark.stats.stats.mean * 1000
+            assert mean_ms < budget_ms * LATENCY_FACTOR, (
+                f"{url}: {mean_ms:.1f} мс при бюджете {budget_ms * LATENCY_FACTOR:.1f} мс"
+            )
+        return response
+
+    return check
@@ -0,0 +1,37 @@
+"""
+Модули настольного клиента (media/prog), не зависящие от Flet.
+"""
+
+import importlib.util
+import os
+
+import pytest
+
+CLIENT_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'media', 'prog')
+
+
+def client_module(name):
+    spec = importlib.util.spec_from_file_location(f"client_{name}", os.path.join(CLIENT_DIR, f"{name}.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture
+def outbox(tmp_path):
+    return client_module('outbox').Outbox(str(tmp_path / 'outbox.sqlite3'))
+
+
+def test_outbox_survives_restart(outbox, tmp_path):
+    first = outbox.put({"text": "a"})
+    second = outbox.put({"text": "b", "client_id": "fixed"})
+    outbox.put(second)  # повторная постановка того же сообщения не дублирует его
+    assert first["client_id"] and second["client_id"] == "fixed"
+
+    # после перезапуска клиента очередь на месте и в порядке постановки
+    restarted = client_module('outbox').Outbox(str(tmp_path / 'outbox.sqlite3'))
+    assert [m["text"] for m in restarted.pending()] == ["a", "b"]
+    assert restarted.pending(limit=1, offset=1) == [second]
+
+    restarted.ack([first["client_id"], "unknown"])
+    assert len(restarted) == 1 and restarted.pending() == [second]
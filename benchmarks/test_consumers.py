@@ -0,0 +1,193 @@
+"""
+WebSocket-чат (ChatConsumer) через WebsocketCommunicator: рукопожатие по токену,
+пачки сообщений с подтверждением, рассылки присутствия и эфемерных событий.
+
+Сценарии асинхронные и запускаются фикстурой ws в своём event loop; фоновые
+задачи реестров (присутствие, эфемерные события, отметки о прочтении) живут
+только в нём и останавливаются вместе со сценарием.
+"""
+
+import pytest
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from rest_framework.authtoken.models import Token
+
+from app.authentication import TokenAuthMiddleware
+from app.ephemeral import ephemeral
+from app.models import ChatMessage, CustomUser
+from app.presence import presence
+from app.receipts import receipts
+from app.routing import websocket_urlpatterns
+
+pytestmark = pytest.mark.django_db
+
+RECEIVE_TIMEOUT = 3
+
+
+@pytest.fixture
+def ws(settings):
+    """Запускает асинхронный сценарий и останавливает фоновые задачи после него"""
+    settings.WS_REQUIRE_AUTH = True
+    flush_interval = presence.flush_interval
+    presence.flush_interval = 0.05  # не ждать секунду окна присутствия
+
+    def run(scenario):
+        async def wrapper():
+            try:
+                await scenario()
+            finally:
+                for task in [*presence.tasks, ephemeral.task, receipts.task]:
+                    if task is not None:
+                        task.cancel()
+                presence.tasks, ephemeral.task, receipts.task = [], None, None
+                await get_channel_layer().flush()
+
+        async_to_sync(wrapper)()
+
+    yield run
+    presence.flush_interval = flush_interval
+    for registry in (presence.local, presence.online, presence.changed, presence.local_changed):
+        registry.clear()
+    ephemeral.pending.clear()
+    receipts.pending.clear()
+
+
+def make_token(username):
+    user = CustomUser.objects.create(username=username)
+    token, _ = Token.objects.get_or_create(user=user)  # токен может создать сигнал регистрации
+    return token.key
+
+
+def communicator(token=None):
+    application = TokenAuthMiddleware(URLRouter(websocket_urlpatterns))
+    subprotocols = ["token", token] if token else None
+    return WebsocketCommunicator(application, "/ws/chat/", subprotocols=subprotocols)
+
+
+async def receive_type(comm, frame_type):
+    """Следующий кадр нужного типа; остальные кадры пропускаются"""
+    while True:
+        frame = await comm.receive_json_from(timeout=RECEIVE_TIMEOUT)
+        if frame.get("type") == frame_type:
+            return frame
+
+
+def test_connect_requires_token(ws):
+    token = make_token('ws_alice')
+
+    async def scenario():
+        # без токена и с неверным токеном - отказ до accept()
+        for comm in (communicator(), communicator('not-a-token')):
+            connected, code = await comm.connect()
+            assert not connected and code == 4401
+
+        comm = communicator(token)
+        connected, subprotocol = await comm.connect()
+        assert connected and subprotocol == "token"
+        await comm.disconnect()
+
+    ws(scenario)
+
+
+def test_batch_frame_ack_and_resend(ws):
+    token = make_token('ws_alice')
+    batch = {"type": "batch", "messages": [
+        {"text": f"offline {i}", "client_id": f"outbox-{i}"} for i in range(3)
+    ]}
+
+    async def scenario():
+        comm = communicator(token)
+        await comm.connect()
+        await comm.send_json_to(batch)
+        ack = await receive_type(comm, "ack")
+        assert sorted(ack["client_ids"]) == ["outbox-0", "outbox-1", "outbox-2"]
+
+        # ack потерялся, клиент прислал очередь снова: подтверждение без повторного сохранения
+        await comm.send_json_to(batch)
+        ack = await receive_type(comm, "ack")
+        assert sorted(ack["client_ids"]) == ["outbox-0", "outbox-1", "outbox-2"]
+        await comm.disconnect()
+
+    ws(scenario)
+    assert ChatMessage.objects.filter(client_id__startswith="outbox-").count() == 3
+
+
+def test_batch_broadcast_single_frame(ws):
+    alice, bob = make_token('ws_alice'), make_token('ws_bob')
+
+    async def scenario():
+        sender, receiver = communicator(alice), communicator(bob)
+        await sender.connect()
+        await receiver.connect()
+
+        await sender.send_json_to({"type": "batch", "messages": [{"text": f"m{i}"} for i in range(3)]})
+        # вся пачка - одним кадром batch, в порядке отправки
+        frame = await receive_type(receiver, "batch")
+        assert [m["text"] for m in frame["messages"]] == ["m0", "m1", "m2"]
+        assert all(m["user"] == "ws_alice" and m["id"] for m in frame["messages"])
+
+        # одиночное сообщение приходит обычным кадром
+        await sender.send_json_to({"text": "single"})
+        while True:
+            frame = await receiver.receive_json_from(timeout=RECEIVE_TIMEOUT)
+            if "text" in frame:
+                break
+        assert frame["text"] == "single" and frame["user"] == "ws_alice"
+
+        await sender.disconnect()
+        await receiver.disconnect()
+
+    ws(scenario)
+
+
+def test_presence_fan_out(ws):
+    alice, bob = make_token('ws_alice'), make_token('ws_bob')
+
+    async def scenario():
+        watcher = communicator(bob)
+        await watcher.connect()
+        other = communicator(alice)
+        await other.connect()
+
+        # изменения за окно приходят одним кадром presence с именами
+        online = set()
+        while 'ws_alice' not in online:
+            frame = await receive_type(watcher, "presence")
+            online.update(frame["online"])
+        assert frame["online_count"] == 2
+
+        await other.disconnect()
+        frame = await receive_type(watcher, "presence")
+        assert frame["offline"] == ["ws_alice"] and frame["online_count"] == 1
+        await watcher.disconnect()
+
+    ws(scenario)
+
+
+def test_ephemeral_events_coalesced(ws):
+    alice, bob = make_token('ws_alice'), make_token('ws_bob')
+
+    async def scenario():
+        sender, receiver = communicator(alice), communicator(bob)
+        await sender.connect()
+        await receiver.connect()
+
+        # сразу после рассылки: до следующей впереди целый интервал
+        await sender.send_json_to({"type": "typing"})
+        await receive_type(receiver, "ephemeral")
+
+        for message_id in range(1, 6):
+            await sender.send_json_to({"type": "typing"})
+            await sender.send_json_to({"type": "read", "message_id": message_id})
+        # десять событий за интервал - один кадр, по последнему событию каждого типа
+        frame = await receive_type(receiver, "ephemeral")
+        assert sorted(frame["events"], key=lambda e: e["type"]) == [
+            {"type": "read", "user": "ws_alice", "message_id": 5},
+            {"type": "typing", "user": "ws_alice"},
+        ]
+        await sender.disconnect()
+        await receiver.disconnect()
+
+    ws(scenario)
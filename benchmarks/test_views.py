@@ -0,0 +1,455 @@
+"""
+Число запросов фиксировано и не зависит от объёма данных: если представление
+начнёт делать запрос на строку (N+1) или тянуть таблицу целиком, тест упадёт.
+
+check_view делает прогревочный запрос, поэтому замеряется состояние
+с заполненным кэшем страниц и счётчиков (app/caching.py).
+"""
+
+import asyncio
+import os
+
+import pytest
+
+from app.models import ChatMessage, CustomUser
+
+pytestmark = pytest.mark.django_db
+
+
+def test_home_view(check_view, client):
+    # счётчики из кэша
+    check_view(client, '/', num_queries=0, budget_ms=50)
+
+
+def test_home_view_authenticated(check_view, user_client):
+    # только сессия и пользователь
+    check_view(user_client, '/', num_queries=2, budget_ms=50)
+
+
+def test_about(check_view, client):
+    check_view(client, '/about/', num_queries=0, budget_ms=5)
+
+
+@pytest.mark.parametrize('url', ['/career/', '/support/', '/contact/', '/coming/', '/download/'])
+def test_cached_pages(check_view, client, url):
+    check_view(client, url, num_queries=0, budget_ms=5)
+
+
+def test_cached_pages_authenticated(check_view, user_client):
+    # шапка зависит от входа: своя копия страницы, запросы только на сессию
+    response = check_view(user_client, '/about/', num_queries=2, budget_ms=10)
+    assert 'Профиль' in response.content.decode()
+
+
+def test_counters_invalidate_cached_pages(client, bench_user):
+    users = CustomUser.objects.count()
+    assert f"{users}+" in client.get('/about/').content.decode()
+
+    CustomUser.objects.create(username='bench_new_user')
+    assert f"{users + 1}+" in client.get('/about/').content.decode()
+
+    messages = ChatMessage.objects.count()
+    ChatMessage.objects.create(user=bench_user, text='new')
+    assert f" {messages + 1} " in client.get('/').content.decode()
+
+
+def test_profile_view(check_view, user_client):
+    check_view(user_client, '/profile/', num_queries=3, budget_ms=50)
+
+
+def test_status(check_view, client):
+    check_view(client, '/status/', num_queries=1, budget_ms=50)
+
+
+def test_user_directory(check_view, token_client):
+    # одна страница каталога, независимо от числа пользователей (токен - из кэша)
+    response = check_view(token_client, '/api/users/?fields=id,username', num_queries=1, budget_ms=20)
+    data = response.json()
+    assert len(data['results']) == 50 and data['next'] == data['results'][-1]['username']
+
+
+def test_user_directory_prefix(check_view, token_client):
+    response = check_view(token_client, '/api/users/?q=bench_user_1&limit=10', num_queries=1, budget_ms=20)
+    assert all(row['username'].startswith('bench_user_1') for row in response.json()['results'])
+
+
+def test_user_me(check_view, token_client):
+    check_view(token_client, '/api/users/me/', num_queries=0, budget_ms=10)
+
+
+def test_message_list(check_view, token_client):
+    # страница сообщений с авторами; токен - из кэша
+    check_view(token_client, '/api/messages/', num_queries=1, budget_ms=100)
+
+
+def test_message_list_archive(check_view, token_client):
+    # в горячей таблице до id=1 ничего нет: + один запрос к архиву
+    check_view(token_client, '/api/messages/?before=1', num_queries=2, budget_ms=100)
+
+
+def test_token_cache_invalidation(token_client, bench_user):
+    assert token_client.get('/api/users/me/').status_code == 200
+    bench_user.is_active = False
+    bench_user.save()
+    assert token_client.get('/api/users/me/').status_code == 401
+    bench_user.is_active = True
+    bench_user.save()
+    assert token_client.get('/api/users/me/').status_code == 200
+
+    response = token_client.post('/api/token/rotate/')
+    assert response.status_code == 200
+    assert token_client.get('/api/users/me/').status_code == 401  # старый токен удалён
+    token_client.credentials(HTTP_AUTHORIZATION=f"Token {response.json()['token']}")
+    assert token_client.get('/api/users/me/').status_code == 200
+
+
+def test_message_changes(check_view, token_client, bench_user):
+    message = ChatMessage.objects.create(user=bench_user, text='old')
+    cursor = token_client.get('/api/messages/changes/').json()['cursor']
+    url = f'/api/messages/{message.id}/'
+    response = token_client.patch(url, {'text': 'new', 'version': 1}, format='json')
+    assert response.json()['version'] == 2
+    # правка устаревшей версии
+    assert token_client.patch(url, {'text': 'x', 'version': 1}, format='json').status_code == 409
+    assert token_client.delete(url).status_code == 204
+
+    # одна дельта на сообщение, с итоговым состоянием: журнал + сами сообщения
+    response = check_view(token_client, f'/api/messages/changes/?since={cursor}', num_queries=2, budget_ms=100)
+    assert response.json()['changes'] == [{'id': message.id, 'version': 3, 'deleted': True}]
+
+
+def test_message_changes_after_archive(token_client, bench_user):
+    from datetime import timedelta
+
+    from django.utils import timezone
+
+    from app.archive import archive_messages
+
+    edited = ChatMessage.objects.create(user=bench_user, text='old')
+    deleted = ChatMessage.objects.create(user=bench_user, text='gone')
+    cursor = token_client.get('/api/messages/changes/').json()['cursor']
+    token_client.patch(f'/api/messages/{edited.id}/', {'text': 'new', 'version': 1}, format='json')
+    token_client.delete(f'/api/messages/{deleted.id}/')
+
+    # клиент был офлайн, пока оба сообщения уехали в архив
+    ChatMessage.objects.filter(pk__in=[edited.pk, deleted.pk]).update(created_at=timezone.now() - timedelta(days=60))
+    assert archive_messages(30) == 2
+    changes = {c['id']: c for c in token_client.get(f'/api/messages/changes/?since={cursor}').json()['changes']}
+    assert changes[edited.id]['text'] == 'new' and changes[edited.id]['version'] == 2
+    assert changes[deleted.id] == {'id': deleted.id, 'version': 2, 'deleted': True}
+
+
+def test_message_thread(check_view, token_client, bench_user):
+    parent = None
+    for i in range(5):
+        response = token_client.post('/api/messages/', {'text': f'reply {i}', 'reply_to': parent}, format='json')
+        assert response.status_code == 201
+        parent = response.json()['id']
+    # превью родителя встроено в ответ: клиенту не нужен отдельный запрос
+    assert response.json()['reply_preview']['text'] == 'reply 3'
+
+    # вся цепочка - один рекурсивный запрос, независимо от глубины
+    response = check_view(token_client, f'/api/messages/{parent}/thread/', num_queries=1, budget_ms=100)
+    assert [m['text'] for m in response.json()['messages']] == [f'reply {i}' for i in range(5)]
+
+
+def test_unread(check_view, token_client, bench_user, django_assert_num_queries):
+    from app.receipts import receipts, DEFAULT_ROOM
+
+    # без кэша - один запрос; счётчик ограничен, длинная история не сканируется целиком
+    with django_assert_num_queries(2):  # + токен
+        response = token_client.get('/api/unread/')
+    assert response.json()['rooms'][DEFAULT_ROOM]['unread'] == 100
+    # токен и счётчик из кэша
+    check_view(token_client, '/api/unread/', num_queries=0, budget_ms=100)
+
+    last = ChatMessage.objects.order_by('-id').first()
+    receipts.ack(bench_user.id, last.id - 3, DEFAULT_ROOM)
+    receipts.ack(bench_user.id, last.id - 1, DEFAULT_ROOM)
+    receipts.write(receipts.drain())  # обычно - фоновая задача раз в несколько секунд
+    assert token_client.get('/api/unread/').json()['rooms'][DEFAULT_ROOM] == {'unread': 1, 'first_unread': last.id}
+
+    # запоздалая отметка с другого устройства не откатывает прочитанное
+    receipts.ack(bench_user.id, last.id - 3, DEFAULT_ROOM)
+    receipts.write(receipts.drain())
+    assert token_client.get('/api/unread/').json()['rooms'][DEFAULT_ROOM]['unread'] == 1
+
+    other = CustomUser.objects.exclude(pk=bench_user.pk).first()
+    ChatMessage.objects.create(user=other, text='new')
+    assert token_client.get('/api/unread/').json()['rooms'][DEFAULT_ROOM]['unread'] == 2
+    ChatMessage.objects.create(user=bench_user, text='own')  # свои сообщения не непрочитанные
+    assert token_client.get('/api/unread/').json()['rooms'][DEFAULT_ROOM]['unread'] == 2
+
+
+def test_save_messages_batch(bench_user, django_assert_max_num_queries):
+    from app.chat import save_messages
+
+    parent = ChatMessage.objects.create(user=bench_user, text='parent')
+    items = [{'text': f'batch {i}', 'client_id': f'key-{i}', 'reply_to': parent.id} for i in range(50)]
+    # пачка - фиксированное число запросов: ключи, родители, один INSERT (+ точка сохранения)
+    with django_assert_max_num_queries(5):
+        messages, done = save_messages(bench_user, items)
+    assert len(messages) == 50 and len(done) == 50
+    assert messages[0].reply_preview['text'] == 'parent'
+
+    # повтор из очереди клиента: подтверждается, но не сохраняется заново
+    messages, done = save_messages(bench_user, items[:10])
+    assert messages == [] and done == [f'key-{i}' for i in range(10)]
+
+
+def read_streaming(response):
+    """Тело потокового ответа: вложения отдаются асинхронным генератором"""
+    from asgiref.sync import async_to_sync
+
+    async def read():
+        return b''.join([chunk async for chunk in response.streaming_content])
+
+    return async_to_sync(read)()
+
+
+def test_attachment_upload_and_range(token_client, settings, tmp_path):
+    settings.ATTACHMENT_ROOT = str(tmp_path)
+    settings.ATTACHMENT_CHUNK_SIZE = 1024
+    content = bytes(range(256)) * 8
+    upload = token_client.post('/api/uploads/', {'filename': 'a.bin', 'size': len(content)}, format='json').json()
+    url = f"/api/uploads/{upload['id']}/"
+
+    def put(offset, chunk):
+        return token_client.put(url, chunk, content_type='application/octet-stream', HTTP_UPLOAD_OFFSET=str(offset))
+
+    # кусок больше chunk_size отклоняется до записи
+    assert put(0, content).status_code == 413
+    assert put(0, content[:1024]).json()['offset'] == 1024
+    attachment = put(1024, content[1024:]).json()
+
+    response = token_client.get(f"/api/attachments/{attachment['id']}/")
+    assert response.status_code == 200 and read_streaming(response) == content
+    response = token_client.get(f"/api/attachments/{attachment['id']}/", HTTP_RANGE='bytes=100-199')
+    assert response.status_code == 206 and response['Content-Range'] == f'bytes 100-199/{len(content)}'
+    assert read_streaming(response) == content[100:200]
+    assert token_client.get(f"/api/attachments/{attachment['id']}/", HTTP_RANGE='bytes=5000-').status_code == 416
+
+
+def test_cleanup_uploads(token_client, settings, tmp_path):
+    from app.attachments import cleanup_uploads, part_path
+    from app.models import UploadSession
+
+    settings.ATTACHMENT_ROOT = str(tmp_path)
+    upload = token_client.post('/api/uploads/', {'filename': 'a.bin', 'size': 10}, format='json').json()
+    session = UploadSession.objects.get(pk=upload['id'])
+    assert cleanup_uploads(max_age=3600) == 0  # свежая загрузка остаётся
+
+    assert cleanup_uploads(max_age=-1) == 1
+    assert not UploadSession.objects.filter(pk=session.pk).exists()
+    assert not os.path.exists(part_path(session))
+
+
+def test_presence_sync_between_processes():
+    from asgiref.sync import async_to_sync
+    from channels.layers import InMemoryChannelLayer
+
+    from app.presence import PRESENCE_SYNC_GROUP, PresenceRegistry
+
+    layer = InMemoryChannelLayer()
+    first, second = PresenceRegistry(layer_sync=True), PresenceRegistry(layer_sync=True)
+
+    async def exchange(source):
+        channel = await layer.new_channel()
+        await layer.group_add(PRESENCE_SYNC_GROUP, channel)
+        await source.publish(layer, full=False)
+        second.apply_remote(await layer.receive(channel))
+        await layer.group_discard(PRESENCE_SYNC_GROUP, channel)
+
+    second.connect('bob')
+    second.drain_changes()
+    first.connect('alice')
+    first.connect('bob')
+    async_to_sync(exchange)(first)
+    # вход alice узнан от другого процесса, bob уже был онлайн здесь
+    assert second.online_count() == 2
+    assert second.drain_changes() == (['alice'], [])
+
+    first.disconnect('alice')
+    first.disconnect('bob')
+    async_to_sync(exchange)(first)
+    assert second.drain_changes() == ([], ['alice'])
+    assert second.is_online('bob') and not second.is_online('alice')
+    assert second.local_changed == {'bob': False}  # чужие изменения другим процессам не пересылаются
+
+
+def test_thumbnail_failure(token_client, bench_user, settings, tmp_path):
+    import hashlib
+
+    from app.attachments import blob_path
+    from app.models import Attachment
+    from app.thumbnails import thumbnails
+
+    settings.ATTACHMENT_ROOT = str(tmp_path)
+    content = b'not an image'
+    sha256 = hashlib.sha256(content).hexdigest()
+    os.makedirs(os.path.dirname(blob_path(sha256)))
+    with open(blob_path(sha256), 'wb') as f:
+        f.write(content)
+    # тип объявлен клиентом, содержимое не картинка
+    attachment = Attachment.objects.create(
+        user=bench_user, sha256=sha256, size=len(content), filename='fake.png', content_type='image/png',
+    )
+    try:
+        thumbnails.generate(sha256)  # обычно - в пуле после загрузки
+        # клиент не опрашивает бесконечно: отказ запомнен, повторно в очередь не ставится
+        response = token_client.get(f'/api/attachments/{attachment.id}/thumbnail/')
+        assert response.status_code == 415
+        assert not thumbnails.schedule(attachment) and sha256 not in thumbnails.pending
+    finally:
+        thumbnails.failed.discard(sha256)
+
+
+def test_thumbnail_transient_error_retried(settings, tmp_path):
+    from app.thumbnails import thumbnails
+
+    settings.ATTACHMENT_ROOT = str(tmp_path)
+    sha256 = 'ab' * 32
+    thumbnails.generate(sha256)  # блоба нет на диске: ошибка временная
+    assert sha256 not in thumbnails.failed
+
+
+def test_metrics_access(client, bench_user, settings):
+    settings.METRICS_ALLOWED_IPS = ['10.0.0.5']
+    assert client.get('/metrics/', REMOTE_ADDR='10.0.0.5').status_code == 200
+    assert client.get('/metrics/').status_code == 403
+
+    bench_user.is_staff = True
+    bench_user.save()
+    client.force_login(bench_user)
+    assert client.get('/metrics/').status_code == 200
+
+
+def test_profile_header_staff_only(client, bench_user, settings):
+    settings.PROFILE_HEADER_ENABLED = True
+    # анонимный запрос получает обычную страницу, не профиль
+    assert 'text/html' in client.get('/about/', HTTP_X_PROFILE='1')['Content-Type']
+
+    bench_user.is_staff = True
+    bench_user.save()
+    client.force_login(bench_user)
+    response = client.get('/about/', HTTP_X_PROFILE='1')
+    assert response['Content-Type'].startswith('text/plain')  # отчёт профилировщика
+
+    settings.PROFILE_HEADER_ENABLED = False
+    assert 'text/html' in client.get('/about/', HTTP_X_PROFILE='1')['Content-Type']
+
+
+def test_message_history_first_page_skips_archive(django_assert_num_queries):
+    from datetime import timedelta
+
+    from django.utils import timezone
+
+    from app.archive import archive_messages, message_history
+    from app.models import ArchivedMessage
+
+    old, tombstone = ChatMessage.objects.order_by('id')[:2]
+    ChatMessage.objects.filter(pk=tombstone.pk).update(deleted_at=timezone.now())
+    ChatMessage.objects.filter(pk__in=[old.pk, tombstone.pk]).update(created_at=timezone.now() - timedelta(days=60))
+    # надгробие переносится вместе с остальными, но в истории его нет
+    assert archive_messages(30) == 2
+    assert ArchivedMessage.objects.filter(pk=tombstone.pk, deleted_at__isnull=False).exists()
+
+    # небольшая горячая таблица: первая страница не трогает архив
+    recent = list(ChatMessage.objects.order_by('-id').values_list('id', flat=True)[:5])
+    ChatMessage.objects.exclude(id__in=recent).update(deleted_at=timezone.now())
+    with django_assert_num_queries(1):
+        assert len(message_history()) == 5
+    # листание назад дочитывает архив
+    with django_assert_num_queries(2):
+        assert message_history(before=min(recent))[0].pk == old.pk
+
+
+def test_status_engine_rows_per_process():
+    from app.models import Server
+    from app.status import STAT_OFFLINE, STAT_ONLINE, STAT_SLEEPING, StatusEngine
+
+    def engine(worker_id):
+        return StatusEngine(interval=5, flush_samples=1, server_name='bench-host', worker_id=worker_id)
+
+    def state(worker_id):
+        return Server.objects.select_related('status').get(name=f'bench-host #{worker_id}').status.name
+
+    first, second = engine(1), engine(2)
+    first.samples = [{'load_percentage': 40, 'websocket_connections': 3}]
+    first.flush()
+    second.samples = [{'load_percentage': 10, 'websocket_connections': 0}]
+    second.flush()
+    # воркеры одного хоста не затирают строки друг друга
+    assert state(1) == STAT_ONLINE and state(2) == STAT_SLEEPING
+
+    first.stop()
+    assert state(1) == STAT_OFFLINE
+    # новый процесс хоста убирает строки остановленных
+    engine(3).flush()
+    assert not Server.objects.filter(name='bench-host #1').exists() and state(2) == STAT_SLEEPING
+
+
+def test_static_files_middleware(client, monkeypatch, tmp_path, django_assert_num_queries):
+    import gzip
+    import json
+
+    from app.staticfiles import static_index
+
+    css = b'body { color: black; }\n' * 100
+    (tmp_path / 'styles.3f2a1b.css').write_bytes(css)
+    (tmp_path / 'styles.3f2a1b.css.gz').write_bytes(gzip.compress(css))
+    (tmp_path / 'robots.txt').write_bytes(b'User-agent: *\n')
+    (tmp_path / 'staticfiles.json').write_text(json.dumps({'paths': {'styles.css': 'styles.3f2a1b.css'}}))
+    monkeypatch.setattr(static_index, 'root', str(tmp_path))
+    monkeypatch.setattr(static_index, 'files', None)
+
+    # отдаётся до сессий и аутентификации
+    with django_assert_num_queries(0):
+        response = client.get('/static/styles.3f2a1b.css', HTTP_ACCEPT_ENCODING='gzip, deflate')
+    assert response['Content-Encoding'] == 'gzip' and gzip.decompress(response.content) == css
+    assert response['Cache-Control'] == 'public, max-age=31536000, immutable'
+    assert response['Vary'] == 'Accept-Encoding'
+    assert client.get('/static/styles.3f2a1b.css').content == css  # без сжатия
+
+    response = client.get('/static/robots.txt')
+    assert 'immutable' not in response['Cache-Control'] and response.content == b'User-agent: *\n'
+    assert client.get('/static/robots.txt', HTTP_IF_NONE_MATCH=response['ETag']).status_code == 304
+    assert client.head('/static/robots.txt').content == b''
+
+
+def test_presence_sync_survives_bad_message():
+    from asgiref.sync import async_to_sync
+    from channels.layers import InMemoryChannelLayer
+
+    from app.presence import PRESENCE_SYNC_GROUP, PresenceRegistry
+
+    layer = InMemoryChannelLayer()
+    registry = PresenceRegistry(layer_sync=True)
+
+    async def scenario():
+        task = asyncio.create_task(registry.sync_loop(layer))
+        await asyncio.sleep(0)  # подписка на группу
+        await layer.group_send(PRESENCE_SYNC_GROUP, {"type": "presence.sync"})  # без process
+        await layer.group_send(PRESENCE_SYNC_GROUP, {"type": "presence.sync", "process": "other", "online": ["alice"]})
+        for _ in range(100):
+            if registry.is_online('alice'):
+                break
+            await asyncio.sleep(0.01)
+        task.cancel()
+
+    async_to_sync(scenario)()
+    assert registry.is_online('alice')
+
+
+def test_save_messages_key_race(bench_user):
+    from app.chat import save_one_by_one
+
+    # ключ сохранила другая вкладка уже после проверки ключей пачкой
+    ChatMessage.objects.create(user=bench_user, text='other tab', client_id='race')
+    done = ['rejected-earlier']
+    created = save_one_by_one([
+        ChatMessage(user=bench_user, text='dup', client_id='race'),
+        ChatMessage(user=bench_user, text='fresh', client_id='fresh'),
+    ], done)
+    assert [m.client_id for m in created] == ['fresh'] and created[0].pk
+    assert done == ['rejected-earlier', 'race']
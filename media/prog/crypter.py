@@ -1,5 +1,6 @@
 # region imports
 import random
+import base64
 import traceback
 import sys
 import os
@@ -28,6 +29,14 @@ library = [
     ']', '^', '_', '`', '{', '|', '}', '~', ' '
 ]
 
+# Компактный формат (версия 2): вместо 15-символьных кусков храним их номера
+# в отсортированной таблице ключа, упакованные в байты и закодированные в base64.
+# Символа '~' нет в алфавите ключа, поэтому старый шифротекст с префиксом не спутать.
+COMPACT_PREFIX = '~2:'
+BULLET_LENGTH = difficulty + 20
+NO_INDEX = 0xFFFF  # Пуля без индекса (фейковая)
+UNKNOWN_CELL = 0xFF  # Кусок, которого нет в базовой таблице ключа
+
 key = ''
 mkr = 0
 message_crypted = ''
@@ -213,11 +222,12 @@ def find_duplicates(lst):
 
 # region шифрование
 
-def cipher(message_docrypted, message_crypted=""):
-    """Шифрование сообщения."""
+def cipher(message_docrypted, message_crypted="", compact=False):
+    """Шифрование сообщения (compact=True - компактный формат версии 2)."""
     global chunks
     global mkr
     message_crypted = ""
+    cells = []
 
     try:
         message_do_crypted = message_docrypted
@@ -233,13 +243,16 @@ def cipher(message_docrypted, message_crypted=""):
             try:
                 index = library.index(uncipher_symbol)
                 cipher_symbol = chunks[index]
-                message_crypted += cipher_symbol
+                cells.append(cipher_symbol)
             except ValueError:
                 with open('data/bugs', 'a') as f:
                     f.write(f"{uncipher_symbol}\n")
                 print(f"Неизвестный символ '{uncipher_symbol}' записан в файл 'data/bugs'.")
 
-        message_crypted += bullet
+        if compact:
+            message_crypted = compact_encode(cells, bullet)
+        else:
+            message_crypted = ''.join(cells) + bullet
 
         chunks = key_reader(mkr=1)
         print("Сообщение успешно зашифровано и записано в файл 'data/message'.")
@@ -252,9 +265,64 @@ def cipher(message_docrypted, message_crypted=""):
 
 # endregion
 
+# region компактное кодирование
+
+def compact_encode(cells, bullet):
+    """Упаковка кусков шифра и пули в компактный формат версии 2.
+
+    Каждый кусок заменяется номером в отсортированной базовой таблице ключа (1 байт),
+    пуля - только индексом (2 байта): новый кусок ключа получатель берёт из своей
+    таблицы (key_reader(mkr=2)), как и в старом формате; шум пули не нужен.
+    """
+    ranks = {}
+    for rank, chunk in enumerate(sorted(key_reader(mkr=0))):
+        ranks.setdefault(chunk, rank)
+
+    index = bullet[:3]
+    if index.isdigit():
+        header = int(index).to_bytes(2, 'big')
+    else:
+        header = NO_INDEX.to_bytes(2, 'big')
+
+    body = bytes(ranks.get(cell, UNKNOWN_CELL) for cell in cells)
+    return COMPACT_PREFIX + base64.b64encode(header + body).decode('ascii')
+
+
+def compact_uncipher(msg):
+    """Расшифровка сообщения в компактном формате версии 2."""
+    try:
+        payload = base64.b64decode(msg[len(COMPACT_PREFIX):])
+        index = int.from_bytes(payload[:2], 'big')
+        body = payload[2:]
+
+        if index != NO_INDEX:
+            uncipher_chunks = key_reader(mkr=2)
+        else:
+            uncipher_chunks = key_reader(mkr=0)
+
+        cells_by_rank = sorted(uncipher_chunks)
+        positions = {}
+        for position, chunk in enumerate(uncipher_chunks):
+            positions.setdefault(chunk, position)
+
+        message_uncipher = ''.join(library[positions[cells_by_rank[rank]]] for rank in body)
+
+        with open("data/key_for_uncipher", "w", encoding="utf-8") as f:
+            f.write(''.join(uncipher_chunks))
+
+        return message_uncipher
+
+    except Exception as error:
+        print(f"Ошибка при расшифровке компактного сообщения: {error}")
+
+# endregion
+
 # region Расшифровка
 def uncipher(msg, mu):
-    """Расшифровка сообщения."""
+    """Расшифровка сообщения (старый формат или компактный с префиксом версии)."""
+    if msg.startswith(COMPACT_PREFIX):
+        return compact_uncipher(msg)
+
     message_codding_list = []
 
     try:
@@ -265,10 +333,10 @@ def uncipher(msg, mu):
             uncipher_chunks = key_reader(mkr=2)
             chunks_for_replace = uncipher_chunks.copy()
 
-            bullet = message_codding[-(difficulty + 20):]
+            bullet = message_codding[-BULLET_LENGTH:]
             index = bullet[:3]
             replace_element = bullet[3:3 + difficulty]
-            message_codding = message_codding[:-(difficulty + 20)]
+            message_codding = message_codding[:-BULLET_LENGTH]
 
             message_for_uncipher = [message_codding[i:i + difficulty] for i in range(0, len(message_codding), difficulty)]
             message_uncipher = ""
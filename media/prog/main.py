@@ -5,28 +5,43 @@ import json
 import re
 import time
 import logging
-from passlib.hash import django_pbkdf2_sha256
+from logging.handlers import QueueHandler, QueueListener
+import queue
+import atexit
 import datetime
 import socket
 import websockets
 import asyncio
 from crypter import cipher, uncipher
+from search_index import MessageSearchIndex
+from outbox import Outbox
 import os
+import mimetypes
 
 
 hostname = socket.gethostname()
 ip_address = socket.gethostbyname(hostname)
 
-# Настройка логирования
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(levelname)s - %(message)s",
-)
+# Настройка логирования: UI-поток только кладёт записи в очередь,
+# форматирование и вывод делает поток QueueListener
+log_queue = queue.SimpleQueue()
+log_output = logging.StreamHandler()
+log_output.setFormatter(logging.Formatter("%(asctime)s - %(levelname)s - %(message)s"))
+log_listener = QueueListener(log_queue, log_output)
+log_listener.start()
+atexit.register(log_listener.stop)
+logging.basicConfig(level=logging.INFO, handlers=[QueueHandler(log_queue)])
 
 # Конфигурация
 CREDENTIALS_FILE = "data/user_credentials.json"
+DOWNLOADS_DIR = "downloads"
 MAX_LOGIN_ATTEMPTS = 3
 BLOCK_TIME = 10
+TYPING_SEND_INTERVAL = 2  # Не чаще одного события "печатает" за 2 секунды
+TYPING_TTL = 4  # Сколько показывать "печатает" после последнего события
+READ_ACK_INTERVAL = 2  # Не чаще одной отметки "прочитано" за 2 секунды
+OUTBOX_BATCH_SIZE = 500  # Сообщений очереди в одном кадре batch (не больше лимита сервера)
+RECONNECT_MAX_DELAY = 30  # Секунд между попытками переподключения (растёт от 1)
 
 class ChatInterface:
     def __init__(self, page, username, theme_mode, language, auth_token):
@@ -37,61 +52,220 @@ class ChatInterface:
         self.auth_token = auth_token
         self.messages = []
         self.ws = None  # WebSocket клиент
+        self.loop = None  # Event loop, в котором живёт WebSocket
+        self.outbox = Outbox()  # Неподтверждённые сервером сообщения переживают обрыв и перезапуск
         self.page.on_keyboard_event = self.handle_keyboard_event
         self.reply_to_message = None  # Новое поле для хранения сообщения-оригинала
         self.selected_message = None  # Для контекстного меню
+        self.online_users = set()  # Пользователи онлайн (по событиям presence)
+        self.typing_users = {}  # Кто печатает -> до какого времени показывать
+        self.typing_timer = None  # Отложенная очистка индикатора "печатает"
+        self.read_markers = {}  # Пользователь -> id последнего прочитанного сообщения
+        self.last_typing_sent = 0.0
+        self.last_read_acked = 0  # id последнего сообщения, о прочтении которого сообщили
+        self.last_read_sent = 0.0
+        self.search_index = MessageSearchIndex()  # Локальный поиск по расшифрованным сообщениям
+        self.changes_cursor = None  # Курсор журнала правок (/api/messages/changes/)
         self.initialize_ui()
 
         asyncio.run(self.connect_websocket())
     
     async def connect_websocket(self):
-        try:
-            self.ws = await websockets.connect("ws://127.0.0.1:8000/ws/chat/")
+        """Подключение с повтором: после обрыва - снова, с растущей паузой"""
+        delay = 1
+        while True:
+            try:
+                await self.run_websocket()
+            except Exception as e:
+                print(f"❌ WebSocket ошибка: {e}")
+            self.ws = None
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, RECONNECT_MAX_DELAY)
+
+    async def flush_outbox(self):
+        """Очередь неотправленных сообщений - одним кадром batch (по OUTBOX_BATCH_SIZE)"""
+        offset = 0
+        while True:
+            messages = self.outbox.pending(OUTBOX_BATCH_SIZE, offset)
+            if not messages:
+                return
+            await self.ws.send(json.dumps({"type": "batch", "messages": messages}))
+            offset += len(messages)
+
+    async def run_websocket(self):
+        # Токен передаётся один раз при подключении, сервер знает автора всех кадров
+        async with websockets.connect(
+            "ws://127.0.0.1:8000/ws/chat/",
+            subprotocols=["token", self.auth_token]
+        ) as ws:
+            self.ws = ws
+            self.loop = asyncio.get_running_loop()
+            await self.flush_outbox()
+            # Правки и удаления, пропущенные без соединения
+            await self.catch_up_changes()
+            self.ack_read()
             while True:
                 message = await self.ws.recv()
                 data = json.loads(message)
+
+                # Сервер сохранил (или отклонил) сообщения: из очереди их можно убрать
+                if data.get("type") == "ack":
+                    self.outbox.ack(data.get("client_ids", []))
+                    continue
+
+                # Изменения присутствия приходят пачкой, это не сообщение чата
+                if data.get("type") == "presence":
+                    self.update_presence(data)
+                    continue
+                if data.get("type") == "ephemeral":
+                    self.apply_ephemeral(data.get("events", []))
+                    continue
+                if data.get("type") == "delta":
+                    self.apply_delta(data)
+                    continue
                 
-                # Дешифруем сообщение
-                if 'text' in data:
-                    data['text'] = uncipher(data['text'], mu=1)
-                
-                # Преобразуем строку created_at в datetime
-                if isinstance(data.get("created_at"), str):
-                    try:
-                        data["created_at"] = datetime.datetime.fromisoformat(
-                            data["created_at"].replace('Z', '+00:00')
-                        )
-                    except ValueError as e:
-                        data["created_at"] = datetime.datetime.now()
-                        logging.error(f"Ошибка преобразования даты в WebSocket: {e}")
-                
-                self.messages.append(data)
-                self.update_chat_display()
+                # Сообщения одного окна рассылки сервера - одним кадром и одним обновлением UI
+                batch = data.get("messages", []) if data.get("type") == "batch" else [data]
+                self.apply_incoming(batch)
+
+    def apply_incoming(self, batch):
+        """Новые сообщения из WebSocket: расшифровка, индекс и одна перерисовка на пачку"""
+        for data in batch:
+            # Дешифруем сообщение (у сообщения с одним вложением текст пустой)
+            if data.get('text'):
+                data['text'] = uncipher(data['text'], mu=1)
+            data['reply_preview'] = self.decode_reply_preview(data.get('reply_preview'))
+
+            # Преобразуем строку created_at в datetime
+            if isinstance(data.get("created_at"), str):
+                try:
+                    data["created_at"] = datetime.datetime.fromisoformat(
+                        data["created_at"].replace('Z', '+00:00')
+                    )
+                except ValueError as e:
+                    data["created_at"] = datetime.datetime.now()
+                    logging.error(f"Ошибка преобразования даты в WebSocket: {e}")
+
+        self.messages.extend(batch)
+        self.search_index.add_messages(batch)  # Одна транзакция на пачку
+        self.update_chat_display()
+
+    def apply_delta(self, delta):
+        """Правка или удаление сообщения: приходит только изменившееся"""
+        message = next((m for m in self.messages if m.get("id") == delta["id"]), None)
+        if message is not None and delta["version"] <= message.get("version", 1):
+            return  # Дельта устарела
+        text = uncipher(delta["text"], mu=1) if delta.get("text") else ""
+        if message is not None:
+            self.search_index.remove_message(delta["id"])
+            if delta.get("deleted"):
+                self.messages.remove(message)
+            else:
+                message["text"] = text
+                message["version"] = delta["version"]
+                message["edited_at"] = delta.get("edited_at")
+                self.search_index.add_messages([message])
+        # Цитаты этого сообщения в ответах (родителя может и не быть в загруженной истории)
+        for reply in self.messages:
+            preview = reply.get("reply_preview")
+            if preview and preview.get("id") == delta["id"]:
+                if delta.get("deleted"):
+                    reply["reply_preview"] = {"id": delta["id"], "user": preview.get("user"), "deleted": True}
+                else:
+                    preview["text"] = text
+        self.update_chat_display()
+
+    def decode_reply_preview(self, preview):
+        """Расшифровка текста цитаты, пришедшей вместе с ответом"""
+        if preview and preview.get("text"):
+            preview = dict(preview, text=uncipher(preview["text"], mu=1))
+        return preview
+
+    def reply_controls(self, message):
+        """Цитата родителя над текстом ответа (из reply_preview, без запросов)"""
+        preview = message.get("reply_preview")
+        if not preview:
+            return []
+        if preview.get("deleted"):
+            text = self.translate("Сообщение удалено")
+        else:
+            text = preview.get("text") or preview.get("attachment") or "…"
+        return [
+            ft.Container(
+                content=ft.Column([
+                    ft.Text(preview.get("user", ""), size=12, weight=ft.FontWeight.BOLD),
+                    ft.Text(text[:100], size=12, italic=True, max_lines=2),
+                ], spacing=2),
+                border=ft.border.only(left=ft.BorderSide(3, ft.Colors.GREY_500)),
+                padding=ft.padding.only(left=8),
+            )
+        ]
+
+    def fetch_changes(self):
+        """Страница журнала правок с текущего курсора (блокирующий HTTP-запрос)"""
+        headers = {"Authorization": f"Token {self.auth_token}"}
+        params = {} if self.changes_cursor is None else {"since": self.changes_cursor}
+        response = requests.get(
+            "http://127.0.0.1:8000/api/messages/changes/", headers=headers, params=params, timeout=10
+        )
+        if response.status_code != 200:
+            logging.error(f"Ошибка синхронизации правок: {response.status_code}")
+            return None
+        return response.json()
+
+    def apply_changes(self, data):
+        """Применяет страницу правок; True - есть ещё"""
+        for delta in data["changes"]:
+            self.apply_delta(delta)
+        self.changes_cursor = data["cursor"]
+        return data["has_more"]
+
+    def sync_changes(self):
+        """Догоняет правки и удаления с последнего курсора (вне event loop)"""
+        try:
+            while True:
+                data = self.fetch_changes()
+                if data is None or not self.apply_changes(data):
+                    return
+        except Exception as e:
+            logging.error(f"Ошибка синхронизации правок: {e}")
+
+    async def catch_up_changes(self):
+        """sync_changes для event loop сокета: запросы - в потоке, чтобы не стояли кадры и ping"""
+        try:
+            while True:
+                data = await asyncio.to_thread(self.fetch_changes)
+                # Применяем здесь, в цикле: сообщения и дельты меняет только он
+                if data is None or not self.apply_changes(data):
+                    return
         except Exception as e:
-            print(f"❌ WebSocket ошибка: {e}")
+            logging.error(f"Ошибка синхронизации правок: {e}")
+
+    def update_presence(self, data):
+        """Применение пачки изменений присутствия"""
+        self.online_users.update(data.get("online", []))
+        self.online_users.difference_update(data.get("offline", []))
+        self.online_text.value = f"{self.translate('Онлайн')}: {data.get('online_count', len(self.online_users))}"
+        self.online_text.update()
 
     def load_user_data(self):
-        """Загрузка реальных данных пользователя с сервера"""
+        """Загрузка данных текущего пользователя с сервера"""
         try:
-            response = requests.get("http://127.0.0.1:8000/api/users/")
+            response = requests.get(
+                "http://127.0.0.1:8000/api/users/me/",
+                headers={"Authorization": f"Token {self.auth_token}"}
+            )
             if response.status_code == 200:
-                data = response.json()
-                # Парсим строку с пользователями
-                users = json.loads(data["users"]) 
-                
-                # Ищем текущего пользователя
-                for user in users:
-                    if user["fields"]["username"] == self.username:
-                        return {
-                            "username": user["fields"]["username"],
-                            "email": user["fields"]["email"] or "не указано",
-                            "avatar": "👤"
-                        }
-                return self.default_user_data()
-            
+                user = response.json()
+                return {
+                    "username": user["username"],
+                    "email": user["email"] or "не указано",
+                    "avatar": "👤"
+                }
+
             logging.error(f"Ошибка API: {response.status_code}")
             return self.default_user_data()
-            
+
         except Exception as e:
             logging.error(f"Ошибка подключения: {str(e)}")
             return self.default_user_data()
@@ -131,15 +305,28 @@ class ChatInterface:
             on_click=self.show_profile_modal
         )
         
+        self.online_text = ft.Text("", size=12, color=ft.Colors.GREY_600)
+        self.unread_text = ft.Text("", size=12, weight=ft.FontWeight.BOLD, color=self.primary_color)
+
+        self.search_button = ft.IconButton(
+            icon=ft.Icons.SEARCH,
+            icon_size=30,
+            icon_color=self.primary_color,
+            on_click=self.show_search_modal
+        )
+
         self.header = ft.Row(
             [
-                ft.Text(
-                    self.translate("Глобальный чат"), 
-                    size=28, 
-                    weight=ft.FontWeight.BOLD,
-                    color=self.primary_color
-                ),
-                self.profile_button
+                ft.Column([
+                    ft.Text(
+                        self.translate("Глобальный чат"), 
+                        size=28, 
+                        weight=ft.FontWeight.BOLD,
+                        color=self.primary_color
+                    ),
+                    ft.Row([self.online_text, self.unread_text], spacing=10)
+                ], spacing=0),
+                ft.Row([self.search_button, self.profile_button], spacing=0)
             ],
             alignment=ft.MainAxisAlignment.SPACE_BETWEEN
         )
@@ -165,6 +352,19 @@ class ChatInterface:
             bgcolor=ft.Colors.with_opacity(0.05, self.primary_color),
             cursor_color=self.primary_color,
             content_padding=10,  # Уменьшено
+            on_change=self.on_message_change,
+        )
+        self.typing_text = ft.Text("", size=12, italic=True, color=ft.Colors.GREY_600)
+
+        # Вложения: файл уходит на сервер по HTTP частями, в WebSocket - только ссылка
+        self.file_picker = ft.FilePicker(on_result=self.on_file_picked)
+        self.page.overlay.append(self.file_picker)
+        self.attach_button = ft.IconButton(
+            icon=ft.Icons.ATTACH_FILE,
+            icon_size=24,
+            icon_color=self.primary_color,
+            tooltip=self.translate("Прикрепить файл"),
+            on_click=lambda e: self.file_picker.pick_files(allow_multiple=False)
         )
 
         # Обновить стили кнопок:
@@ -201,9 +401,11 @@ class ChatInterface:
                     color=ft.Colors.BLACK if self.theme_mode == ft.ThemeMode.DARK else ft.Colors.GREY_400,
                 )
             ),
+            ft.Container(self.typing_text, padding=ft.padding.only(left=15)),
             ft.Container(
                 content=ft.Row(
                     [
+                        self.attach_button,
                         self.new_message_field,
                         ft.Container(self.send_button, padding=ft.padding.only(left=10))
                     ],
@@ -221,6 +423,7 @@ class ChatInterface:
             )
         )
         
+        self.load_unread()  # До истории: после её показа сообщения станут прочитанными
         self.load_messages()
         self.page.update()
 
@@ -315,6 +518,49 @@ class ChatInterface:
         self.settings_modal.open = True
         self.page.update()
 
+    def search_messages(self, query, limit=50):
+        """Полнотекстовый поиск по локальному индексу сообщений"""
+        try:
+            return self.search_index.search(query, limit=limit)
+        except Exception as e:
+            logging.error(f"Ошибка поиска: {e}")
+            return []
+
+    def show_search_modal(self, e):
+        """Модальное окно поиска по сообщениям"""
+        results = ft.ListView(height=300, width=400, spacing=5)
+
+        def on_search(e):
+            results.controls = [
+                ft.ListTile(
+                    title=ft.Text(found["user"], weight=ft.FontWeight.BOLD),
+                    subtitle=ft.Text(found["snippet"]),
+                    trailing=ft.Text(found["created_at"][:16].replace("T", " "), size=10, color=ft.Colors.GREY_600),
+                )
+                for found in self.search_messages(e.control.value)
+            ]
+            if not results.controls:
+                results.controls = [ft.Text(self.translate("Ничего не найдено"), color=ft.Colors.GREY_600)]
+            results.update()
+
+        search_field = ft.TextField(
+            hint_text=self.translate("Поиск сообщений..."),
+            autofocus=True,
+            on_submit=on_search,
+            on_change=on_search,
+            border_radius=20
+        )
+
+        self.search_modal = ft.AlertDialog(
+            title=ft.Text(self.translate("Поиск")),
+            content=ft.Column([search_field, results], tight=True, spacing=10),
+            shape=ft.RoundedRectangleBorder(radius=20)
+        )
+
+        self.page.dialog = self.search_modal
+        self.search_modal.open = True
+        self.page.update()
+
     def toggle_theme(self, e):
         self.theme_mode = ft.ThemeMode.DARK if e.control.value else ft.ThemeMode.LIGHT
         self.page.theme_mode = self.theme_mode
@@ -339,7 +585,7 @@ class ChatInterface:
             return
 
         # Добавляем информацию об ответе
-        encrypted_msg = cipher(message)
+        encrypted_msg = cipher(message, compact=True)
         data = {
             "user": self.username,
             "text": encrypted_msg,
@@ -347,17 +593,14 @@ class ChatInterface:
             "reply_to": self.reply_to_message["id"] if self.reply_to_message else None
         }
 
-        logging.info(f"📤 [CLIENT] Отправка WebSocket-сообщения: {data}")
+        logging.debug("📤 [CLIENT] Отправка WebSocket-сообщения (%d символов)", len(encrypted_msg))
 
-        if self.ws:
-            try:
-                loop = asyncio.get_event_loop()
-                if loop.is_running():
-                    asyncio.create_task(self.ws.send(json.dumps(data)))  # ✅ Работает в активном event loop
-                else:
-                    asyncio.run(self.ws.send(json.dumps(data)))  # Используется только если event loop не запущен
-            except RuntimeError:
-                asyncio.run(self.ws.send(json.dumps(data)))  # Если event loop отсутствует, создаём новый
+        # Сначала в очередь: без соединения сообщение уйдёт при переподключении
+        data = self.outbox.put(data)
+        if not self.send_ws(data):
+            self.page.show_snack_bar(
+                ft.SnackBar(ft.Text(self.translate("Нет соединения: сообщение будет отправлено позже")), open=True)
+            )
 
         # 🧹 Очищаем поле ввода
         self.new_message_field.value = ""
@@ -365,12 +608,142 @@ class ChatInterface:
             self.clear_reply(None)
         self.page.update()
 
+    def send_ws(self, data):
+        """Отправка кадра из любого потока в event loop сокета; False, если соединения нет"""
+        if self.ws is None or self.loop is None:
+            return False
+        asyncio.run_coroutine_threadsafe(self.ws.send(json.dumps(data)), self.loop)
+        return True
+
+    def on_file_picked(self, e: ft.FilePickerResultEvent):
+        if not e.files:
+            return
+        attachment = self.upload_attachment(e.files[0].path)
+        if attachment:
+            self.send_ws(self.outbox.put({"user": self.username, "text": "", "attachment": attachment["id"]}))
+        else:
+            self.page.show_snack_bar(
+                ft.SnackBar(ft.Text(self.translate("Не удалось загрузить файл")), open=True)
+            )
+
+    def upload_attachment(self, path, retries=3):
+        """Загрузка файла по частям с докачкой после обрыва; возвращает данные вложения"""
+        headers = {"Authorization": f"Token {self.auth_token}"}
+        base_url = "http://127.0.0.1:8000/api/uploads/"
+        try:
+            response = requests.post(base_url, headers=headers, json={
+                "filename": os.path.basename(path),
+                "size": os.path.getsize(path),
+                "content_type": mimetypes.guess_type(path)[0] or "application/octet-stream",
+            })
+            if response.status_code != 201:
+                logging.error(f"Ошибка начала загрузки: {response.status_code}")
+                return None
+            upload = response.json()
+            upload_url = f"{base_url}{upload['id']}/"
+            offset, failures = 0, 0
+
+            with open(path, "rb") as f:
+                while True:
+                    f.seek(offset)
+                    chunk = f.read(upload["chunk_size"])
+                    try:
+                        response = requests.put(upload_url, data=chunk, headers={
+                            **headers,
+                            "Upload-Offset": str(offset),
+                            "Content-Type": "application/octet-stream",
+                        })
+                    except requests.RequestException as e:
+                        response = None
+                        logging.warning(f"Обрыв загрузки на {offset} байт: {e}")
+
+                    if response is not None and response.status_code == 201:
+                        return response.json()  # последний кусок: вложение готово
+                    if response is not None and response.status_code == 200:
+                        offset, failures = response.json()["offset"], 0
+                        continue
+
+                    failures += 1
+                    if failures > retries:
+                        return None
+                    # Сервер знает, сколько байт реально дошло - продолжаем оттуда
+                    status = requests.get(upload_url, headers=headers)
+                    if status.status_code != 200:
+                        return None
+                    offset = status.json()["offset"]
+        except Exception as e:
+            logging.error(f"Ошибка загрузки файла: {e}")
+            return None
+
+    def on_message_change(self, e):
+        """Событие "печатает": не чаще раза в TYPING_SEND_INTERVAL секунд"""
+        now = time.monotonic()
+        if self.new_message_field.value and now - self.last_typing_sent >= TYPING_SEND_INTERVAL:
+            self.last_typing_sent = now
+            self.send_ws({"type": "typing", "user": self.username})
+
+    def load_unread(self):
+        """Значок непрочитанных при запуске (сервер отвечает из кэша)"""
+        try:
+            response = requests.get(
+                "http://127.0.0.1:8000/api/unread/",
+                headers={"Authorization": f"Token {self.auth_token}"}
+            )
+            if response.status_code == 200:
+                unread = sum(room["unread"] for room in response.json()["rooms"].values())
+                if unread:
+                    label = "99+" if unread >= 100 else str(unread)
+                    self.unread_text.value = f"{self.translate('Непрочитанные')}: {label}"
+        except Exception as e:
+            logging.error(f"Ошибка загрузки непрочитанных: {e}")
+
+    def ack_read(self):
+        """Отметка "прочитано" до последнего показанного сообщения, не чаще READ_ACK_INTERVAL"""
+        last_id = max((m["id"] for m in self.messages if m.get("id")), default=0)
+        now = time.monotonic()
+        if self.ws is None or last_id <= self.last_read_acked or now - self.last_read_sent < READ_ACK_INTERVAL:
+            return  # Без сокета отметку отправит первое обновление после подключения
+        self.last_read_acked = last_id
+        self.last_read_sent = now
+        self.send_ws({"type": "read", "user": self.username, "message_id": last_id})
+        self.unread_text.value = ""
+
+    def apply_ephemeral(self, events):
+        """Применение пачки эфемерных событий одним обновлением индикатора"""
+        now = time.monotonic()
+        for event in events:
+            if event.get("type") == "typing":
+                self.typing_users[event["user"]] = now + TYPING_TTL
+            elif event.get("type") == "read":
+                self.read_markers[event["user"]] = event.get("message_id")
+        self.refresh_typing()
+
+    def refresh_typing(self):
+        """Индикатор "печатает": убирает истёкших и планирует следующую очистку"""
+        now = time.monotonic()
+        self.typing_users = {user: until for user, until in self.typing_users.items() if until > now}
+        if self.typing_users:
+            self.typing_text.value = f"{', '.join(self.typing_users)} {self.translate('печатает...')}"
+        else:
+            self.typing_text.value = ""
+        self.typing_text.update()
+
+        if self.typing_timer is not None:
+            self.typing_timer.cancel()
+            self.typing_timer = None
+        if self.typing_users and self.loop is not None:
+            # Без новых событий надпись снимется сама, когда истечёт ближайший срок
+            delay = min(self.typing_users.values()) - now
+            self.typing_timer = self.loop.call_later(delay, self.refresh_typing)
+
     def load_messages(self):
         try:
             headers = {
                 "Authorization": f"Token {self.auth_token}",
                 "Content-Type": "application/json"
             }
+            if self.changes_cursor is None:
+                self.sync_changes()  # Курсор до истории: правки после загрузки не потеряются
             response = requests.get("http://127.0.0.1:8000/api/messages/", headers=headers)
             if response.status_code == 200:
                 messages_data = response.json()
@@ -395,12 +768,17 @@ class ChatInterface:
                     self.messages.append({
                         "id": msg['id'],  # Добавляем ID сообщения
                         "user": username,
-                        "text": uncipher(msg['text'], mu=1),
+                        "text": uncipher(msg['text'], mu=1) if msg['text'] else "",
                         "created_at": created_at,
-                        "reply_to": msg.get('reply_to')  # Добавляем информацию об ответе
+                        "attachment": msg.get('attachment'),
+                        "version": msg.get('version', 1),
+                        "edited_at": msg.get('edited_at'),
+                        "reply_to": msg.get('reply_to'),  # Добавляем информацию об ответе
+                        "reply_preview": self.decode_reply_preview(msg.get('reply_preview'))
                     })
 
                 self.messages.sort(key=lambda x: x['created_at'])  # Сортировка по datetime
+                self.search_index.add_messages(self.messages)  # Уже проиндексированные пропускаются
                 self.update_chat_display()  # Обновление отображения
             else:
                 logging.error(f"Ошибка при загрузке сообщений: {response.status_code}")
@@ -423,7 +801,6 @@ class ChatInterface:
         }
 
         for msg in sorted_messages:
-            print(f"Сырые данные: {msg}")
             # Добавляем 3 часа к времени
             dt = msg["created_at"] + datetime.timedelta(hours=3)
 
@@ -455,6 +832,7 @@ class ChatInterface:
             controls.append(self.create_message_group(message_group, last_user))
 
         self.chat_messages.controls = controls
+        self.ack_read()
         self.page.update()
 
         # Прокрутка к последнему сообщению после обновления
@@ -482,11 +860,14 @@ class ChatInterface:
                             size=12,
                             color=self.primary_color if is_my_message else ft.Colors.GREY_600,
                         ),
+                        *self.reply_controls(message),
                         ft.Text(
                             message["text"],
                             size=16,
                             color=ft.Colors.WHITE if is_my_message else ft.Colors.BLACK,
+                            visible=bool(message["text"]),
                         ),
+                        *self.attachment_controls(message, is_my_message),
                         time_label  # Просто вставляем время сразу
                     ], spacing=5),
                     bgcolor=self.primary_color if is_my_message else self.secondary_color,
@@ -500,6 +881,46 @@ class ChatInterface:
 
         return message_row  # Возвращаем строку сообщения
     
+    def attachment_controls(self, message, is_my_message):
+        """Ссылка на вложение в пузыре: файл скачивается только по клику"""
+        attachment = message.get("attachment")
+        if not attachment:
+            return []
+        size_kb = max(1, attachment["size"] // 1024)
+        return [ft.TextButton(
+            f"📎 {attachment['filename']} ({size_kb} KB)",
+            style=ft.ButtonStyle(color=ft.Colors.WHITE if is_my_message else self.primary_color),
+            on_click=lambda e: self.download_attachment(attachment),
+        )]
+
+    def download_attachment(self, attachment):
+        """Скачивание потоком в DOWNLOADS_DIR; недокачанный файл продолжается через Range"""
+        os.makedirs(DOWNLOADS_DIR, exist_ok=True)
+        path = os.path.join(DOWNLOADS_DIR, os.path.basename(attachment["filename"]))
+        part = f"{path}.part"
+        offset = os.path.getsize(part) if os.path.exists(part) else 0
+        headers = {"Authorization": f"Token {self.auth_token}"}
+        if offset:
+            headers["Range"] = f"bytes={offset}-"
+        try:
+            with requests.get(
+                f"http://127.0.0.1:8000/api/attachments/{attachment['id']}/",
+                headers=headers, stream=True
+            ) as response:
+                if response.status_code not in (200, 206):
+                    logging.error(f"Ошибка скачивания: {response.status_code}")
+                    return
+                # 200 вместо 206 - сервер отдал файл целиком, начинаем заново
+                with open(part, "ab" if response.status_code == 206 else "wb") as f:
+                    for block in response.iter_content(64 * 1024):
+                        f.write(block)
+            os.replace(part, path)
+            self.page.show_snack_bar(
+                ft.SnackBar(ft.Text(f"{self.translate('Файл сохранён')}: {path}"), open=True)
+            )
+        except Exception as e:
+            logging.error(f"Ошибка скачивания: {e}")
+
     def create_message_group(self, messages, user):
         is_my_message = user == self.username
         other_bg_color = "#E8F5E9" if self.theme_mode == ft.ThemeMode.LIGHT else "#2E3440"
@@ -508,13 +929,18 @@ class ChatInterface:
         # Контекстное меню
         menu_items = []
         if is_my_message:
-            menu_items.append(
+            menu_items.extend([
+                ft.PopupMenuItem(
+                    text=self.translate("Редактировать"),
+                    icon=ft.icons.EDIT,
+                    on_click=lambda e, msg=messages[0]: self.show_edit_modal(msg)
+                ),
                 ft.PopupMenuItem(
                     text=self.translate("Удалить"),
                     icon=ft.icons.DELETE,
                     on_click=lambda e, msg=messages[0]: self.delete_message(msg)
                 )
-            )
+            ])
         menu_items.extend([
             ft.PopupMenuItem(
                 text=self.translate("Ответить"),
@@ -550,12 +976,15 @@ class ChatInterface:
         message_bubbles = ft.Column(
             [
                 ft.Container(
-                    content=ft.Text(
-                        msg["text"],
-                        color=other_text_color if not is_my_message else ft.Colors.WHITE,
-                        size=16,
-                        selectable=True
-                    ),
+                    content=ft.Column([
+                        *self.reply_controls(msg),
+                        ft.Text(
+                            msg["text"] + (f" ({self.translate('изменено')})" if msg.get("edited_at") else ""),
+                            color=other_text_color if not is_my_message else ft.Colors.WHITE,
+                            size=16,
+                            selectable=True
+                        ),
+                    ], spacing=3),
                     bgcolor=self.primary_color if is_my_message else other_bg_color,
                     border=ft.border.all(1, "#C8E6C9" if self.theme_mode == ft.ThemeMode.LIGHT else "#434C5E"),
                     padding=ft.padding.symmetric(horizontal=15, vertical=10),
@@ -620,6 +1049,45 @@ class ChatInterface:
             ft.SnackBar(ft.Text(self.translate("Сообщение скопировано в буфер")), open=True)
         )
 
+    def show_edit_modal(self, message):
+        """Правка своего сообщения"""
+        edit_field = ft.TextField(value=message["text"], autofocus=True, multiline=True, border_radius=20)
+
+        def on_save(e):
+            self.edit_modal.open = False
+            self.page.update()
+            text = edit_field.value.strip()
+            if text and text != message["text"]:
+                self.edit_message(message, text)
+
+        self.edit_modal = ft.AlertDialog(
+            title=ft.Text(self.translate("Редактировать")),
+            content=edit_field,
+            actions=[ft.TextButton(self.translate("Сохранить"), on_click=on_save)],
+            shape=ft.RoundedRectangleBorder(radius=20)
+        )
+        self.page.dialog = self.edit_modal
+        self.edit_modal.open = True
+        self.page.update()
+
+    def edit_message(self, message, text):
+        try:
+            headers = {"Authorization": f"Token {self.auth_token}"}
+            response = requests.patch(
+                f"http://127.0.0.1:8000/api/messages/{message['id']}/",
+                headers=headers,
+                json={"text": cipher(text, compact=True), "version": message.get("version", 1)}
+            )
+            if response.status_code in (200, 409):
+                # 409: сообщение уже изменено - в ответе его текущее состояние
+                self.apply_delta(response.json())
+            if response.status_code == 409:
+                self.page.show_snack_bar(
+                    ft.SnackBar(ft.Text(self.translate("Сообщение уже изменено")), open=True)
+                )
+        except Exception as e:
+            logging.error(f"Ошибка правки: {e}")
+
     def delete_message(self, message):
         try:
             headers = {"Authorization": f"Token {self.auth_token}"}
@@ -629,6 +1097,7 @@ class ChatInterface:
             )
             if response.status_code == 204:
                 self.messages = [m for m in self.messages if m.get('id') != message['id']]
+                self.search_index.remove_message(message['id'])
                 self.update_chat_display()
         except Exception as e:
             logging.error(f"Ошибка удаления: {e}")
@@ -909,29 +1378,26 @@ class AuthApp:
         self.toggle_ui_elements(True)
         time.sleep(1)  # Имитация задержки сети
 
-        if self.validate_credentials(username, password):
+        # Пароль проверяет сервер при выдаче токена (вход по имени или email)
+        credentials = self.obtain_token(username, password)
+        if credentials:
             try:
-                response = requests.post(
-                    "http://127.0.0.1:8000/api-token-auth/",
-                    data={"username": username, "password": password}
+                self.auto_login_attempted = False
+                auth_token, username = credentials
+                self.page.client_storage.set("auth_token", auth_token)
+                self.page.client_storage.set("username", username)
+                self.save_credentials(username, password)  # Перенесено сюда
+                self.page.clean()
+                ChatInterface(
+                    self.page, 
+                    username, 
+                    self.theme_mode,
+                    self.language,
+                    auth_token
                 )
-                if response.status_code == 200:
-                    self.auto_login_attempted = False
-                    auth_token = response.json()['token']
-                    self.page.client_storage.set("auth_token", auth_token)
-                    self.page.client_storage.set("username", username)
-                    self.save_credentials(username, password)  # Перенесено сюда
-                    self.page.clean()
-                    ChatInterface(
-                        self.page, 
-                        username, 
-                        self.theme_mode,
-                        self.language,
-                        auth_token
-                    )
-                    logging.info(f"Успешный вход: {username}")
+                logging.info(f"Успешный вход: {username}")
             except Exception as e:
-                logging.error(f"Ошибка получения токена: {str(e)}")
+                logging.error(f"Ошибка входа: {str(e)}")
         else:
             self.login_attempts -= 1  # Уменьшаем количество оставшихся попыток вместо увеличения
             self.last_failed_attempt = time.time()
@@ -964,6 +1430,21 @@ class AuthApp:
             },
             "en": {
                 "Global Chat": "Global Chat",
+                "Онлайн": "Online",
+                "печатает...": "is typing...",
+                "Поиск": "Search",
+                "Поиск сообщений...": "Search messages...",
+                "Ничего не найдено": "Nothing found",
+                "Прикрепить файл": "Attach file",
+                "Не удалось загрузить файл": "File upload failed",
+                "Файл сохранён": "File saved",
+                "Редактировать": "Edit",
+                "Сохранить": "Save",
+                "изменено": "edited",
+                "Сообщение удалено": "Message deleted",
+                "Непрочитанные": "Unread",
+                "Нет соединения: сообщение будет отправлено позже": "Offline: the message will be sent later",
+                "Сообщение уже изменено": "Message was already changed",
                 "Новое сообщение": "New message",
                 "Выйти": "Logout",
                 "Secure Auth": "Secure Auth",
@@ -981,36 +1462,20 @@ class AuthApp:
         }
         return translations[lang].get(text, text)
 
-    def validate_credentials(self, username, password):
-        """Проверка учетных данных."""
-        users = self.get_users()
-        for user in users:
-            if (user['username'] == username or user['email'] == username):
-                try:
-                    return django_pbkdf2_sha256.verify(password, user['password'])
-                except Exception as e:
-                    logging.error(f"Password check error: {e}")
-                    return False
-        return False
-
-    def get_users(self):
-        """Получение пользователей из API."""
+    def obtain_token(self, login, password):
+        """(токен, имя пользователя) или None при неверных учетных данных"""
         try:
-            response = requests.get("http://127.0.0.1:8000/api/users/")
+            response = requests.post(
+                "http://127.0.0.1:8000/api-token-auth/",
+                data={"username": login, "password": password}
+            )
             if response.status_code == 200:
-                users_data = json.loads(response.json()['users'])
-                return [
-                    {
-                        'username': user['fields']['username'],
-                        'email': user['fields']['email'],
-                        'password': user['fields']['password']
-                    }
-                    for user in users_data
-                ]
-            return []
+                data = response.json()
+                return data["token"], data["username"]
+            return None
         except Exception as e:
             logging.error(f"API Error: {e}")
-            return []
+            return None
 
     def toggle_ui_elements(self, loading: bool):
         """Переключение состояния UI."""
@@ -0,0 +1,72 @@
+# region imports
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+# endregion
+
+# region Очередь исходящих сообщений
+
+OUTBOX_DB_FILE = "data/outbox.sqlite3"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    seq INTEGER PRIMARY KEY,
+    client_id TEXT NOT NULL UNIQUE,
+    payload TEXT NOT NULL,
+    queued_at REAL NOT NULL
+);
+"""
+
+
+class Outbox:
+    """Постоянная очередь исходящих сообщений (SQLite).
+
+    Сообщение попадает в очередь до отправки и удаляется только после
+    подтверждения сервера (кадр ack с его client_id). Без сети или после
+    перезапуска клиента очередь уходит одним кадром batch при подключении;
+    повторная отправка безопасна: сервер отбрасывает уже сохранённые ключи.
+    """
+
+    def __init__(self, path=OUTBOX_DB_FILE):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode = WAL")
+        self.db.executescript(SCHEMA)
+
+    @staticmethod
+    def new_client_id():
+        return uuid.uuid4().hex
+
+    def put(self, data):
+        """Ставит сообщение в очередь, добавляя ключ идемпотентности; возвращает кадр"""
+        data = dict(data, client_id=data.get("client_id") or self.new_client_id())
+        with self.lock, self.db:
+            self.db.execute(
+                "INSERT OR IGNORE INTO outbox (client_id, payload, queued_at) VALUES (?, ?, ?)",
+                (data["client_id"], json.dumps(data), time.time()),
+            )
+        return data
+
+    def pending(self, limit=500, offset=0):
+        """Неподтверждённые сообщения в порядке постановки"""
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT payload FROM outbox ORDER BY seq LIMIT ? OFFSET ?", (limit, offset)
+            ).fetchall()
+        return [json.loads(payload) for (payload,) in rows]
+
+    def ack(self, client_ids):
+        with self.lock, self.db:
+            self.db.executemany("DELETE FROM outbox WHERE client_id = ?", [(cid,) for cid in client_ids])
+
+    def __len__(self):
+        with self.lock:
+            return self.db.execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+
+# endregion
@@ -0,0 +1,130 @@
+# region imports
+import hashlib
+import os
+import sqlite3
+import threading
+import datetime
+
+# endregion
+
+# region Локальный поисковый индекс
+
+SEARCH_DB_FILE = "data/search_index.sqlite3"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY,
+    key TEXT NOT NULL UNIQUE,
+    message_id INTEGER,
+    user TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    text TEXT NOT NULL
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+    text, user,
+    content='messages', content_rowid='id',
+    tokenize='unicode61 remove_diacritics 2'
+);
+CREATE TRIGGER IF NOT EXISTS messages_ai AFTER INSERT ON messages BEGIN
+    INSERT INTO messages_fts(rowid, text, user) VALUES (new.id, new.text, new.user);
+END;
+CREATE TRIGGER IF NOT EXISTS messages_ad AFTER DELETE ON messages BEGIN
+    INSERT INTO messages_fts(messages_fts, rowid, text, user) VALUES ('delete', old.id, old.text, old.user);
+END;
+"""
+
+
+class MessageSearchIndex:
+    """Полнотекстовый индекс (SQLite FTS5) по расшифрованным сообщениям.
+
+    Сервер хранит только шифротекст, поэтому индекс ведётся на клиенте:
+    сообщения добавляются по мере получения и загрузки истории, повторная
+    загрузка того же сообщения игнорируется (ключ - id или автор+время+текст).
+    """
+
+    def __init__(self, path=SEARCH_DB_FILE):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode = WAL")
+        self.db.execute("PRAGMA synchronous = NORMAL")
+        self.db.executescript(SCHEMA)
+
+    @staticmethod
+    def message_key(message):
+        if message.get("id") is not None:
+            return f"id:{message['id']}"
+        digest = hashlib.sha1(message["text"].encode("utf-8")).hexdigest()
+        return f"{message['user']}|{format_time(message.get('created_at'))}|{digest}"
+
+    def add_messages(self, messages):
+        """Добавление пачки сообщений одной транзакцией (дубликаты пропускаются)"""
+        rows = [
+            (
+                self.message_key(message),
+                message.get("id"),
+                message["user"],
+                format_time(message.get("created_at")),
+                message["text"],
+            )
+            for message in messages
+            if message.get("text")
+        ]
+        if not rows:
+            return 0
+        with self.lock, self.db:
+            cursor = self.db.executemany(
+                "INSERT OR IGNORE INTO messages (key, message_id, user, created_at, text) VALUES (?, ?, ?, ?, ?)",
+                rows,
+            )
+            return cursor.rowcount
+
+    def remove_message(self, message_id):
+        with self.lock, self.db:
+            self.db.execute("DELETE FROM messages WHERE message_id = ?", (message_id,))
+
+    def search(self, query, limit=50):
+        """Поиск по словам (последнее слово - по префиксу), лучшие совпадения первыми"""
+        match = build_match_query(query)
+        if not match:
+            return []
+        with self.lock:
+            rows = self.db.execute(
+                """
+                SELECT m.message_id, m.user, m.created_at, m.text,
+                       snippet(messages_fts, 0, '[', ']', '…', 10)
+                FROM messages_fts
+                JOIN messages m ON m.id = messages_fts.rowid
+                WHERE messages_fts MATCH ?
+                ORDER BY bm25(messages_fts), m.created_at DESC
+                LIMIT ?
+                """,
+                (match, limit),
+            ).fetchall()
+        return [
+            {"id": row[0], "user": row[1], "created_at": row[2], "text": row[3], "snippet": row[4]}
+            for row in rows
+        ]
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+
+def build_match_query(query):
+    """Пользовательский ввод -> безопасный запрос FTS5: '"слово" "префи"*'"""
+    words = [word.replace('"', '""') for word in query.split()]
+    if not words:
+        return ""
+    terms = [f'"{word}"' for word in words]
+    terms[-1] += "*"
+    return " ".join(terms)
+
+
+def format_time(value):
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    return str(value or "")
+
+# endregion
@@ -1,11 +1,21 @@
 import os
 from django.core.asgi import get_asgi_application
 from channels.routing import ProtocolTypeRouter, URLRouter
-from app.routing import websocket_urlpatterns
 
-os.environ.setdefault("DJANGO_SETTINGS_MODULE", "your_project.settings")
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "project.settings")
+
+# Django нужно инициализировать до импорта consumers (они импортируют модели)
+django_asgi_app = get_asgi_application()
+
+from django.conf import settings  # noqa: E402
+from app.authentication import TokenAuthMiddleware  # noqa: E402
+from app.routing import websocket_urlpatterns  # noqa: E402
+from app.status import status_engine  # noqa: E402
+
+if settings.STATUS_ENGINE_ENABLED:
+    status_engine.start()
 
 application = ProtocolTypeRouter({
-    "http": get_asgi_application(),
-    "websocket": URLRouter(websocket_urlpatterns),
+    "http": django_asgi_app,
+    "websocket": TokenAuthMiddleware(URLRouter(websocket_urlpatterns)),
 })
@@ -0,0 +1,87 @@
+"""
+Профили базы данных.
+
+Профиль выбирается переменной окружения DB_PROFILE:
+    sqlite   - (по умолчанию) SQLite, с WAL для своей базы, см. tune_sqlite
+    postgres - PostgreSQL, параметры подключения из POSTGRES_*
+"""
+
+import os
+
+# PRAGMA для каждого нового подключения SQLite. WAL позволяет читать во время записи,
+# synchronous=NORMAL в режиме WAL не теряет целостность, а busy_timeout заставляет
+# ждать блокировку вместо мгновенного "database is locked".
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 20000)),
+    'mmap_size': int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024)),
+    'cache_size': -64000,  # ~64 МБ
+    'temp_store': 'MEMORY',
+}
+
+# journal_mode=WAL записывается в заголовок самого файла базы, а рядом появляются
+# -wal/-shm. Лежащий в репозитории db.sqlite3 поэтому не переключаем, иначе любая
+# команда manage.py меняет отслеживаемый файл. WAL включается для своей базы
+# (SQLITE_PATH) или явно: SQLITE_WAL=1 (SQLITE_WAL=0 - выключить).
+SQLITE_WAL = os.environ.get('SQLITE_WAL', '1' if 'SQLITE_PATH' in os.environ else '0') == '1'
+
+# Время жизни постоянного подключения (секунды)
+CONN_MAX_AGE = int(os.environ.get('DB_CONN_MAX_AGE', 600))
+
+
+def sqlite_database(base_dir):
+    return {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.environ.get('SQLITE_PATH', os.path.join(base_dir, 'db.sqlite3')),
+        'CONN_MAX_AGE': CONN_MAX_AGE,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            # Таймаут ожидания блокировки на уровне драйвера (секунды)
+            'timeout': SQLITE_PRAGMAS['busy_timeout'] / 1000,
+            # Пишущая транзакция сразу берёт блокировку и не падает на upgrade read -> write
+            'transaction_mode': 'IMMEDIATE',
+        },
+    }
+
+
+def postgres_database():
+    return {
+        'ENGINE': 'django.db.backends.postgresql',
+        'NAME': os.environ.get('POSTGRES_DB', 'moremessage'),
+        'USER': os.environ.get('POSTGRES_USER', 'moremessage'),
+        'PASSWORD': os.environ.get('POSTGRES_PASSWORD', ''),
+        'HOST': os.environ.get('POSTGRES_HOST', 'localhost'),
+        'PORT': os.environ.get('POSTGRES_PORT', '5432'),
+        'CONN_MAX_AGE': CONN_MAX_AGE,
+        'CONN_HEALTH_CHECKS': True,
+    }
+
+
+DATABASE_PROFILES = {
+    'sqlite': sqlite_database,
+    'postgres': lambda base_dir: postgres_database(),
+}
+
+
+def database_config(base_dir):
+    """Настройки DATABASES['default'] для профиля из DB_PROFILE"""
+    profile = os.environ.get('DB_PROFILE', 'sqlite')
+    try:
+        return DATABASE_PROFILES[profile](base_dir)
+    except KeyError:
+        raise ValueError(f"Неизвестный профиль базы данных: {profile}") from None
+
+
+def tune_sqlite(sender, connection, **kwargs):
+    """Обработчик connection_created: применяет SQLITE_PRAGMAS к новому подключению"""
+    if connection.vendor != 'sqlite':
+        return
+    pragmas = dict(SQLITE_PRAGMAS)
+    if not SQLITE_WAL:
+        # Режим журнала файла не трогаем; synchronous=NORMAL надёжен только в WAL
+        del pragmas['journal_mode']
+        pragmas['synchronous'] = 'FULL'
+    with connection.cursor() as cursor:
+        for pragma, value in pragmas.items():
+            cursor.execute(f"PRAGMA {pragma} = {value}")
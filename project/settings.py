@@ -13,6 +13,7 @@ https://docs.djangoproject.com/en/5.1/ref/settings/
 
 from pathlib import Path
 import socket
+from .database import database_config
 
 hostname = socket.gethostname()
 ip_address = socket.gethostbyname(hostname)
@@ -23,7 +24,7 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'app.authentication.CachedTokenAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
@@ -62,11 +63,14 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'app.middleware.MetricsMiddleware',  # первым, чтобы учитывать время всех остальных
     'django.middleware.security.SecurityMiddleware',
+    'app.middleware.StaticFilesMiddleware',  # до сессий: статике они не нужны
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'app.middleware.ProfileMiddleware',  # после аутентификации: X-Profile только для staff
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -103,11 +107,9 @@ CORS_ALLOWED_ORIGINS = [
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
+# Профиль выбирается переменной DB_PROFILE (sqlite/postgres), см. project/database.py
 DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
-    }
+    'default': database_config(BASE_DIR),
 }
 
 AUTHENTICATION_BACKENDS = [
@@ -149,6 +151,15 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/5.1/howto/static-files/
 
 STATIC_URL = 'static/'
+# Сборка: python manage.py collectstatic --noinput
+# (хэш в именах и .gz/.br копии, см. app/staticfiles.py)
+STATIC_ROOT = BASE_DIR / 'staticfiles'
+STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'app.staticfiles.CompressedManifestStorage'},
+}
+# max-age для статики без хэша в имени (секунды)
+STATIC_MAX_AGE = 60
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
@@ -174,3 +185,107 @@ CHANNEL_LAYERS = {
 
 
 ASGI_APPLICATION = "project.asgi.application"
+
+# Метрики и профилирование (app/metrics.py, app/middleware.py)
+# Заголовок "X-Profile: 1" возвращает профиль запроса вместо ответа (только staff)
+PROFILE_HEADER_ENABLED = os.environ.get('PROFILE_HEADER_ENABLED') == '1'
+# Доля запросов, профили которых сохраняются в PROFILE_DIR (0 - выключено)
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+PROFILE_DIR = os.path.join(BASE_DIR, 'profiles')
+# /metrics/ доступен staff и адресам из списка (сборщик метрик)
+METRICS_ALLOWED_IPS = os.environ.get('METRICS_ALLOWED_IPS', '127.0.0.1,::1').split(',')
+
+# Логирование: записи уходят в очередь, вывод делает поток QueueListener (app/log.py)
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
+# Доля логируемых событий "получено сообщение" (ошибки логируются всегда)
+LOG_MESSAGE_SAMPLE_RATE = float(os.environ.get('LOG_MESSAGE_SAMPLE_RATE', 0.01))
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'filters': {
+        'sample_messages': {
+            '()': 'app.log.SampleFilter',
+            'rate': LOG_MESSAGE_SAMPLE_RATE,
+        },
+    },
+    'handlers': {
+        'queue': {
+            '()': 'app.log.QueueListenerHandler',
+            'filename': os.environ.get('LOG_FILE'),
+            'structured': os.environ.get('LOG_STRUCTURED', '1') == '1',
+        },
+    },
+    'root': {
+        'handlers': ['queue'],
+        'level': 'WARNING',
+    },
+    'loggers': {
+        'app': {
+            'level': LOG_LEVEL,
+        },
+        'app.consumers.messages': {
+            'filters': ['sample_messages'],
+        },
+    },
+}
+
+# Движок статуса (app/status.py): запускается в ASGI-процессе
+STATUS_ENGINE_ENABLED = os.environ.get('STATUS_ENGINE_ENABLED', '1') == '1'
+STATUS_SAMPLE_INTERVAL = 5  # секунд между снимками
+STATUS_FLUSH_SAMPLES = 12  # снимков на одну запись в Server
+STATUS_SERVER_NAME = os.environ.get('STATUS_SERVER_NAME', hostname)
+# Номер воркера на хосте (например, process_num supervisor); по умолчанию - pid
+STATUS_WORKER_ID = os.environ.get('STATUS_WORKER_ID')
+
+# Присутствие (app/presence.py)
+PRESENCE_FLUSH_INTERVAL = 1.0  # окно склейки изменений онлайн/офлайн (секунды)
+PRESENCE_HEARTBEAT = 15.0  # полный список пользователей процесса для других процессов
+# None - синхронизировать через channel layer, если он не InMemoryChannelLayer
+PRESENCE_LAYER_SYNC = None
+
+# Эфемерные события (app/ephemeral.py): не чаще одной рассылки на пользователя за интервал
+EPHEMERAL_INTERVAL = 0.5
+
+# Вложения (app/attachments.py): хранятся по SHA-256 в MEDIA_ROOT/attachments
+ATTACHMENT_ROOT = os.path.join(MEDIA_ROOT, 'attachments')
+ATTACHMENT_MAX_SIZE = 100 * 1024 * 1024  # байт
+ATTACHMENT_CHUNK_SIZE = 1024 * 1024  # размер куска для клиента; больший кусок отклоняется (413)
+ATTACHMENT_UPLOAD_TTL = 24 * 3600  # секунд до удаления незавершённой загрузки (cleanup_uploads)
+
+# Превью изображений (app/thumbnails.py, нужен Pillow)
+THUMBNAIL_SIZES = (64, 256, 1024)  # px по большей стороне
+THUMBNAIL_WORKERS = 2  # потоков построения превью
+THUMBNAIL_MAX_PENDING = 32  # вложений в очереди, остальные строятся по запросу
+
+# Кэш (app/caching.py): страницы сайта и счётчики пользователей/сообщений.
+# CACHE_DIR задаёт общий для процессов файловый кэш вместо памяти процесса
+CACHE_DIR = os.environ.get('CACHE_DIR')
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': CACHE_DIR,
+    } if CACHE_DIR else {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'moremessage',
+        'OPTIONS': {'MAX_ENTRIES': 1000},
+    },
+}
+PAGE_CACHE_TIMEOUT = 60 * 15  # страницы без счётчиков меняются только с релизом
+SITE_COUNTERS_TIMEOUT = 60  # верхняя граница расхождения счётчиков между процессами
+
+# Токены (app/authentication.py)
+TOKEN_CACHE_TTL = 60  # секунд: сколько другие процессы могут видеть удалённый токен
+TOKEN_CACHE_MAX_ENTRIES = 10000
+# Срок жизни токена в днях (пусто - бессрочно); новый выдаёт /api-token-auth/
+TOKEN_EXPIRY_DAYS = int(os.environ['TOKEN_EXPIRY_DAYS']) if os.environ.get('TOKEN_EXPIRY_DAYS') else None
+
+# Отметки о прочтении (app/receipts.py): не больше одной записи на пользователя за интервал
+READ_RECEIPT_FLUSH_INTERVAL = 5.0
+UNREAD_CACHE_TIMEOUT = 60  # верхняя граница отставания счётчика непрочитанных между процессами
+
+# Окно склейки рассылки: сообщения за это время уходят клиенту одним кадром batch (секунды)
+WS_BROADCAST_WINDOW = 0.01
+
+# WebSocket без токена (подпротокол "token, <key>" или ?token=) отклоняется до accept()
+WS_REQUIRE_AUTH = os.environ.get('WS_REQUIRE_AUTH', '1') == '1'